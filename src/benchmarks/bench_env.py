@@ -0,0 +1,15 @@
+#!/usr/bin/python3
+
+# Environment details recorded with benchmark results.
+
+import os
+import subprocess
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,213 @@
+#!/usr/bin/python3
+
+# The script to benchmark image processing hot paths on synthetic images.
+#
+# Usage:
+#   python img_processing_bench_main.py \
+#     --sizes 64,128,256 --repeats 5 \
+#     --output_json <bench_json_path> --baseline_json <previous_bench_json_path>
+
+import os, sys
+SCRIPT_DIRS = os.path.dirname(os.path.abspath(__file__)).split(os.sep)
+sys.path.append(os.path.join(os.sep, *SCRIPT_DIRS[:SCRIPT_DIRS.index('src')]))
+
+from src.benchmarks import bench_env
+from src.img_processing.augmentation import adjust_overlay
+from src.img_processing.augmentation import rotate_resize_crop
+from src.img_processing.detection.shadow import shadow_region_selection
+from src.img_processing.editing import cropping
+from src.img_processing.mask import scale_mask
+from src.img_processing.regions import region_contour
+
+import argparse
+import json
+import logging
+import pathlib
+import platform
+import statistics
+import time
+
+import numpy as np
+
+
+# Number of overlapping region masks of the overlapping benchmark.
+NUM_OVERLAPPING_MASKS = 60
+
+
+def parse_args(argv):
+    # Parse input arguments.
+    parser = argparse.ArgumentParser(description='Image Processing Benchmarks')
+    parser.add_argument('-s', '--sizes', dest='img_sizes',
+                        help='Comma-separated sides of synthetic square images.',
+                        required=False, default='64,128,256')
+    parser.add_argument('-r', '--repeats', dest='num_repeats',
+                        help='Number of timed runs of every benchmark.',
+                        required=False, type=int, default=5)
+    parser.add_argument('-k', '--benchmarks', dest='benchmark_names',
+                        help='Comma-separated names of benchmarks to run (all, if absent).',
+                        required=False, default=None)
+    parser.add_argument('-o', '--output_json', dest='output_json_path',
+                        help='Path to the benchmark results.', required=False)
+    parser.add_argument('-b', '--baseline_json', dest='baseline_json_path',
+                        help='Path to previous results to compare with.', required=False)
+    parser.add_argument('--seed', dest='seed',
+                        help='Seed of synthetic images.', required=False, type=int, default=0)
+
+    return parser.parse_args(argv[1:])
+
+
+def create_synthetic_rgba(rng, height, width, ellipse_alpha=255, background_alpha=255):
+    """Creates noisy RGBa-image with a darker ellipse in the middle.
+
+    Args:
+      rng: NumPy random generator.
+      height: Image height.
+      width: Image width.
+      ellipse_alpha: Alpha channel of ellipse pixels.
+      background_alpha: Alpha channel of the rest pixels.
+
+    Returns:
+      RGBa-array and binary mask of the ellipse.
+    """
+    rows, cols = np.ogrid[:height, :width]
+    ellipse_mask = (
+        ((rows - height / 2) / (height / 3)) ** 2 + ((cols - width / 2) / (width / 4)) ** 2 <= 1)
+
+    img_rgba = rng.integers(100, 256, size=(height, width, 4), dtype=np.uint8)
+    img_rgba[ellipse_mask, :3] //= 3
+    img_rgba[:, :, 3] = background_alpha
+    img_rgba[ellipse_mask, 3] = ellipse_alpha
+    return img_rgba, ellipse_mask
+
+
+def create_benchmarks(rng, img_size):
+    """Creates benchmarked calls for synthetic images of the given size.
+
+    Args:
+      rng: NumPy random generator.
+      img_size: Side of synthetic square images.
+
+    Returns:
+      Dictionary of benchmark names and argument-less functions.
+    """
+    img_rgba, ellipse_mask = create_synthetic_rgba(rng, img_size, img_size)
+    obj_rgba, _ = create_synthetic_rgba(rng, img_size // 2, img_size // 2, background_alpha=0)
+    tiny_obj_rgba, _ = create_synthetic_rgba(rng, 16, 16, background_alpha=0)
+
+    quarter_masks = []
+    for row_slice in (slice(0, img_size // 2), slice(img_size // 2, img_size)):
+        for col_slice in (slice(0, img_size // 2), slice(img_size // 2, img_size)):
+            quarter_mask = np.zeros(ellipse_mask.shape, dtype=bool)
+            quarter_mask[row_slice, col_slice] = True
+            quarter_masks.append(np.logical_and(quarter_mask, ~ellipse_mask))
+    region_masks = [ellipse_mask] + quarter_masks
+
+    # SAM automatic masks mostly overlap each other.
+    overlapping_masks = []
+    for _ in range(NUM_OVERLAPPING_MASKS):
+        top, left = rng.integers(0, img_size - img_size // 3, size=2)
+        overlapping_mask = np.zeros(ellipse_mask.shape, dtype=bool)
+        overlapping_mask[top:top + img_size // 3, left:left + img_size // 3] = True
+        overlapping_masks.append(overlapping_mask)
+
+    return {
+        'crop_rgba': lambda: cropping.crop_rgba(
+            img_rgba, img_size // 4, img_size // 4, img_size // 2, img_size // 2),
+        'rotate_resize_crop_rgba_img': lambda: rotate_resize_crop.rotate_resize_crop_rgba_img(
+            obj_rgba, 30, max(2, img_size // 3), 180),
+        'saliency_blend_into_largest.tiny': lambda: adjust_overlay.saliency_blend_into_largest(
+            img_rgba, tiny_obj_rgba, img_size // 2, img_size // 2, 180, tiny_img_max_side_size=20),
+        'saliency_blend_into_largest.regular': lambda: adjust_overlay.saliency_blend_into_largest(
+            img_rgba, obj_rgba, img_size // 2, img_size // 2, 180, tiny_img_max_side_size=20),
+        'scale_binary_mask': lambda: scale_mask.scale_binary_mask(
+            ellipse_mask, 32, 32, borderline_ratio_thold=0.5),
+        'get_mask_contour_len': lambda: region_contour.get_mask_contour_len(
+            img_rgba, ellipse_mask, 150, mask_extension_kernel_size=5),
+        'get_darker_then_most_of_rest': lambda: shadow_region_selection.get_darker_then_most_of_rest(
+            img_rgba, region_masks),
+        'get_darker_then_most_of_rest.overlapping': lambda: (
+            shadow_region_selection.get_darker_then_most_of_rest(img_rgba, overlapping_masks)),
+    }
+
+
+def time_benchmark(benchmark_fn, num_repeats):
+    """Runs the function once to warm up and then the given number of times.
+
+    Returns:
+      Dictionary of min, median and mean run durations in seconds.
+    """
+    benchmark_fn()
+    durations = []
+    for _ in range(num_repeats):
+        start_time = time.perf_counter()
+        benchmark_fn()
+        durations.append(time.perf_counter() - start_time)
+    return {
+        'min_s': min(durations),
+        'median_s': statistics.median(durations),
+        'mean_s': statistics.mean(durations),
+        'repeats': num_repeats,
+    }
+
+
+def compare_with_baseline(results, baseline_results):
+    """Logs median duration ratios of the same benchmarks and sizes."""
+    for benchmark_name, size_results in sorted(results.items()):
+        for img_size, timing in sorted(size_results.items(), key=lambda item: int(item[0])):
+            baseline_timing = baseline_results.get(benchmark_name, {}).get(img_size)
+            if not baseline_timing:
+                continue
+            logging.info('%s[%s]: %.3fx of baseline median (%.6fs vs %.6fs).',
+                benchmark_name, img_size, timing['median_s'] / baseline_timing['median_s'],
+                timing['median_s'], baseline_timing['median_s'])
+
+
+def main(argv):
+    parsed_args = parse_args(argv)
+    try:
+        img_sizes = [int(img_size) for img_size in parsed_args.img_sizes.split(',')]
+    except ValueError:
+        logging.error('Invalid %s image sizes.', parsed_args.img_sizes)
+        return os.EX_USAGE
+    if not img_sizes or min(img_sizes) < 16 or parsed_args.num_repeats <= 0:
+        logging.error('Image sizes must be at least 16 and repeats positive.')
+        return os.EX_USAGE
+    benchmark_names = (
+        set(parsed_args.benchmark_names.split(',')) if parsed_args.benchmark_names else None)
+
+    rng = np.random.default_rng(parsed_args.seed)
+    results = {}
+    for img_size in img_sizes:
+        for benchmark_name, benchmark_fn in create_benchmarks(rng, img_size).items():
+            if benchmark_names and benchmark_name not in benchmark_names:
+                continue
+            timing = time_benchmark(benchmark_fn, parsed_args.num_repeats)
+            results.setdefault(benchmark_name, {})[str(img_size)] = timing
+            logging.info('%s[%d]: median %.6fs, min %.6fs.',
+                benchmark_name, img_size, timing['median_s'], timing['min_s'])
+
+    if parsed_args.baseline_json_path:
+        with open(parsed_args.baseline_json_path) as baseline_file:
+            compare_with_baseline(results, json.load(baseline_file)['results'])
+
+    if parsed_args.output_json_path:
+        bench_report = {
+            'git_commit': bench_env.get_git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'seed': parsed_args.seed,
+            'results': results,
+        }
+        output_json_path = pathlib.Path(parsed_args.output_json_path)
+        output_json_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_json_path, 'w') as output_json_file:
+            json.dump(bench_report, output_json_file, indent=2, sort_keys=True)
+
+    return os.EX_OK
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    sys.exit(main(sys.argv))
@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+
+# The script to compare SegNet latency, throughput and mask accuracy in fp32, bf16 and int8.
+#
+# Usage:
+#   python segnet_precision_bench_main.py \
+#     --model segnet.pt --int8_model <export dir>/segnet.int8.pt \
+#     --val_images <dir> --val_masks <dir> --val_cache <dir> \
+#     --batch_size 8 --batches 20 --intra_op_threads 16 --output_json <bench_json_path>
+
+import os, sys
+SCRIPT_DIRS = os.path.dirname(os.path.abspath(__file__)).split(os.sep)
+sys.path.append(os.path.join(os.sep, *SCRIPT_DIRS[:SCRIPT_DIRS.index('src')]))
+
+from src.benchmarks import bench_env
+from src.machine_learning.segmentation.matrix2d import segnet_tiled_inference
+from src.machine_learning.segmentation.matrix2d.segmentation_datasets import PreDecodedSegmentationDataset
+
+import argparse
+import contextlib
+import itertools
+import json
+import logging
+import pathlib
+import platform
+import statistics
+import time
+
+import torch
+
+
+FP32 = 'fp32'
+BF16 = 'bf16'
+INT8 = 'int8'
+PRECISIONS = (FP32, BF16, INT8)
+
+
+def parse_args(argv):
+    # Parse input arguments.
+    parser = argparse.ArgumentParser(description='SegNet Precision Benchmarks')
+    parser.add_argument('--model', dest='model_path',
+                        help='SegNet state dict saved by cnn_matrix2d_train.', required=True)
+    parser.add_argument('--int8_model', dest='int8_model_path',
+                        help='Quantized TorchScript model saved by segnet_export_main.', required=False)
+    parser.add_argument('--val_images', dest='val_image_dir',
+                        help='Folder with validation images.', required=True)
+    parser.add_argument('--val_masks', dest='val_mask_dir',
+                        help='Folder with validation masks of the same file names.', required=True)
+    parser.add_argument('--val_cache', dest='val_cache_dir',
+                        help='Folder of decoded validation samples.', required=True)
+    parser.add_argument('--precisions', dest='precisions', nargs='*', choices=PRECISIONS,
+                        default=list(PRECISIONS), help='Benchmarked precisions.')
+    parser.add_argument('--batch_size', dest='batch_size',
+                        help='Number of samples in a batch.', required=False, type=int, default=8)
+    parser.add_argument('--batches', dest='num_batches',
+                        help='Number of timed validation batches.', required=False, type=int, default=20)
+    parser.add_argument('--warmup_batches', dest='num_warmup_batches',
+                        help='Number of untimed batches run first.', required=False, type=int, default=2)
+    parser.add_argument('--intra_op_threads', dest='num_intra_op_threads',
+                        help='Number of threads within CPU operators (torch default, if absent).',
+                        required=False, type=int, default=None)
+    parser.add_argument('-o', '--output_json', dest='output_json_path',
+                        help='Path to the benchmark results.', required=False)
+    return parser.parse_args(argv[1:])
+
+
+def run_model(model, images, precision):
+    autocast = (torch.autocast(device_type='cpu', dtype=torch.bfloat16)
+                if precision == BF16 else contextlib.nullcontext())
+    with torch.inference_mode(), autocast:
+        return model(images).float()
+
+
+def benchmark_precision(model, precision, batches, num_warmup_batches, reference_predictions=None):
+    """Times batches through the model and measures its mask accuracy.
+
+    Args:
+      model: Model in eval mode.
+      precision: One of PRECISIONS.
+      batches: List of (images, masks) batches loaded in advance.
+      num_warmup_batches: Number of untimed batches run first.
+      reference_predictions: Predicted classes of fp32 model per batch to compare with.
+
+    Returns:
+      Dictionary of timings and accuracies, list of predicted classes per batch.
+    """
+    for images, _ in batches[:num_warmup_batches]:
+        run_model(model, images, precision)
+
+    latencies, predictions = [], []
+    correct, agreed, total = 0, 0, 0
+    for batch_idx, (images, masks) in enumerate(batches):
+        start_time = time.perf_counter()
+        outputs = run_model(model, images, precision)
+        latencies.append(time.perf_counter() - start_time)
+
+        predicted = torch.argmax(outputs, dim=1)
+        predictions.append(predicted)
+        masks = masks.squeeze(1).long()
+        correct += (predicted == masks).sum().item()
+        total += masks.nelement()
+        if reference_predictions is not None:
+            agreed += (predicted == reference_predictions[batch_idx]).sum().item()
+
+    num_samples = sum(images.size(0) for images, _ in batches)
+    result = {
+        'median_batch_latency_s': statistics.median(latencies),
+        'min_batch_latency_s': min(latencies),
+        'samples_per_s': num_samples / sum(latencies),
+        'mask_accuracy': correct / total,
+    }
+    if reference_predictions is not None:
+        result['fp32_agreement'] = agreed / total
+    return result, predictions
+
+
+def main(argv):
+    parsed_args = parse_args(argv)
+    if INT8 in parsed_args.precisions and not parsed_args.int8_model_path:
+        logging.error('Int8 benchmark requires --int8_model.')
+        return os.EX_USAGE
+    if parsed_args.num_batches <= 0:
+        logging.error('Number of batches must be positive.')
+        return os.EX_USAGE
+    if parsed_args.num_intra_op_threads:
+        torch.set_num_threads(parsed_args.num_intra_op_threads)
+
+    val_data = PreDecodedSegmentationDataset.from_dirs(
+        image_dir=parsed_args.val_image_dir, mask_dir=parsed_args.val_mask_dir,
+        cache_dir=parsed_args.val_cache_dir)
+    val_loader = torch.utils.data.DataLoader(val_data, batch_size=parsed_args.batch_size, shuffle=False)
+    # The same batches are loaded in advance to time only the models.
+    batches = list(itertools.islice(val_loader, parsed_args.num_batches))
+
+    models = {}
+    float_model = segnet_tiled_inference.load_segnet(parsed_args.model_path)
+    for precision in parsed_args.precisions:
+        models[precision] = (
+            torch.jit.load(parsed_args.int8_model_path) if precision == INT8 else float_model)
+
+    results, reference_predictions = {}, None
+    for precision in sorted(parsed_args.precisions, key=PRECISIONS.index):
+        results[precision], predictions = benchmark_precision(
+            models[precision].eval(), precision, batches,
+            parsed_args.num_warmup_batches, reference_predictions)
+        if precision == FP32:
+            reference_predictions = predictions
+        logging.info('%s: median batch %.4fs, %.1f samples/s, mask accuracy %.4f.', precision,
+                     results[precision]['median_batch_latency_s'],
+                     results[precision]['samples_per_s'], results[precision]['mask_accuracy'])
+
+    if parsed_args.output_json_path:
+        bench_report = {
+            'git_commit': bench_env.get_git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'machine': platform.machine(),
+            'num_threads': torch.get_num_threads(),
+            'batch_size': parsed_args.batch_size,
+            'num_batches': len(batches),
+            'results': results,
+        }
+        output_json_path = pathlib.Path(parsed_args.output_json_path)
+        output_json_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_json_path, 'w') as output_json_file:
+            json.dump(bench_report, output_json_file, indent=2, sort_keys=True)
+
+    return os.EX_OK
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    sys.exit(main(sys.argv))
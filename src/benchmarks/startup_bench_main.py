@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+
+# The script to benchmark startup (import) time of small_detect subcommands.
+#
+# Usage:
+#   python startup_bench_main.py \
+#     --subcommands tile,rotate,detect-shadow --repeats 5 \
+#     --output_json <bench_json_path> --baseline_json <previous_bench_json_path>
+#
+# Every run is a fresh interpreter printing the subcommand help, so its time
+# is the cost of imports. The slowest top-level imports are taken from
+# python -X importtime of the last run.
+
+import os, sys
+SCRIPT_DIRS = os.path.dirname(os.path.abspath(__file__)).split(os.sep)
+sys.path.append(os.path.join(os.sep, *SCRIPT_DIRS[:SCRIPT_DIRS.index('src')]))
+
+from src import small_detect
+from src.benchmarks import bench_env
+
+import argparse
+import json
+import logging
+import pathlib
+import platform
+import statistics
+import subprocess
+import time
+
+
+SMALL_DETECT_PATH = pathlib.Path(small_detect.__file__).resolve()
+
+
+def parse_args(argv):
+    # Parse input arguments.
+    parser = argparse.ArgumentParser(description='Startup Benchmarks')
+    parser.add_argument('-k', '--subcommands', dest='subcommand_names',
+                        help='Comma-separated subcommands to benchmark (all, if absent).',
+                        required=False, default=None)
+    parser.add_argument('-r', '--repeats', dest='num_repeats',
+                        help='Number of timed runs of every subcommand.',
+                        required=False, type=int, default=5)
+    parser.add_argument('--top_imports', dest='num_top_imports',
+                        help='Number of the slowest top-level imports to report.',
+                        required=False, type=int, default=5)
+    parser.add_argument('-o', '--output_json', dest='output_json_path',
+                        help='Path to the benchmark results.', required=False)
+    parser.add_argument('-b', '--baseline_json', dest='baseline_json_path',
+                        help='Path to previous results to compare with.', required=False)
+
+    return parser.parse_args(argv[1:])
+
+
+def parse_import_times(importtime_stderr):
+    """Parses cumulative microseconds of top-level packages from -X importtime output."""
+    import_times = {}
+    for line in importtime_stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, module_name = line[len('import time:'):].split('|')
+        # Nested imports are indented below their importer.
+        if module_name.startswith(' ') and not module_name.startswith('  '):
+            import_times[module_name.strip()] = int(cumulative_us)
+    return import_times
+
+
+def time_subcommand_startup(subcommand_name, num_repeats, num_top_imports):
+    """Runs the subcommand help in fresh interpreters once to warm up file caches and then timed.
+
+    Returns:
+      Dictionary of min, median and mean run durations in seconds and the slowest
+      top-level imports or error of a subcommand failing to start.
+    """
+    command = [sys.executable, '-X', 'importtime', str(SMALL_DETECT_PATH), subcommand_name, '--help']
+    durations = []
+    for repeat_idx in range(num_repeats + 1):
+        start_time = time.perf_counter()
+        completed_process = subprocess.run(command, capture_output=True, text=True)
+        duration = time.perf_counter() - start_time
+        if completed_process.returncode != 0:
+            return {'error': completed_process.stderr.strip().splitlines()[-1:]}
+        if repeat_idx:
+            durations.append(duration)
+
+    import_times = parse_import_times(completed_process.stderr)
+    return {
+        'min_s': min(durations),
+        'median_s': statistics.median(durations),
+        'mean_s': statistics.mean(durations),
+        'repeats': num_repeats,
+        'top_imports_s': {
+            module_name: cumulative_us / 1e6 for module_name, cumulative_us in sorted(
+                import_times.items(), key=lambda item: item[1], reverse=True)[:num_top_imports]},
+    }
+
+
+def compare_with_baseline(results, baseline_results):
+    """Logs median startup ratios of the same subcommands."""
+    for subcommand_name, timing in sorted(results.items()):
+        baseline_timing = baseline_results.get(subcommand_name)
+        if 'error' in timing or not baseline_timing or 'error' in baseline_timing:
+            continue
+        logging.info('%s: %.3fx of baseline median (%.3fs vs %.3fs).',
+            subcommand_name, timing['median_s'] / baseline_timing['median_s'],
+            timing['median_s'], baseline_timing['median_s'])
+
+
+def main(argv):
+    parsed_args = parse_args(argv)
+    all_subcommand_names = [subcommand_name for subcommand_name, _, _ in small_detect.SUBCOMMANDS]
+    subcommand_names = (
+        parsed_args.subcommand_names.split(',') if parsed_args.subcommand_names
+        else all_subcommand_names)
+    unknown_subcommand_names = set(subcommand_names) - set(all_subcommand_names)
+    if unknown_subcommand_names:
+        logging.error('Unknown %s subcommands.', ', '.join(sorted(unknown_subcommand_names)))
+        return os.EX_USAGE
+    if parsed_args.num_repeats <= 0:
+        logging.error('Repeats must be positive.')
+        return os.EX_USAGE
+
+    results = {}
+    for subcommand_name in subcommand_names:
+        timing = time_subcommand_startup(
+            subcommand_name, parsed_args.num_repeats, parsed_args.num_top_imports)
+        results[subcommand_name] = timing
+        if 'error' in timing:
+            logging.warning('%s fails to start: %s', subcommand_name, ' '.join(timing['error']))
+            continue
+        logging.info('%s: median %.3fs, min %.3fs, slowest imports %s.',
+            subcommand_name, timing['median_s'], timing['min_s'], ', '.join(
+                f'{module_name} {import_s:.3f}s'
+                for module_name, import_s in timing['top_imports_s'].items()))
+
+    if parsed_args.baseline_json_path:
+        with open(parsed_args.baseline_json_path) as baseline_file:
+            compare_with_baseline(results, json.load(baseline_file)['results'])
+    if parsed_args.output_json_path:
+        bench_report = {
+            'git_commit': bench_env.get_git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'results': results,
+        }
+        output_json_path = pathlib.Path(parsed_args.output_json_path)
+        output_json_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_json_path, 'w') as output_json_file:
+            json.dump(bench_report, output_json_file, indent=2, sort_keys=True)
+    return os.EX_OK
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    sys.exit(main(sys.argv))
@@ -5,6 +5,7 @@
 from src.img_processing.base import image_pool
 
 import logging
+import math
 
 import numpy as np
 import skimage.transform
@@ -15,6 +16,33 @@ class ImageMagicProps:
         '1000x0.000002+100')  # Max-IterationsXDistortion+<Print-Iterations>
 
 
+def _fit_into_larger(larger_shape, smaller_rgba, center_row_in_larger, center_col_in_larger):
+    """Crops parts of the smaller image outside the larger one.
+
+    Returns:
+      Top-left row and column of the cropped smaller image in the larger one and
+      the cropped image or None, if the smaller image is outside the larger one.
+    """
+    top_left_row_in_larger = center_row_in_larger - smaller_rgba.shape[0] // 2
+    top_left_col_in_larger = center_col_in_larger - smaller_rgba.shape[1] // 2
+
+    if (top_left_row_in_larger > larger_shape[0] or
+            top_left_col_in_larger > larger_shape[1]):
+        return None
+
+    if top_left_row_in_larger < 0:
+        smaller_rgba = smaller_rgba[-top_left_row_in_larger:, :, :]
+        top_left_row_in_larger = 0
+    if top_left_col_in_larger < 0:
+        smaller_rgba = smaller_rgba[:, -top_left_col_in_larger:, :]
+        top_left_col_in_larger = 0
+
+    smaller_rgba = smaller_rgba[
+        :min(smaller_rgba.shape[0], larger_shape[0] - top_left_row_in_larger),
+        :min(smaller_rgba.shape[1], larger_shape[1] - top_left_col_in_larger), :]
+    return top_left_row_in_larger, top_left_col_in_larger, smaller_rgba
+
+
 def saliency_blend_into_largest(
     larger_rgba, smaller_rgba, center_row_in_larger, center_col_in_larger,
     smaller_alpha_mask_thold=None, tiny_img_max_side_size=20):
@@ -38,24 +66,12 @@ def saliency_blend_into_largest(
         smaller_rgba_height = smaller_rgba.shape[0]
         smaller_min_size = min(smaller_rgba_width, smaller_rgba_height)
 
-        top_left_row_in_larger = center_row_in_larger - smaller_rgba_height // 2
-        top_left_col_in_larger = center_col_in_larger - smaller_rgba_width // 2
-
-        if (top_left_row_in_larger > larger_rgba.shape[1] or
-                top_left_col_in_larger > larger_rgba.shape[1]):
+        fit_smaller = _fit_into_larger(
+            larger_rgba.shape, smaller_rgba, center_row_in_larger, center_col_in_larger)
+        if not fit_smaller:
             logging.warning('Image inserted outside the larger one.')
             return larger_rgba
-
-        if top_left_row_in_larger < 0:
-            smaller_rgba = smaller_rgba[-top_left_row_in_larger:, :, :]
-            top_left_row_in_larger = 0
-        if top_left_col_in_larger < 0:
-            smaller_rgba = smaller_rgba[:, -top_left_col_in_larger:, :]
-            top_left_col_in_larger = 0
-
-        smaller_rgba = smaller_rgba[
-            :min(smaller_rgba.shape[0], larger_rgba.shape[0] - top_left_row_in_larger),
-            :min(smaller_rgba.shape[1], larger_rgba.shape[1] - top_left_col_in_larger), :]
+        top_left_row_in_larger, top_left_col_in_larger, smaller_rgba = fit_smaller
 
         fit_smaller_rgba = np.zeros(larger_rgba.shape, dtype=np.uint8)
         fit_smaller_rgba[
@@ -97,3 +113,87 @@ def saliency_blend_into_largest(
             binary_mask = np.array(binary_mask).astype(np.uint8) * 255
 
         return np.array(target_img), fit_smaller_rgba, binary_mask
+
+
+def saliency_blend_all_into_largest(
+    larger_rgba, smaller_rgbas, center_rows_in_larger, center_cols_in_larger,
+    smaller_alpha_mask_thold=None, tiny_img_max_side_size=20):
+    """Blends several smaller images into the larger one in one ImageMagick pass.
+
+    Every smaller image is prepared as saliency_blend_into_largest does (alpha
+    eroded proportionally to its size or transparent pixels colored with its
+    center color, if it is tiny) and then all of them are blended at once.
+
+    Args:
+      larger_rgba: Larger image to fit in.
+      smaller_rgbas: Smaller images to overlay (their boxes must not overlap).
+      center_rows_in_larger: Row-offsets of the smaller image centers in the largest one.
+      center_cols_in_larger: Column-offsets of the smaller image centers in the largest one.
+      smaller_alpha_mask_thold: Alpha channel threshold [0..255] to create a mask of
+                                the smaller images outlining them in the bigger one (optional).
+      tiny_img_max_side_size: Threshold to distinguish too small images.
+
+    Returns:
+      Overlaid RGBa-array, smaller images positioned
+      in the bigger one before overlay and their combined binary mask.
+    """
+    with image_pool.ImagePool() as img_pool:
+        fit_smaller_rgba = np.zeros(larger_rgba.shape, dtype=np.uint8)
+        blended_smaller_rgba = np.zeros(larger_rgba.shape, dtype=np.uint8)
+        for smaller_rgba, center_row_in_larger, center_col_in_larger in zip(
+                smaller_rgbas, center_rows_in_larger, center_cols_in_larger):
+            smaller_min_size = min(smaller_rgba.shape[0], smaller_rgba.shape[1])
+            fit_smaller = _fit_into_larger(
+                larger_rgba.shape, smaller_rgba, center_row_in_larger, center_col_in_larger)
+            if not fit_smaller:
+                logging.warning('Image inserted outside the larger one.')
+                continue
+            top, left, smaller_rgba = fit_smaller
+            bottom, right = top + smaller_rgba.shape[0], left + smaller_rgba.shape[1]
+            fit_smaller_rgba[top:bottom, left:right, :] = smaller_rgba
+
+            # Erosion and background colors reach beyond the image box by the margin.
+            margin = max(1, math.ceil(smaller_min_size / 10.0) + 1)
+            margin_top, margin_left = max(0, top - margin), max(0, left - margin)
+            margin_bottom = min(larger_rgba.shape[0], bottom + margin)
+            margin_right = min(larger_rgba.shape[1], right + margin)
+            margin_rgba = np.zeros(
+                (margin_bottom - margin_top, margin_right - margin_left, 4), dtype=np.uint8)
+            margin_rgba[
+                top - margin_top:bottom - margin_top, left - margin_left:right - margin_left,
+                :] = smaller_rgba
+
+            if smaller_min_size > tiny_img_max_side_size:
+                disk_kernel = round(smaller_min_size / 10.0, 1)
+                margin_img = img_pool.imagick_from_rgba(margin_rgba)
+                margin_img.morphology(method='erode', kernel=f'disk:{disk_kernel}', channel='alpha')
+                margin_rgba[:, :, 3] = np.array(margin_img)[:, :, 3]
+                blended_smaller_rgba[top:bottom, left:right, :] = margin_rgba[
+                    top - margin_top:bottom - margin_top, left - margin_left:right - margin_left, :]
+            else:
+                # The same as dst_over composition with the center color background
+                # keeping alpha (see saliency_blend_into_largest).
+                smaller_rgba_to_one_pixel = skimage.transform.resize(
+                    smaller_rgba, (1, 1), order=1, mode='constant', anti_aliasing=False,
+                    preserve_range=True).astype(np.uint8)[0, 0]
+                margin_alpha = margin_rgba[:, :, 3:].astype(np.uint16)
+                margin_rgba[:, :, :3] = (
+                    (margin_rgba[:, :, :3] * margin_alpha +
+                     smaller_rgba_to_one_pixel[:3] * (255 - margin_alpha) + 127) // 255)
+                blended_margin_rgba = blended_smaller_rgba[
+                    margin_top:margin_bottom, margin_left:margin_right, :]
+                background = blended_margin_rgba[:, :, 3] == 0
+                blended_margin_rgba[background] = margin_rgba[background]
+
+        src_img = img_pool.imagick_from_rgba(blended_smaller_rgba)
+        target_img = img_pool.imagick_from_rgba(larger_rgba)
+        target_img.composite(
+            src_img, operator='saliency_blend',
+            arguments=ImageMagicProps.SEAMLESS_SALIENCY_BLEND_AGS)
+
+        binary_mask = None
+        if smaller_alpha_mask_thold is not None:
+            binary_mask = fit_smaller_rgba[:, :, 3] >= smaller_alpha_mask_thold
+            binary_mask = np.array(binary_mask).astype(np.uint8) * 255
+
+        return np.array(target_img), fit_smaller_rgba, binary_mask
@@ -8,7 +8,9 @@
 #     --output_img <output_img_path> --insert_mask <binary_mask_path> \
 #     --center_row 50 --center_column 50 --alpha_threshold 215
 
-from src.img_processing.augmentation import adjust_overlay
+from src.img_processing.io import imgwrite
+from src.img_processing.io import mask_io
+from src.img_processing.io import rgba_read
 
 import argparse
 import logging
@@ -16,13 +18,6 @@ import os
 import pathlib
 import sys
 
-import numpy as np
-import skimage
-import skimage.color
-import skimage.io
-import skimage.transform
-import skimage.util
-
 
 def parse_args(argv):
     # Parse input arguments.
@@ -34,7 +29,8 @@ def parse_args(argv):
     parser.add_argument('-o', '--output_img', dest='output_img_path',
         help='Path to the overlaid image.', required=True)
     parser.add_argument('-m', '--insert_mask', dest='insert_mask_path',
-        help='Optional path to the inserted image mask.', required=False)
+        help='Optional path to the inserted image mask (1-bit PNG or bit-packed *.bmask).',
+        required=False)
 
     parser.add_argument('-t', '--alpha_threshold', dest='alpha_mask_threshold',
         help='Transparency threshold [0..255] for mask.', required=False,
@@ -50,6 +46,8 @@ def parse_args(argv):
 
 def main(argv):
     parsed_args = parse_args(argv)
+    from src.img_processing.augmentation import adjust_overlay
+
     img_path_to_fit_into = pathlib.Path(parsed_args.img_path_to_fit_into)
     inserted_img_path = pathlib.Path(parsed_args.inserted_img_path)
     output_img_path = pathlib.Path(parsed_args.output_img_path)
@@ -58,14 +56,10 @@ def main(argv):
         if parsed_args.insert_mask_path is not None else None)
 
     # Read image arrays.
-    img_rgba_to_fit_into = skimage.io.imread(str(img_path_to_fit_into))
+    img_rgba_to_fit_into = rgba_read.read_rgba(img_path_to_fit_into)
     width_of_img_to_fit = img_rgba_to_fit_into.shape[1]
     height_of_img_to_fit = img_rgba_to_fit_into.shape[0]
-    if img_rgba_to_fit_into.shape[-1] == 3:
-        img_rgba_to_fit_into = np.insert(img_rgba_to_fit_into, 3, 255, axis=2)
-    inserted_img_rgba = skimage.io.imread(str(inserted_img_path))
-    if inserted_img_rgba.shape[-1] == 3:
-        inserted_img_rgba = np.insert(inserted_img_rgba, 3, 255, axis=2)
+    inserted_img_rgba = rgba_read.read_rgba(inserted_img_path)
 
     center_row_of_overlay = parsed_args.center_row_of_overlay
     center_column_of_overlay = parsed_args.center_column_of_overlay
@@ -76,15 +70,14 @@ def main(argv):
         logging.error(f'Wrong {height_of_img_to_fit} column offset.')
         return os.EX_NOINPUT
 
-    overlaid_img_rgba, binary_mask = adjust_overlay.saliency_blend_into_largest(
+    overlaid_img_rgba, _, binary_mask = adjust_overlay.saliency_blend_into_largest(
         img_rgba_to_fit_into, inserted_img_rgba,
         center_row_of_overlay, center_column_of_overlay,
         alpha_mask_threshold)
-    skimage.io.imsave(str(output_img_path), overlaid_img_rgba)
+    imgwrite.write_image(output_img_path, overlaid_img_rgba, file_format=None)
 
     if parsed_args.insert_mask_path is not None:
-        skimage.io.imsave(str(parsed_args.insert_mask_path),
-            skimage.img_as_uint(binary_mask))
+        mask_io.write_mask(parsed_args.insert_mask_path, binary_mask)
 
     return os.EX_OK
 
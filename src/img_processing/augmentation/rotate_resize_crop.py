@@ -7,6 +7,26 @@ from src.img_processing.base import image_pool
 import numpy as np
 
 
+def alpha_trim_rgba(img_rgba, alpha_channel_threshold):
+    """Crops transparent rows and columns around the visible pixels.
+
+    Args:
+      img_rgba: Source image RGBa-array.
+      alpha_channel_threshold: Threshold to filter out transparent pixels [0..255].
+
+    Returns:
+      View of the smallest RGBa-array part holding all the visible pixels
+      (the whole array, if there are no visible pixels).
+    """
+    visible_pixels = img_rgba[:, :, 3] >= alpha_channel_threshold
+    visible_rows = np.flatnonzero(np.any(visible_pixels, axis=1))
+    visible_cols = np.flatnonzero(np.any(visible_pixels, axis=0))
+    if not len(visible_rows):
+        return img_rgba
+    return img_rgba[
+        visible_rows[0]:visible_rows[-1] + 1, visible_cols[0]:visible_cols[-1] + 1, :]
+
+
 def rotate_resize_crop_rgba_img(
     img_rgba, angle_in_degrees, scaled_width_in_pixels,
     alpha_channel_threshold):
@@ -7,7 +7,8 @@
 #     --degrees 30 --width 40 --alpha_threshold 215 \
 #     --input_img <input_img_path> --output_dir <input_dir_path>
 
-from src.img_processing.augmentation import rotate_resize_crop
+from src.img_processing.io import imgwrite
+from src.img_processing.io import rgba_read
 
 import argparse
 import logging
@@ -15,12 +16,6 @@ import os
 import pathlib
 import sys
 
-import numpy as np
-import skimage.color
-import skimage.io
-import skimage.transform
-import skimage.util
-
 
 def parse_args(argv):
     # Parse input arguments.
@@ -41,6 +36,8 @@ def parse_args(argv):
 
 def main(argv):
     parses_args = parse_args(argv)
+    from src.img_processing.augmentation import rotate_resize_crop
+
     angle_in_degrees = parses_args.angle_in_degrees
     scaled_width_in_pixels = parses_args.width_in_pixels
     alpha_channel_threshold = (
@@ -53,9 +50,7 @@ def main(argv):
         logging.error(f'{input_img_path} or {output_dir_path} is wrong.')
         return os.EX_NOINPUT
 
-    img_rgba = skimage.io.imread(str(input_img_path))
-    if img_rgba.shape[-1] == 3:
-        img_rgba = np.insert(img_rgba, 3, 255, axis=2)
+    img_rgba = rgba_read.read_rgba(input_img_path)
 
     output_rgba = rotate_resize_crop.rotate_resize_crop_rgba_img(
         img_rgba, angle_in_degrees, scaled_width_in_pixels,
@@ -65,7 +60,7 @@ def main(argv):
 
     output_img_path = output_dir_path.joinpath(
         input_img_path.stem + output_img_suffix + input_img_path.suffix)
-    skimage.io.imsave(str(output_img_path), output_rgba)
+    imgwrite.write_image(output_img_path, output_rgba, file_format=None)
 
     return os.EX_OK
 
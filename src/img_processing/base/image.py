@@ -1,9 +1,10 @@
 #!/usr/bin/python3
 
-import numpy as np
+from src.img_processing.base import memory_budget
+from src.img_processing.io import rgba_read
+
 import os
 import pathlib
-import skimage.io
 
 
 class ImageFile:
@@ -28,9 +29,7 @@ class ImageFile:
 
     def load(self):
         try:
-            img = RawImage(path=self.path, rgba=skimage.io.imread(str(self.path)))
-            img.add_alpha_if_absent()
-            return img
+            return RawImage(path=self.path, rgba=rgba_read.read_rgba(self.path))
         except ValueError:
             return None
 
@@ -40,6 +39,7 @@ class RawImage:
 
     def __init__(self, path='', rgba=None):
         self.path = path
+        self._rgba = None
         self.rgba = rgba
 
     def __repr__(self):
@@ -49,16 +49,36 @@ class RawImage:
         return self
 
     def __exit__(self, *args):
-        if self.rgba:
-            self.rgba.resize(0, 0, refcheck=False)
+        self.release()
+
+    def __del__(self):
+        self.release()
+
+    @property
+    def rgba(self):
+        return self._rgba
+
+    @rgba.setter
+    def rgba(self, rgba):
+        memory_accountant = memory_budget.get_memory_accountant()
+        if self._rgba is not None:
+            memory_accountant.release(memory_budget.MemoryAccountant.RAW_IMAGES, self._rgba.nbytes)
+        self._rgba = rgba
+        if rgba is not None:
+            memory_accountant.track(memory_budget.MemoryAccountant.RAW_IMAGES, rgba.nbytes)
+
+    def release(self):
+        """Drops the pixels (views of them, e.g. cropped tiles, stay valid)."""
+        if getattr(self, '_rgba', None) is not None:
+            self.rgba = None
 
     @property
     def shape(self):
         return self.rgba.shape if self.rgba is not None else (0, 0)
 
     def add_alpha_if_absent(self):
-        if 2 < len(self.rgba.shape) and self.rgba.shape[-1] == 3:
-            self.rgba = np.insert(self.rgba, 3, 255, axis=2)
+        if self.rgba.ndim != 3 or self.rgba.shape[-1] != 4 or self.rgba.dtype != 'uint8':
+            self.rgba = rgba_read.to_rgba(self.rgba)
 
     def clear_half_transparent_pixels(self, alpha_channel_threshold):
         transparent_pixels = self.rgba[:, :, 3] < alpha_channel_threshold
@@ -1,7 +1,15 @@
 #!/usr/bin/python3
 
+from src.img_processing.base import memory_budget
+
 import numpy as np
 import wand.image
+import wand.version
+
+
+def get_imagick_nbytes(imagick_img):
+    """Estimates pixel cache size of RGBa ImageMagick image."""
+    return imagick_img.width * imagick_img.height * 4 * max(1, wand.version.QUANTUM_DEPTH // 8)
 
 
 class ImagePool:
@@ -9,21 +17,26 @@ class ImagePool:
 
     def __init__(self):
         self.created_imagick_images = []
+        self.tracked_nbytes = 0
 
-    def imagick_from_rgba(self, rgba):
-        imagick_img = wand.image.Image.from_array(rgba, channel_map='RGBA')
+    def _add_imagick(self, imagick_img):
+        imagick_nbytes = get_imagick_nbytes(imagick_img)
+        memory_budget.get_memory_accountant().track(
+            memory_budget.MemoryAccountant.IMAGICK_IMAGES, imagick_nbytes)
+        self.tracked_nbytes += imagick_nbytes
         self.created_imagick_images.append(imagick_img)
         return imagick_img
 
+    def imagick_from_rgba(self, rgba):
+        return self._add_imagick(wand.image.Image.from_array(rgba, channel_map='RGBA'))
+
     def imagick_from_color_and_shape(self, one_pixel_rgba, shape):
         return self.imagick_from_rgba(np.tile(
             np.array(one_pixel_rgba, dtype='uint8'),
             (shape[0], shape[1], 1)))  # see http://www.github.com/emcconville/wand/discussions/631
 
     def clone_imagick(self, imagick_img):
-        cloned_img = imagick_img.clone()
-        self.created_imagick_images.append(cloned_img)
-        return cloned_img
+        return self._add_imagick(imagick_img.clone())
 
     def __enter__(self):
         return self
@@ -31,3 +44,7 @@ class ImagePool:
     def __exit__(self, *args):
         for imagick_img in self.created_imagick_images:
             imagick_img.close()
+        self.created_imagick_images = []
+        memory_budget.get_memory_accountant().release(
+            memory_budget.MemoryAccountant.IMAGICK_IMAGES, self.tracked_nbytes)
+        self.tracked_nbytes = 0
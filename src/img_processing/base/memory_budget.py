@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+
+# Process-wide accounting of memory held by images and masks.
+
+import contextlib
+import os
+import resource
+import sys
+import threading
+
+
+def get_current_rss_bytes():
+    """Gets resident set size of the process (peak one, if current is unknown)."""
+    try:
+        with open('/proc/self/statm') as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return get_peak_rss_bytes()
+
+
+def get_peak_rss_bytes():
+    """Gets peak resident set size of the process."""
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+class MemoryAccountant:
+    """Tracks bytes held per category and throttles acquisitions over budget."""
+
+    RAW_IMAGES = 'raw_images'
+    IMAGICK_IMAGES = 'imagick_images'
+    MASKS = 'masks'
+    WRITE_QUEUE = 'write_queue'
+    CACHES = 'caches'
+
+    def __init__(self, budget_bytes=None):
+        self.budget_bytes = budget_bytes
+        self.condition = threading.Condition()
+        self.held_bytes = {}
+        self.total_held_bytes = 0
+        self.peak_held_bytes = 0
+
+    def set_budget(self, budget_bytes):
+        with self.condition:
+            self.budget_bytes = budget_bytes
+            self.condition.notify_all()
+
+    def track(self, category, nbytes):
+        """Accounts bytes held in the category without waiting."""
+        with self.condition:
+            self.held_bytes[category] = self.held_bytes.get(category, 0) + nbytes
+            self.total_held_bytes += nbytes
+            self.peak_held_bytes = max(self.peak_held_bytes, self.total_held_bytes)
+
+    def release(self, category, nbytes):
+        with self.condition:
+            self.held_bytes[category] = self.held_bytes.get(category, 0) - nbytes
+            self.total_held_bytes -= nbytes
+            self.condition.notify_all()
+
+    def acquire(self, category, nbytes, timeout=None):
+        """Waits until the bytes fit the budget and accounts them.
+
+        Waits only while the category itself holds bytes to be released,
+        so a single acquisition larger than the budget still passes.
+
+        Args:
+          category: Category of throttled component (e.g. write queue).
+          nbytes: Number of bytes to hold.
+          timeout: Max number of seconds to wait (unlimited, if None).
+
+        Returns:
+          True, if the bytes fit the budget before the timeout.
+        """
+        with self.condition:
+            fit_budget = self.condition.wait_for(
+                lambda: (not self.budget_bytes or not self.held_bytes.get(category, 0) or
+                         self.total_held_bytes + nbytes <= self.budget_bytes),
+                timeout=timeout)
+            self.track(category, nbytes)
+            return fit_budget
+
+    def wait_for_budget(self, nbytes, released_categories=(WRITE_QUEUE,), timeout=None):
+        """Waits until the bytes to be allocated fit the budget without accounting them.
+
+        Waits only while the categories released by other threads (e.g. write
+        queue) hold bytes, so bytes held by the caller never block it.
+
+        Args:
+          nbytes: Number of bytes to allocate (e.g. decoded image).
+          released_categories: Categories released by other threads.
+          timeout: Max number of seconds to wait (unlimited, if None).
+
+        Returns:
+          True, if the bytes fit the budget before the timeout.
+        """
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: (not self.budget_bytes or
+                         self.total_held_bytes + nbytes <= self.budget_bytes or
+                         not any(self.held_bytes.get(category, 0) for category in released_categories)),
+                timeout=timeout)
+
+    def is_over_budget(self, extra_bytes=0):
+        with self.condition:
+            return bool(self.budget_bytes) and (
+                self.total_held_bytes + extra_bytes > self.budget_bytes)
+
+    @contextlib.contextmanager
+    def holding(self, category, nbytes):
+        """Accounts bytes held within the context."""
+        self.track(category, nbytes)
+        try:
+            yield
+        finally:
+            self.release(category, nbytes)
+
+    def report(self):
+        with self.condition:
+            held_bytes = dict(self.held_bytes)
+            total_held_bytes, peak_held_bytes = self.total_held_bytes, self.peak_held_bytes
+        return {
+            'held_bytes': held_bytes,
+            'total_held_bytes': total_held_bytes,
+            'peak_held_bytes': peak_held_bytes,
+            'budget_bytes': self.budget_bytes,
+            'rss_bytes': get_current_rss_bytes(),
+            'peak_rss_bytes': get_peak_rss_bytes(),
+        }
+
+    def publish(self, metrics):
+        """Sets memory gauges of the stage metrics registry."""
+        if not metrics.enabled:
+            return
+        memory_report = self.report()
+        for category, held_bytes in memory_report['held_bytes'].items():
+            metrics.set_gauge(f'memory_{category}_bytes', held_bytes)
+        for gauge_name in ('total_held_bytes', 'peak_held_bytes', 'rss_bytes', 'peak_rss_bytes'):
+            metrics.set_gauge(f'memory_{gauge_name}', memory_report[gauge_name])
+
+
+_memory_accountant = MemoryAccountant()
+
+
+def get_memory_accountant():
+    """Gets process-wide memory accountant."""
+    return _memory_accountant
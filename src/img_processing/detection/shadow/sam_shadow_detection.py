@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+
+# Shadow detection among SAM regions darker than most of the rest image.
+
+from src.img_processing.detection.shadow import shadow_detection_protocol
+from src.img_processing.detection.shadow import shadow_region_selection
+from src.img_processing.regions import region_contour
+from src.machine_learning.segmentation.sam import sam_mask_gen_config
+from src.monitoring import stage_metrics
+
+import numpy as np
+
+
+MASK_FILE_EXT = shadow_detection_protocol.MASK_FILE_EXT
+
+CONTOUR_MASK_EXTENSION_KERNEL_SIZE = 5
+
+
+class SamShadowDetectionConfig:
+    def __init__(self):
+        self.sam_config = sam_mask_gen_config.SamAutoMaskGeneratorConfig()
+        self.sam_config.pred_iou_thresh = 0.8
+        self.sam_config.stability_score_thresh = 0.7
+        self.sam_config.box_nms_thresh = 0.7
+        self.sam_config.min_mask_region_area = 30
+
+        self.total_brightest_area_min_share = 0.5
+        self.target_area_max_quantile = 0.7
+        self.other_area_min_quantile = 0.25
+
+        self.min_shadow_boundary_contour_share = 0.3
+
+        self.shadow_mask_element_min_share = 0.001
+        self.total_shadow_mask_min_share = 0.01
+
+
+def add_non_covered_area(binary_masks, transparent_pixels):
+    """Appends the non-transparent image area not covered by the masks to them."""
+    total_binary_mask = np.zeros(transparent_pixels.shape, dtype=bool)
+    for binary_mask in binary_masks:
+        np.logical_or(total_binary_mask, binary_mask, out=total_binary_mask)
+    binary_masks.append(np.logical_and(~total_binary_mask, ~transparent_pixels))
+    return binary_masks
+
+
+def get_boundary_contour_share(img_rgba, area_mask, alpha_channel_threshold):
+    """Gets share of the region contour passing through the image boundary or transparent pixels.
+
+    Returns:
+      Contour share or NaN for a region without contour.
+    """
+    total_contour_len, boundary_contour_len = region_contour.get_mask_contour_len(
+        img_rgba, area_mask, alpha_channel_threshold,
+        mask_extension_kernel_size=CONTOUR_MASK_EXTENSION_KERNEL_SIZE)
+    return boundary_contour_len / total_contour_len if total_contour_len else np.nan
+
+
+def detect_shadow_mask(img_rgba, binary_masks, shadow_detect_config, alpha_channel_threshold):
+    """Selects shadow regions among the image regions.
+
+    Args:
+      img_rgba: Source image RGBa-array with cleared half-transparent pixels.
+      binary_masks: List of region binary masks including the non-covered area.
+      shadow_detect_config: SamShadowDetectionConfig.
+      alpha_channel_threshold: Threshold to filter out transparent pixels [0..255].
+
+    Returns:
+      Shadow binary mask or None, if the shadow is too small.
+    """
+    metrics = stage_metrics.get_metrics()
+    img_size = img_rgba.shape[0] * img_rgba.shape[1]
+
+    with metrics.stage('region_selection'):
+        shadow_masks = shadow_region_selection.get_darker_then_most_of_rest(
+            img_rgba, binary_masks,
+            total_brightest_area_min_share=shadow_detect_config.total_brightest_area_min_share,
+            target_area_max_quantile=shadow_detect_config.target_area_max_quantile,
+            other_area_min_quantile=shadow_detect_config.other_area_min_quantile)
+
+    result_mask = np.zeros(img_rgba.shape[:2], dtype=bool)
+    for shadow_mask in shadow_masks:
+        # The area check goes first as it is much cheaper than the contour.
+        if shadow_mask.sum() <= img_size * shadow_detect_config.shadow_mask_element_min_share:
+            continue
+        with metrics.stage('contour'):
+            boundary_contour_share = get_boundary_contour_share(
+                img_rgba, shadow_mask, alpha_channel_threshold)
+        if not (boundary_contour_share >= shadow_detect_config.min_shadow_boundary_contour_share):
+            continue
+        np.logical_or(result_mask, shadow_mask, out=result_mask)
+
+    if result_mask.sum() > img_size * shadow_detect_config.total_shadow_mask_min_share:
+        return result_mask
+    return None
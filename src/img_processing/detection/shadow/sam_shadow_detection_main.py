@@ -5,26 +5,33 @@
 # Usage:
 #   python sam_shadow_detection_main.py \
 #     --dir <input_dir> --sam_pth sam_vit_b_01ec64.pth --sam_type vit_b
+#
+# With --sam_backend onnx the SAM encoder and decoder are exported to ONNX
+# once and run with ONNX Runtime on CPU.
+#
+# With --watch the folder tree is polled keeping the model loaded, images are
+# detected once they are new or changed and not written for --debounce seconds.
+# Processed images are remembered in --watch_index between runs, images failing
+# detection are logged and retried only once they are changed.
 
 
-from src.img_processing.detection.shadow import shadow_region_selection
+from src.img_processing.base import image
+from src.img_processing.base import memory_budget
+from src.img_processing.detection.shadow import sam_shadow_detection
+from src.img_processing.io import folder_watch
 from src.img_processing.io import imgread
-from src.img_processing.regions import region_contour
-from src.machine_learning.segmentation.sam import sam_multi_mask_gen
+from src.img_processing.io import mask_io
+from src.img_processing.io import rgba_read
+from src.machine_learning.segmentation.sam import sam_mask_gen_config
+from src.monitoring import stage_metrics
 
 import argparse
 import logging
 import os
 import pathlib
 import sys
+import time
 
-import numpy as np
-import skimage.color
-import skimage.io
-import skimage.transform
-import skimage.util
-
-MASK_FILE_EXT = '.shadow.mask.png'
 
 def parse_args(argv):
     # Parse input arguments.
@@ -37,34 +44,135 @@ def parse_args(argv):
         help='Path to SAM pth-checkpoint.', required=True)
     parser.add_argument('-m', '--sam_type', dest='sam_model_type',
         help='SAM model type (vit_h, vit_b, etc.).', required=True)
+    parser.add_argument('--sam_backend', dest='sam_backend',
+        help='SAM inference backend (ONNX Runtime runs on CPU).', required=False,
+        choices=sam_mask_gen_config.BACKENDS, default=sam_mask_gen_config.TORCH_BACKEND)
+    parser.add_argument('--sam_threads', dest='num_sam_threads',
+        help='Number of CPU threads of ONNX Runtime (all cores, if absent).',
+        required=False, type=int, default=None)
+    parser.add_argument('--sam_onnx_dir', dest='sam_onnx_dir_path',
+        help='Folder of exported SAM ONNX models (beside the checkpoint, if absent).',
+        required=False, default=None)
 
     parser.add_argument('-a', '--alpha_threshold', dest='alpha_channel_threshold',
         help='Transparency threshold for smoothing [0..255].', required=False,
         type=int, default=150)
 
+    parser.add_argument('--watch', dest='watch', action='store_true',
+        help='Poll the folder tree and detect shadows of new or changed images.')
+    parser.add_argument('--poll_interval', dest='poll_interval_in_seconds',
+        help='Seconds between polls of the watched folder.', required=False, type=float, default=2.0)
+    parser.add_argument('--debounce', dest='debounce_in_seconds',
+        help='Seconds an image must stay unchanged to be detected.', required=False,
+        type=float, default=2.0)
+    parser.add_argument('--full_scan_interval', dest='full_scan_interval_in_seconds',
+        help='Seconds between listings of unchanged folders (finding images rewritten in place).',
+        required=False, type=float, default=300.0)
+    parser.add_argument('--watch_index', dest='watch_index_path',
+        help='Path to JSON index of processed images (in the watched folder, if absent).',
+        required=False, default=None)
+
+    stage_metrics.add_metrics_args(parser)
+
     return parser.parse_args(argv[1:])
 
 
-class SamShadowDetectionConfig:
-    def __init__(self):
-        self.sam_config = sam_multi_mask_gen.SamAutoMaskGeneratorConfig()
-        self.sam_config.pred_iou_thresh = 0.8
-        self.sam_config.stability_score_thresh = 0.7
-        self.sam_config.box_nms_thresh = 0.7
-        self.sam_config.min_mask_region_area = 30
+def detect_and_save_shadow_mask(
+        img, sam_mask_inference, shadow_detect_config, alpha_channel_threshold):
+    """Detects shadow of the image and saves its mask beside the image.
 
-        self.total_brightest_area_min_share = 0.5
-        self.target_area_max_quantile = 0.7
-        self.other_area_min_quantile = 0.25
+    The mask left by a previous detection is removed, if there is no shadow now.
+    """
+    memory_accountant = memory_budget.get_memory_accountant()
+    metrics = stage_metrics.get_metrics()
+    logging.info(f'Processing {img}.')
+    img.clear_half_transparent_pixels(alpha_channel_threshold)
 
-        self.min_shadow_boundary_contour_share = 0.3
+    transparent_pixels = img.rgba[:, :, 3] < alpha_channel_threshold
 
-        self.shadow_mask_element_min_share = 0.001
-        self.total_shadow_mask_min_share = 0.01
+    with metrics.stage('sam_masks'):
+        binary_masks = sam_mask_inference.generate_all_masks(img.rgba)
+    metrics.observe(
+        'sam_masks_per_image', len(binary_masks), stage_metrics.COUNT_BUCKETS)
+
+    sam_shadow_detection.add_non_covered_area(binary_masks, transparent_pixels)
+    masks_nbytes = sum(binary_mask.nbytes for binary_mask in binary_masks)
+    memory_accountant.track(memory_budget.MemoryAccountant.MASKS, masks_nbytes)
+
+    try:
+        result_mask = sam_shadow_detection.detect_shadow_mask(
+            img.rgba, binary_masks, shadow_detect_config, alpha_channel_threshold)
+        shadow_binary_mask_filename = img.path.stem + sam_shadow_detection.MASK_FILE_EXT
+        shadow_binary_mask_path = img.path.resolve().parent.joinpath(shadow_binary_mask_filename)
+        if result_mask is not None:
+            with metrics.stage('write'):
+                mask_io.write_mask(shadow_binary_mask_path, result_mask)
+            metrics.count('shadow_masks_saved')
+            logging.info(f'{shadow_binary_mask_filename} is saved')
+        else:
+            shadow_binary_mask_path.unlink(missing_ok=True)
+        metrics.count('images_processed')
+    finally:
+        memory_accountant.release(memory_budget.MemoryAccountant.MASKS, masks_nbytes)
+        img.release()
+        memory_accountant.publish(metrics)
+
+
+def watch_folder(img_dir_path, parsed_args, sam_mask_inference, shadow_detect_config):
+    """Detects shadows of new or changed images of the folder tree until interrupted."""
+    metrics = stage_metrics.get_metrics()
+    file_index = folder_watch.FileIndex.load(
+        parsed_args.watch_index_path or img_dir_path / 'shadow_watch_index.json')
+    folder_poller = folder_watch.FolderPoller(
+        img_dir_path, file_index, ignored_suffixes=(sam_shadow_detection.MASK_FILE_EXT,),
+        debounce_in_seconds=parsed_args.debounce_in_seconds)
+    logging.info(f'Watching {img_dir_path} with {len(file_index)} processed images.')
+
+    last_full_scan_time = time.monotonic()
+    try:
+        while True:
+            poll_start_time = time.monotonic()
+            full_scan = poll_start_time - last_full_scan_time >= parsed_args.full_scan_interval_in_seconds
+            if full_scan:
+                last_full_scan_time = poll_start_time
+            with metrics.stage('poll'):
+                ready_files = folder_poller.poll(full_scan=full_scan)
+
+            for file_path, rel_path, file_stat in ready_files:
+                try:
+                    with metrics.stage('decode'):
+                        img = image.RawImage(path=file_path, rgba=rgba_read.read_rgba(file_path))
+                except (OSError, ValueError):
+                    logging.warning(f'{file_path} is not a readable image.')
+                else:
+                    # noinspection PyBroadException
+                    try:
+                        detect_and_save_shadow_mask(
+                            img, sam_mask_inference, shadow_detect_config,
+                            parsed_args.alpha_channel_threshold)
+                    except Exception:
+                        # The failed image is retried only once it is changed.
+                        logging.exception(f'Shadow detection of {file_path}.')
+                        metrics.count('images_failed')
+                        img.release()
+                    else:
+                        metrics.observe('arrival_to_mask_s', time.time() - file_stat[0] / 1e9)
+                # The index is saved after every image not to repeat it after a crash.
+                file_index.mark_processed(rel_path, file_stat)
+                file_index.save()
+            file_index.save()
+            metrics.set_gauge('watch_pending_files', len(folder_poller.pending_files))
+
+            time.sleep(max(0.0, parsed_args.poll_interval_in_seconds - (time.monotonic() - poll_start_time)))
+    except KeyboardInterrupt:
+        logging.info(f'Stopped watching {img_dir_path}.')
+    finally:
+        file_index.save()
 
 
 def main(argv):
     parsed_args = parse_args(argv)
+    from src.machine_learning.segmentation.sam import sam_multi_mask_gen
 
     img_dir_path = pathlib.Path(parsed_args.img_dir_path)
     sam_checkpoint_path = pathlib.Path(parsed_args.sam_checkpoint_path)
@@ -76,59 +184,35 @@ def main(argv):
     if not (0 <= alpha_channel_threshold <= 255):
         logging.error(f'Incorrect alpha channel threshold.')
         return os.EX_NOINPUT
+    if parsed_args.watch and (
+            parsed_args.poll_interval_in_seconds <= 0 or parsed_args.debounce_in_seconds < 0):
+        logging.error(f'Incorrect poll interval or debounce time.')
+        return os.EX_USAGE
 
-    shadow_detect_config = SamShadowDetectionConfig()
+    shadow_detect_config = sam_shadow_detection.SamShadowDetectionConfig()
 
     sam_mask_inference = sam_multi_mask_gen.SamMultiMaskInference(
         sam_auto_mask_generator_config=shadow_detect_config.sam_config,
-        sam_checkpoint=sam_checkpoint_path, sam_model_type=parsed_args.sam_model_type)
-
-    for file_name in sorted(os.listdir(str(img_dir_path))):
-        if file_name.endswith(MASK_FILE_EXT):
-            os.remove(img_dir_path / file_name)
-
-    for img in imgread.load_images_from_dir(img_dir_path):
-        logging.info(f'Processing {img}.')
-        img.add_alpha_if_absent()
-        img.clear_half_transparent_pixels(alpha_channel_threshold)
-
-        img_size = img.rgba.shape[0] * img.rgba.shape[1]
-        transparent_pixels = img.rgba[:, :, 3] < alpha_channel_threshold
-
-        binary_masks = sam_mask_inference.generate_all_masks(img.rgba)
-
-        # Add target image area not covered by masks.
-        total_binary_mask = np.zeros(img.rgba.shape[:2], dtype=bool)
-        for binary_mask in binary_masks:
-            total_binary_mask = np.logical_or(total_binary_mask, binary_mask)
-        non_covered_mask_area = np.logical_and(~total_binary_mask, ~transparent_pixels)
-        binary_masks.append(non_covered_mask_area)
-
-        shadow_maks = shadow_region_selection.get_darker_then_most_of_rest(
-            img.rgba, binary_masks,
-            total_brightest_area_min_share=shadow_detect_config.total_brightest_area_min_share,
-            target_area_max_quantile=shadow_detect_config.target_area_max_quantile,
-            other_area_min_quantile=shadow_detect_config.other_area_min_quantile)
-
-        result_mask = np.zeros(img.rgba.shape[:2], dtype=bool) if shadow_maks else None
-        for shadow_mask in shadow_maks:
-            total_contour_len, boundary_contour_len = region_contour.get_mask_contour_len(
-                img.rgba, shadow_mask, alpha_channel_threshold, mask_extension_kernel_size=5)
-            if (total_contour_len == 0 or boundary_contour_len / total_contour_len
-                    < shadow_detect_config.min_shadow_boundary_contour_share):
-                continue
-            if shadow_mask.sum() <= img_size * shadow_detect_config.shadow_mask_element_min_share:
-                continue
-            result_mask = np.logical_or(result_mask, shadow_mask)
-
-        if (result_mask is not None and
-                result_mask.sum() > img_size * shadow_detect_config.total_shadow_mask_min_share):
-            shadow_binary_mask_filename = img.path.stem + MASK_FILE_EXT
-            shadow_binary_mask_path = img.path.resolve().parent.joinpath(
-                shadow_binary_mask_filename)
-            skimage.io.imsave(str(shadow_binary_mask_path), skimage.img_as_uint(result_mask))
-            logging.info(f'{shadow_binary_mask_filename} is saved')
-
+        sam_checkpoint=sam_checkpoint_path, sam_model_type=parsed_args.sam_model_type,
+        backend=parsed_args.sam_backend, num_threads=parsed_args.num_sam_threads,
+        onnx_dir=parsed_args.sam_onnx_dir_path)
+
+    if not parsed_args.watch:
+        for file_name in sorted(os.listdir(str(img_dir_path))):
+            if file_name.endswith(sam_shadow_detection.MASK_FILE_EXT):
+                os.remove(img_dir_path / file_name)
+
+    metrics_reporter = stage_metrics.start_metrics_reporter(parsed_args)
+    metrics = stage_metrics.get_metrics()
+    if parsed_args.watch:
+        watch_folder(img_dir_path, parsed_args, sam_mask_inference, shadow_detect_config)
+    else:
+        for img in metrics.timed_iter(imgread.load_images_from_dir(img_dir_path), 'decode'):
+            detect_and_save_shadow_mask(
+                img, sam_mask_inference, shadow_detect_config, alpha_channel_threshold)
+
+    if metrics_reporter:
+        metrics_reporter.stop()
     return os.EX_OK
 
 
@@ -0,0 +1,243 @@
+#!/usr/bin/python3
+
+# Vectorized evaluation of SamShadowDetectionConfig threshold grids against cached region statistics.
+
+from src.img_processing.detection.shadow import sam_shadow_detection
+from src.img_processing.detection.shadow import shadow_region_selection
+
+import collections
+import itertools
+
+import numpy as np
+
+
+SWEEP_PARAMS = (
+    'total_brightest_area_min_share',
+    'target_area_max_quantile',
+    'other_area_min_quantile',
+    'min_shadow_boundary_contour_share',
+    'shadow_mask_element_min_share',
+    'total_shadow_mask_min_share',
+)
+
+
+class ConfigGrid:
+    """Cartesian product of SamShadowDetectionConfig threshold values."""
+
+    def __init__(self, param_values):
+        """Makes the grid.
+
+        Args:
+          param_values: Dictionary of SWEEP_PARAMS names and their value lists
+                        (default config values for absent names).
+        """
+        default_config = sam_shadow_detection.SamShadowDetectionConfig()
+        unknown_params = set(param_values) - set(SWEEP_PARAMS)
+        if unknown_params:
+            raise ValueError(f'Unknown sweep parameters {sorted(unknown_params)}.')
+        self.param_values = {
+            param_name: tuple(param_values.get(param_name) or (getattr(default_config, param_name),))
+            for param_name in SWEEP_PARAMS}
+        self.configs = [
+            dict(zip(SWEEP_PARAMS, config_values))
+            for config_values in itertools.product(*self.param_values.values())]
+        self.param_arrays = {
+            param_name: np.array([config[param_name] for config in self.configs], dtype=np.float64)
+            for param_name in SWEEP_PARAMS}
+
+    def __len__(self):
+        return len(self.configs)
+
+    @property
+    def quantiles(self):
+        return tuple(sorted(
+            set(self.param_values['target_area_max_quantile']) |
+            set(self.param_values['other_area_min_quantile'])))
+
+    def make_config(self, config_idx):
+        shadow_detect_config = sam_shadow_detection.SamShadowDetectionConfig()
+        for param_name, param_value in self.configs[config_idx].items():
+            setattr(shadow_detect_config, param_name, param_value)
+        return shadow_detect_config
+
+
+# Region areas, gray quantiles, boundary contour shares (NaN, if not computed)
+# and atoms: pixel sets of the same region membership, their pixel counts,
+# region membership (atoms x regions), ground truth membership and atom label map.
+ImageSweepStats = collections.namedtuple('ImageSweepStats', [
+    'img_size', 'area_sums', 'quantiles', 'area_quantiles', 'contour_shares',
+    'atom_counts', 'atom_regions', 'atom_ground_truth', 'atom_labels'])
+
+
+def get_region_atoms(area_masks, ground_truth_mask=None):
+    """Splits image pixels into atoms of the same region (and ground truth) membership.
+
+    Returns:
+      Atom pixel counts, atom region membership (atoms x regions),
+      atom ground truth membership (or None) and label map of pixel atoms.
+    """
+    membership_masks = list(area_masks) + ([ground_truth_mask] if ground_truth_mask is not None else [])
+    atom_counts, atom_membership, atom_labels = shadow_region_selection.get_mask_atoms(membership_masks)
+    atom_regions = atom_membership[:, :len(area_masks)]
+    atom_ground_truth = atom_membership[:, len(area_masks)] if ground_truth_mask is not None else None
+    return atom_counts, atom_regions, atom_ground_truth, atom_labels
+
+
+def compute_image_sweep_stats(
+        img_rgba, binary_masks, config_grid, alpha_channel_threshold, ground_truth_mask=None):
+    """Computes region statistics the grid configurations are evaluated against.
+
+    Boundary contours are the most expensive statistics, so they are computed
+    only for regions passing darkness and area checks of any grid configuration.
+
+    Args:
+      img_rgba: Source image RGBa-array with cleared half-transparent pixels.
+      binary_masks: List of region binary masks including the non-covered area.
+      config_grid: ConfigGrid.
+      alpha_channel_threshold: Threshold to filter out transparent pixels [0..255].
+      ground_truth_mask: Binary shadow mask to compare with (optional).
+
+    Returns:
+      ImageSweepStats.
+    """
+    img_size = img_rgba.shape[0] * img_rgba.shape[1]
+    region_stats = shadow_region_selection.compute_region_stats(
+        img_rgba, binary_masks, config_grid.quantiles)
+
+    contour_shares = np.full(len(region_stats.area_masks), np.nan)
+    candidate_regions = np.any(
+        _select_darker_regions(region_stats.area_sums, region_stats.quantiles,
+                               region_stats.area_quantiles, config_grid) &
+        _select_large_regions(region_stats.area_sums, img_size, config_grid), axis=0)
+    for region_idx in np.flatnonzero(candidate_regions):
+        contour_shares[region_idx] = sam_shadow_detection.get_boundary_contour_share(
+            img_rgba, region_stats.area_masks[region_idx], alpha_channel_threshold)
+
+    if region_stats.area_masks or ground_truth_mask is not None:
+        atom_counts, atom_regions, atom_ground_truth, atom_labels = get_region_atoms(
+            region_stats.area_masks, ground_truth_mask)
+    else:
+        atom_counts, atom_regions, atom_ground_truth, atom_labels = (
+            np.array([img_size]), np.zeros((1, 0), dtype=bool), None,
+            np.zeros(img_rgba.shape[:2], dtype=np.int64))
+    return ImageSweepStats(
+        img_size, region_stats.area_sums, region_stats.quantiles, region_stats.area_quantiles,
+        contour_shares, atom_counts, atom_regions, atom_ground_truth, atom_labels)
+
+
+def _select_darker_regions(area_sums, quantiles, area_quantiles, config_grid):
+    quantile_indices = {quantile: quantile_idx for quantile_idx, quantile in enumerate(quantiles)}
+    target_quantile_indices = [
+        quantile_indices[quantile] for quantile in config_grid.param_arrays['target_area_max_quantile']]
+    other_quantile_indices = [
+        quantile_indices[quantile] for quantile in config_grid.param_arrays['other_area_min_quantile']]
+    return shadow_region_selection.select_darker_regions(
+        area_sums, area_quantiles[:, target_quantile_indices].T,
+        area_quantiles[:, other_quantile_indices].T,
+        config_grid.param_arrays['total_brightest_area_min_share'])
+
+
+def _select_large_regions(area_sums, img_size, config_grid):
+    return area_sums > img_size * config_grid.param_arrays['shadow_mask_element_min_share'][:, np.newaxis]
+
+
+def select_shadow_atoms(sweep_stats, config_grid):
+    """Selects shadow pixel atoms of every grid configuration.
+
+    Returns:
+      Boolean array of configuration shadow atoms (configurations x atoms).
+    """
+    shadow_regions = (
+        _select_darker_regions(sweep_stats.area_sums, sweep_stats.quantiles,
+                               sweep_stats.area_quantiles, config_grid) &
+        _select_large_regions(sweep_stats.area_sums, sweep_stats.img_size, config_grid))
+    # NaN shares of regions without contour fail the check as in the detection.
+    with np.errstate(invalid='ignore'):
+        shadow_regions &= (
+            sweep_stats.contour_shares >=
+            config_grid.param_arrays['min_shadow_boundary_contour_share'][:, np.newaxis])
+
+    shadow_atoms = (shadow_regions.astype(np.int32) @ sweep_stats.atom_regions.T.astype(np.int32)) > 0
+    shadow_areas = shadow_atoms @ sweep_stats.atom_counts
+    # Too small shadow masks are not saved.
+    shadow_atoms[shadow_areas <= sweep_stats.img_size *
+                 config_grid.param_arrays['total_shadow_mask_min_share']] = False
+    return shadow_atoms
+
+
+def evaluate_config_grid(sweep_stats, config_grid):
+    """Evaluates all the grid configurations on the image statistics.
+
+    Returns:
+      Dictionary of per-configuration arrays: shadow mask areas and, if there is
+      ground truth, its area and intersection with the shadow masks.
+    """
+    shadow_atoms = select_shadow_atoms(sweep_stats, config_grid)
+    evaluation = {'shadow_areas': shadow_atoms @ sweep_stats.atom_counts}
+    if sweep_stats.atom_ground_truth is not None:
+        ground_truth_counts = sweep_stats.atom_counts * sweep_stats.atom_ground_truth
+        evaluation['ground_truth_areas'] = np.full(len(config_grid), ground_truth_counts.sum())
+        evaluation['intersection_areas'] = shadow_atoms @ ground_truth_counts
+    return evaluation
+
+
+def get_shadow_mask(sweep_stats, shadow_atoms):
+    """Gets shadow binary mask from the configuration shadow atoms."""
+    return shadow_atoms[sweep_stats.atom_labels]
+
+
+class SweepReport:
+    """Per-configuration metrics accumulated over images."""
+
+    def __init__(self, config_grid):
+        self.config_grid = config_grid
+        self.num_images = 0
+        self.num_shadow_masks = np.zeros(len(config_grid), dtype=np.int64)
+        self.shadow_share_sums = np.zeros(len(config_grid))
+        self.num_ground_truth_images = 0
+        self.iou_sums = np.zeros(len(config_grid))
+        self.total_intersection_areas = np.zeros(len(config_grid), dtype=np.int64)
+        self.total_shadow_areas = np.zeros(len(config_grid), dtype=np.int64)
+        self.total_ground_truth_areas = 0
+
+    def add(self, sweep_stats, evaluation):
+        shadow_areas = evaluation['shadow_areas']
+        self.num_images += 1
+        self.num_shadow_masks += shadow_areas > 0
+        self.shadow_share_sums += shadow_areas / sweep_stats.img_size
+        if 'ground_truth_areas' not in evaluation:
+            return
+
+        ground_truth_areas = evaluation['ground_truth_areas']
+        intersection_areas = evaluation['intersection_areas']
+        union_areas = shadow_areas + ground_truth_areas - intersection_areas
+        self.num_ground_truth_images += 1
+        # Both empty masks match perfectly.
+        self.iou_sums += np.where(union_areas > 0, intersection_areas / np.maximum(union_areas, 1), 1.0)
+        self.total_intersection_areas += intersection_areas
+        self.total_shadow_areas += shadow_areas
+        self.total_ground_truth_areas += int(ground_truth_areas[0])
+
+    def to_dict(self):
+        config_reports = []
+        for config_idx, config in enumerate(self.config_grid.configs):
+            config_report = {
+                'config': config,
+                'num_shadow_masks': int(self.num_shadow_masks[config_idx]),
+                'mean_shadow_share': float(self.shadow_share_sums[config_idx] / max(self.num_images, 1)),
+            }
+            if self.num_ground_truth_images:
+                config_report.update({
+                    'mean_iou': float(self.iou_sums[config_idx] / self.num_ground_truth_images),
+                    'pixel_precision': float(
+                        self.total_intersection_areas[config_idx] /
+                        max(self.total_shadow_areas[config_idx], 1)),
+                    'pixel_recall': float(
+                        self.total_intersection_areas[config_idx] / max(self.total_ground_truth_areas, 1)),
+                })
+            config_reports.append(config_report)
+        return {
+            'num_images': self.num_images,
+            'num_ground_truth_images': self.num_ground_truth_images,
+            'configs': config_reports,
+        }
@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+
+# The script to sweep shadow detection thresholds computing SAM masks and
+# region statistics once per image.
+#
+# Usage:
+#   python shadow_config_sweep_main.py \
+#     --dir <input_dir> --sam_pth sam_vit_b_01ec64.pth --sam_type vit_b \
+#     --total_brightest_area_min_share 0.4 0.5 0.6 \
+#     --target_area_max_quantile 0.6 0.7 0.8 --other_area_min_quantile 0.2 0.25 0.3 \
+#     --ground_truth_dir <dir_of_shadow_masks> --report_json <report path>
+#
+# Ground truth masks are named as the detected ones (<image stem>.shadow.mask.png),
+# every absent threshold takes its default SamShadowDetectionConfig value.
+
+from src.img_processing.detection.shadow import sam_shadow_detection
+from src.img_processing.detection.shadow import shadow_config_sweep
+from src.img_processing.io import imgread
+from src.img_processing.io import mask_io
+from src.machine_learning.segmentation.sam import sam_mask_gen_config
+from src.monitoring import stage_metrics
+
+import argparse
+import json
+import logging
+import os
+import pathlib
+import sys
+
+
+def parse_args(argv):
+    # Parse input arguments.
+    parser = argparse.ArgumentParser(description='Shadow detection config sweep')
+
+    parser.add_argument('-d', '--dir', dest='img_dir_path',
+        help='Folder with images to detect shadows.', required=True)
+    parser.add_argument('-g', '--ground_truth_dir', dest='ground_truth_dir_path',
+        help='Folder with ground truth shadow masks.', required=False, default=None)
+
+    parser.add_argument('-s', '--sam_pth', dest='sam_checkpoint_path',
+        help='Path to SAM pth-checkpoint.', required=True)
+    parser.add_argument('-m', '--sam_type', dest='sam_model_type',
+        help='SAM model type (vit_h, vit_b, etc.).', required=True)
+    parser.add_argument('--sam_backend', dest='sam_backend',
+        help='SAM inference backend (ONNX Runtime runs on CPU).', required=False,
+        choices=sam_mask_gen_config.BACKENDS, default=sam_mask_gen_config.TORCH_BACKEND)
+    parser.add_argument('--sam_threads', dest='num_sam_threads',
+        help='Number of CPU threads of ONNX Runtime (all cores, if absent).',
+        required=False, type=int, default=None)
+    parser.add_argument('--sam_onnx_dir', dest='sam_onnx_dir_path',
+        help='Folder of exported SAM ONNX models (beside the checkpoint, if absent).',
+        required=False, default=None)
+
+    parser.add_argument('-a', '--alpha_threshold', dest='alpha_channel_threshold',
+        help='Transparency threshold for smoothing [0..255].', required=False,
+        type=int, default=150)
+
+    for param_name in shadow_config_sweep.SWEEP_PARAMS:
+        parser.add_argument(f'--{param_name}', dest=param_name,
+            help=f'Swept {param_name} values (the default one, if absent).',
+            required=False, type=float, nargs='+', default=None)
+
+    parser.add_argument('--report_json', dest='report_json_path',
+        help='Path to JSON of per-configuration metrics.', required=False)
+    parser.add_argument('--masks_dir', dest='masks_dir_path',
+        help='Folder to save shadow masks of every configuration (not saved, if absent).',
+        required=False, default=None)
+
+    stage_metrics.add_metrics_args(parser)
+
+    return parser.parse_args(argv[1:])
+
+
+def load_ground_truth_mask(ground_truth_dir_path, img):
+    ground_truth_mask_path = ground_truth_dir_path / (img.path.stem + sam_shadow_detection.MASK_FILE_EXT)
+    if not ground_truth_mask_path.is_file():
+        return None
+    ground_truth_mask = mask_io.read_mask(ground_truth_mask_path)
+    if ground_truth_mask.shape != img.rgba.shape[:2]:
+        logging.error(f'{ground_truth_mask_path} shape differs from {img}.')
+        return None
+    return ground_truth_mask
+
+
+def main(argv):
+    parsed_args = parse_args(argv)
+    from src.machine_learning.segmentation.sam import sam_multi_mask_gen
+
+    img_dir_path = pathlib.Path(parsed_args.img_dir_path)
+    sam_checkpoint_path = pathlib.Path(parsed_args.sam_checkpoint_path)
+    if not img_dir_path.is_dir() or not sam_checkpoint_path.is_file():
+        logging.error(f'Wrong {img_dir_path} or {sam_checkpoint_path}.')
+        return os.EX_NOINPUT
+    ground_truth_dir_path = (
+        pathlib.Path(parsed_args.ground_truth_dir_path) if parsed_args.ground_truth_dir_path else None)
+    if ground_truth_dir_path and not ground_truth_dir_path.is_dir():
+        logging.error(f'{ground_truth_dir_path} is not a dir.')
+        return os.EX_NOINPUT
+
+    alpha_channel_threshold = parsed_args.alpha_channel_threshold
+    if not (0 <= alpha_channel_threshold <= 255):
+        logging.error(f'Incorrect alpha channel threshold.')
+        return os.EX_NOINPUT
+
+    config_grid = shadow_config_sweep.ConfigGrid({
+        param_name: getattr(parsed_args, param_name)
+        for param_name in shadow_config_sweep.SWEEP_PARAMS})
+    logging.info(f'Sweeping {len(config_grid)} configurations.')
+
+    masks_dir_path = pathlib.Path(parsed_args.masks_dir_path) if parsed_args.masks_dir_path else None
+    if masks_dir_path:
+        masks_dir_path.mkdir(parents=True, exist_ok=True)
+
+    shadow_detect_config = sam_shadow_detection.SamShadowDetectionConfig()
+    sam_mask_inference = sam_multi_mask_gen.SamMultiMaskInference(
+        sam_auto_mask_generator_config=shadow_detect_config.sam_config,
+        sam_checkpoint=sam_checkpoint_path, sam_model_type=parsed_args.sam_model_type,
+        backend=parsed_args.sam_backend, num_threads=parsed_args.num_sam_threads,
+        onnx_dir=parsed_args.sam_onnx_dir_path)
+
+    sweep_report = shadow_config_sweep.SweepReport(config_grid)
+    metrics_reporter = stage_metrics.start_metrics_reporter(parsed_args)
+    metrics = stage_metrics.get_metrics()
+    for img in metrics.timed_iter(imgread.load_images_from_dir(img_dir_path), 'decode'):
+        if img.path.name.endswith(sam_shadow_detection.MASK_FILE_EXT):
+            img.release()
+            continue
+        logging.info(f'Processing {img}.')
+        img.clear_half_transparent_pixels(alpha_channel_threshold)
+        transparent_pixels = img.rgba[:, :, 3] < alpha_channel_threshold
+
+        with metrics.stage('sam_masks'):
+            binary_masks = sam_mask_inference.generate_all_masks(img.rgba)
+        sam_shadow_detection.add_non_covered_area(binary_masks, transparent_pixels)
+
+        ground_truth_mask = (
+            load_ground_truth_mask(ground_truth_dir_path, img) if ground_truth_dir_path else None)
+        with metrics.stage('region_stats'):
+            sweep_stats = shadow_config_sweep.compute_image_sweep_stats(
+                img.rgba, binary_masks, config_grid, alpha_channel_threshold, ground_truth_mask)
+        with metrics.stage('config_grid'):
+            sweep_report.add(sweep_stats, shadow_config_sweep.evaluate_config_grid(
+                sweep_stats, config_grid))
+
+        if masks_dir_path:
+            with metrics.stage('write'):
+                shadow_atoms = shadow_config_sweep.select_shadow_atoms(sweep_stats, config_grid)
+                for config_idx in range(len(config_grid)):
+                    if shadow_atoms[config_idx].any():
+                        mask_io.write_mask(
+                            masks_dir_path / f'{img.path.stem}.{config_idx}{sam_shadow_detection.MASK_FILE_EXT}',
+                            shadow_config_sweep.get_shadow_mask(sweep_stats, shadow_atoms[config_idx]))
+        metrics.count('images_processed')
+        img.release()
+
+    if metrics_reporter:
+        metrics_reporter.stop()
+
+    report = sweep_report.to_dict()
+    best_configs = sorted(
+        report['configs'], key=lambda config_report: config_report.get('mean_iou', 0.0), reverse=True)
+    if report['num_ground_truth_images'] and best_configs:
+        logging.info(f'Best mean IoU {best_configs[0]["mean_iou"]:.3f} of {best_configs[0]["config"]}.')
+    if parsed_args.report_json_path:
+        with open(parsed_args.report_json_path, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+    return os.EX_OK
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    sys.exit(main(sys.argv))
@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+
+# Client of the resident shadow detection server (light imports only, no SAM or torch).
+
+from src.img_processing.detection.shadow import shadow_detection_protocol
+
+import http
+import http.client
+import json
+import socket
+
+
+class ShadowDetectionError(Exception):
+    """The server failed to detect shadow."""
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, unix_socket_path, timeout):
+        super().__init__('localhost', timeout=timeout)
+        self.unix_socket_path = unix_socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_socket_path)
+
+
+class ShadowDetectionClient:
+    """Connection to the shadow detection server (one per thread)."""
+
+    def __init__(self, unix_socket_path=None, host='127.0.0.1', port=8765, timeout_in_seconds=600.0):
+        """Opens keep-alive connection to the Unix socket or TCP port of the server."""
+        if unix_socket_path:
+            self.connection = _UnixHTTPConnection(str(unix_socket_path), timeout_in_seconds)
+        else:
+            self.connection = http.client.HTTPConnection(host, port, timeout=timeout_in_seconds)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def _request(self, method, path, body=None, headers=None):
+        self.connection.request(method, path, body=body, headers=headers or {})
+        response = self.connection.getresponse()
+        content = response.read()
+        if response.status >= http.HTTPStatus.BAD_REQUEST:
+            try:
+                error_message = json.loads(content)['error']
+            except (ValueError, KeyError):
+                error_message = content.decode(errors='replace')
+            raise ShadowDetectionError(f'{response.status}: {error_message}')
+        return response, content
+
+    def detect_file(self, image_path, mask_path=None):
+        """Detects shadow of the image file the server reads.
+
+        Args:
+          image_path: Image path accessible by the server.
+          mask_path: Path to save the mask to relative to the mask root of the server
+                     (beside the image, if None).
+
+        Returns:
+          Saved mask path (or None without shadow) and shadow share of the image pixels.
+        """
+        detect_request = {'image_path': str(image_path)}
+        if mask_path:
+            detect_request['mask_path'] = str(mask_path)
+        _, content = self._request(
+            'POST', shadow_detection_protocol.DETECT_PATH, json.dumps(detect_request).encode(),
+            {'Content-Type': 'application/json'})
+        detect_response = json.loads(content)
+        return detect_response['mask_path'], detect_response['shadow_share']
+
+    def detect_bytes(self, encoded_image):
+        """Detects shadow of the image file content.
+
+        Returns:
+          1-bit PNG mask bytes (or None without shadow) and shadow share of the image pixels.
+        """
+        response, content = self._request(
+            'POST', shadow_detection_protocol.DETECT_PATH, encoded_image,
+            {'Content-Type': 'application/octet-stream'})
+        shadow_share = float(response.getheader(shadow_detection_protocol.SHADOW_SHARE_HEADER, 0.0))
+        return (content if response.status == http.HTTPStatus.OK else None), shadow_share
+
+    def health(self):
+        _, content = self._request('GET', shadow_detection_protocol.HEALTH_PATH)
+        return json.loads(content)
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+
+# The script to detect shadows of a folder with the running shadow detection server.
+#
+# Usage:
+#   python shadow_detection_client_main.py \
+#     --dir <input_dir> --unix_socket /tmp/shadow_detection.sock --concurrency 4
+#
+# Masks are saved beside images as sam_shadow_detection_main does, the server
+# reads the images by their absolute paths. Concurrent requests let the server
+# batch them.
+
+import os, sys
+SCRIPT_DIRS = os.path.dirname(os.path.abspath(__file__)).split(os.sep)
+sys.path.append(os.path.join(os.sep, *SCRIPT_DIRS[:SCRIPT_DIRS.index('src')]))
+
+from src.img_processing.detection.shadow import shadow_detection_client
+from src.img_processing.detection.shadow import shadow_detection_protocol
+
+import argparse
+import concurrent.futures
+import logging
+import pathlib
+import threading
+
+
+def parse_args(argv):
+    # Parse input arguments.
+    parser = argparse.ArgumentParser(description='Shadow detection server client')
+
+    parser.add_argument('-d', '--dir', dest='img_dir_path',
+        help='Folder with images to detect shadows.', required=True)
+    parser.add_argument('--unix_socket', dest='unix_socket_path',
+        help='Unix socket of the server (TCP port, if absent).', required=False, default=None)
+    parser.add_argument('--host', dest='host',
+        help='Host of the server.', required=False, default='127.0.0.1')
+    parser.add_argument('--port', dest='port',
+        help='TCP port of the server.', required=False, type=int, default=8765)
+    parser.add_argument('--concurrency', dest='num_concurrent_requests',
+        help='Number of concurrent requests.', required=False, type=int, default=4)
+
+    return parser.parse_args(argv[1:])
+
+
+def main(argv):
+    parsed_args = parse_args(argv)
+
+    img_dir_path = pathlib.Path(parsed_args.img_dir_path)
+    if not img_dir_path.is_dir():
+        logging.error(f'{img_dir_path} is not a dir.')
+        return os.EX_NOINPUT
+    if parsed_args.num_concurrent_requests <= 0:
+        logging.error(f'Number of concurrent requests must be positive.')
+        return os.EX_USAGE
+
+    img_paths = []
+    for file_name in sorted(os.listdir(str(img_dir_path))):
+        file_path = img_dir_path.absolute() / file_name
+        if file_name.endswith(shadow_detection_protocol.MASK_FILE_EXT):
+            os.remove(file_path)
+        elif file_path.is_file():
+            img_paths.append(file_path)
+
+    # Keep-alive connection per thread.
+    thread_clients = threading.local()
+    all_clients = []
+
+    def detect(img_path):
+        if not hasattr(thread_clients, 'client'):
+            thread_clients.client = shadow_detection_client.ShadowDetectionClient(
+                parsed_args.unix_socket_path, parsed_args.host, parsed_args.port)
+            all_clients.append(thread_clients.client)
+        try:
+            return thread_clients.client.detect_file(img_path)
+        except shadow_detection_client.ShadowDetectionError as error:
+            logging.warning(f'{img_path}: {error}')
+            return None, 0.0
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=parsed_args.num_concurrent_requests) as executor:
+            for img_path, (mask_path, shadow_share) in zip(img_paths, executor.map(detect, img_paths)):
+                if mask_path:
+                    logging.info(f'{mask_path} is saved, {shadow_share:.3f} of {img_path.name} pixels.')
+    except OSError as error:
+        logging.error(f'Shadow detection server is unavailable: {error}')
+        return os.EX_UNAVAILABLE
+    finally:
+        for client in all_clients:
+            client.close()
+    return os.EX_OK
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    sys.exit(main(sys.argv))
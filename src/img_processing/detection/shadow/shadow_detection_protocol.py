@@ -0,0 +1,10 @@
+#!/usr/bin/python3
+
+# Shadow detection file names and server endpoints shared by the server and its light clients.
+
+MASK_FILE_EXT = '.shadow.mask.png'
+
+DETECT_PATH = '/detect'
+HEALTH_PATH = '/health'
+METRICS_PATH = '/metrics'
+SHADOW_SHARE_HEADER = 'X-Shadow-Share'
@@ -0,0 +1,293 @@
+#!/usr/bin/python3
+
+# Resident shadow detection service batching concurrent requests to one loaded SAM model.
+#
+# Requests:
+#   POST /detect with JSON {"image_path": <path>, "mask_path": <optional path>}
+#     saves the mask (beside the image, if no path) and responds with JSON
+#     {"mask_path": <path or null>, "shadow_share": <share of image pixels>}.
+#     Mask paths are accepted only inside the mask root folder of the server,
+#     they are never removed without shadow (stale masks beside images are).
+#   POST /detect with image file bytes responds with 1-bit PNG mask bytes
+#     (or 204 without shadow) and X-Shadow-Share header.
+#   GET /health responds with JSON of stage metrics, GET /metrics with Prometheus text.
+
+from src.img_processing.base import image
+from src.img_processing.detection.shadow import sam_shadow_detection
+from src.img_processing.detection.shadow import shadow_detection_protocol
+from src.img_processing.io import mask_io
+from src.img_processing.io import rgba_read
+from src.monitoring import stage_metrics
+
+import concurrent.futures
+import http
+import http.server
+import json
+import logging
+import os
+import pathlib
+import queue
+import socket
+import socketserver
+import threading
+import time
+
+
+class BatchingShadowDetector:
+    """Shadow detector thread taking queued images in batches.
+
+    Requests coming while a batch is processed are queued and taken together
+    with the next batch, so SAM image encoder runs over several images at once.
+    """
+
+    def __init__(self, sam_mask_inference, shadow_detect_config, alpha_channel_threshold,
+                 max_batch_size=4, batch_timeout_in_seconds=0.01):
+        """Starts the detector thread.
+
+        Args:
+          sam_mask_inference: Loaded SamMultiMaskInference.
+          shadow_detect_config: SamShadowDetectionConfig.
+          alpha_channel_threshold: Threshold to filter out transparent pixels [0..255].
+          max_batch_size: Max number of images detected in one batch.
+          batch_timeout_in_seconds: Time to wait for more requests after the first one.
+        """
+        self.sam_mask_inference = sam_mask_inference
+        self.shadow_detect_config = shadow_detect_config
+        self.alpha_channel_threshold = alpha_channel_threshold
+        self.max_batch_size = max_batch_size
+        self.batch_timeout_in_seconds = batch_timeout_in_seconds
+        self.request_queue = queue.Queue()
+        self.detector_thread = threading.Thread(target=self._detect_batches, daemon=True)
+        self.detector_thread.start()
+
+    def submit(self, img):
+        """Queues image for detection.
+
+        Args:
+          img: RawImage (its half-transparent pixels are cleared in place).
+
+        Returns:
+          Future of the shadow binary mask or None, if the shadow is too small.
+        """
+        future = concurrent.futures.Future()
+        self.request_queue.put((img, future))
+        return future
+
+    def stop(self):
+        self.request_queue.put(None)
+        self.detector_thread.join()
+
+    def _take_batch(self):
+        batch = [self.request_queue.get()]
+        if batch[0] is None:
+            return None
+        deadline = time.perf_counter() + self.batch_timeout_in_seconds
+        while len(batch) < self.max_batch_size:
+            try:
+                request = self.request_queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                break
+            if request is None:
+                # Stop after the batch.
+                self.request_queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _detect_batches(self):
+        metrics = stage_metrics.get_metrics()
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            batch = [(img, future) for img, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            metrics.observe('detection_batch_size', len(batch), stage_metrics.COUNT_BUCKETS)
+            try:
+                for img, _ in batch:
+                    img.clear_half_transparent_pixels(self.alpha_channel_threshold)
+                with metrics.stage('sam_masks'):
+                    all_binary_masks = self.sam_mask_inference.generate_all_masks_batch(
+                        [img.rgba for img, _ in batch])
+            except Exception as error:
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+
+            for (img, future), binary_masks in zip(batch, all_binary_masks):
+                try:
+                    sam_shadow_detection.add_non_covered_area(
+                        binary_masks, img.rgba[:, :, 3] < self.alpha_channel_threshold)
+                    future.set_result(sam_shadow_detection.detect_shadow_mask(
+                        img.rgba, binary_masks, self.shadow_detect_config, self.alpha_channel_threshold))
+                except Exception as error:
+                    future.set_exception(error)
+                metrics.count('images_processed')
+
+
+class ShadowDetectionRequestHandler(http.server.BaseHTTPRequestHandler):
+    """HTTP handler decoding images and writing masks in server threads around the detector."""
+
+    server_version = 'ShadowDetection/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        # Unix socket clients have no address.
+        return str(self.client_address[0]) if self.client_address else 'unix'
+
+    def do_GET(self):
+        metrics = stage_metrics.get_metrics()
+        if self.path == shadow_detection_protocol.HEALTH_PATH:
+            self._send(http.HTTPStatus.OK, json.dumps(
+                {'status': 'ok', 'metrics': metrics.summary()}).encode(), 'application/json')
+        elif self.path == shadow_detection_protocol.METRICS_PATH:
+            self._send(http.HTTPStatus.OK, metrics.prometheus_text().encode(), 'text/plain; version=0.0.4')
+        else:
+            self._send_error(http.HTTPStatus.NOT_FOUND, f'Unknown path {self.path}.')
+
+    def do_POST(self):
+        # The body is read anyway not to take it as the next request of the connection.
+        content = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path != shadow_detection_protocol.DETECT_PATH:
+            self._send_error(http.HTTPStatus.NOT_FOUND, f'Unknown path {self.path}.')
+            return
+        if self.headers.get_content_type() == 'application/json':
+            self._detect_file(content)
+        else:
+            self._detect_bytes(content)
+
+    def _detect_file(self, content):
+        try:
+            detect_request = json.loads(content)
+            img_path = pathlib.Path(detect_request['image_path'])
+            requested_mask_path = detect_request.get('mask_path')
+            if requested_mask_path:
+                mask_path = self.server.get_requested_mask_path(requested_mask_path)
+            else:
+                mask_path = img_path.with_name(img_path.stem + sam_shadow_detection.MASK_FILE_EXT)
+            img = image.RawImage(path=img_path, rgba=rgba_read.read_rgba(img_path))
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            self._send_error(http.HTTPStatus.BAD_REQUEST, f'Bad detection request: {error}')
+            return
+
+        with img:
+            result_mask = self._detect(img)
+        if result_mask is False:
+            return
+        try:
+            if result_mask is not None:
+                with stage_metrics.get_metrics().stage('write'):
+                    mask_io.write_mask(mask_path, result_mask)
+                stage_metrics.get_metrics().count('shadow_masks_saved')
+            elif not requested_mask_path:
+                # The mask of the previous detection is stale.
+                mask_path.unlink(missing_ok=True)
+        except OSError as error:
+            logging.exception('Mask %s is not saved.', mask_path)
+            self._send_error(http.HTTPStatus.INTERNAL_SERVER_ERROR, f'Mask is not saved: {error}')
+            return
+        self._send(http.HTTPStatus.OK, json.dumps({
+            'mask_path': str(mask_path) if result_mask is not None else None,
+            'shadow_share': get_shadow_share(result_mask),
+        }).encode(), 'application/json')
+
+    def _detect_bytes(self, content):
+        try:
+            img = image.RawImage(path='<request>', rgba=rgba_read.decode_rgba(content))
+        except ValueError as error:
+            self._send_error(http.HTTPStatus.BAD_REQUEST, str(error))
+            return
+
+        with img:
+            result_mask = self._detect(img)
+        if result_mask is False:
+            return
+        if result_mask is None:
+            self._send(http.HTTPStatus.NO_CONTENT, b'', None,
+                       {shadow_detection_protocol.SHADOW_SHARE_HEADER: '0.0'})
+            return
+        self._send(http.HTTPStatus.OK, mask_io.encode_mask_png(result_mask), 'image/png',
+                   {shadow_detection_protocol.SHADOW_SHARE_HEADER: str(get_shadow_share(result_mask))})
+
+    def _detect(self, img):
+        """Waits for the detection result (False after an error response)."""
+        try:
+            return self.server.detector.submit(img).result()
+        except Exception as error:
+            logging.exception('Detection failed.')
+            self._send_error(http.HTTPStatus.INTERNAL_SERVER_ERROR, f'Detection failed: {error}')
+            return False
+
+    def _send_error(self, status, message):
+        self._send(status, json.dumps({'error': message}).encode(), 'application/json')
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        for header_name, header_value in (headers or {}).items():
+            self.send_header(header_name, header_value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug('%s - %s', self.address_string(), format % args)
+
+
+def get_shadow_share(shadow_mask):
+    if shadow_mask is None:
+        return 0.0
+    return float(shadow_mask.sum() / shadow_mask.size)
+
+
+class ShadowDetectionHTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address, detector, mask_root_path=None):
+        self.detector = detector
+        self.mask_root_path = pathlib.Path(mask_root_path).resolve() if mask_root_path else None
+        super().__init__(server_address, ShadowDetectionRequestHandler)
+
+    def get_requested_mask_path(self, requested_mask_path):
+        """Resolves mask path of a request relative to the mask root.
+
+        Raises:
+          ValueError: The server has no mask root or the path is outside of it.
+        """
+        if not self.mask_root_path:
+            raise ValueError('Mask paths are not accepted without mask root of the server.')
+        mask_path = (self.mask_root_path / requested_mask_path).resolve()
+        if not mask_path.is_relative_to(self.mask_root_path) or mask_path == self.mask_root_path:
+            raise ValueError(f'{requested_mask_path} is outside of the mask root.')
+        return mask_path
+
+
+class UnixShadowDetectionHTTPServer(ShadowDetectionHTTPServer):
+    """The server listening to a local Unix socket instead of TCP port."""
+
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        # A socket file left by a killed server is replaced.
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def create_server(detector, host='127.0.0.1', port=8765, unix_socket_path=None, mask_root_path=None):
+    """Creates HTTP server of the detector listening to the Unix socket or TCP port.
+
+    Requested mask paths are saved inside the mask root (not accepted, if None).
+    """
+    if unix_socket_path:
+        return UnixShadowDetectionHTTPServer(str(unix_socket_path), detector, mask_root_path)
+    return ShadowDetectionHTTPServer((host, port), detector, mask_root_path)
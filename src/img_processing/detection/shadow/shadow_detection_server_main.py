@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+
+# The script to serve shadow detection with SAM model loaded once.
+#
+# Usage:
+#   python shadow_detection_server_main.py \
+#     --sam_pth sam_vit_b_01ec64.pth --sam_type vit_b --unix_socket /tmp/shadow_detection.sock
+#
+# Without --unix_socket the server listens to --host and --port. Images are
+# sent with shadow_detection_client_main or any HTTP client, e.g.
+#   curl --unix-socket /tmp/shadow_detection.sock -H 'Content-Type: application/json' \
+#     -d '{"image_path": "/data/tree.png"}' http://localhost/detect
+#
+# Masks are saved beside images, requested "mask_path" is accepted only
+# relative to (or inside) --mask_root.
+
+from src.img_processing.detection.shadow import sam_shadow_detection
+from src.img_processing.detection.shadow import shadow_detection_server
+from src.machine_learning.segmentation.sam import sam_mask_gen_config
+from src.monitoring import stage_metrics
+
+import argparse
+import logging
+import os
+import pathlib
+import signal
+import sys
+
+
+def parse_args(argv):
+    # Parse input arguments.
+    parser = argparse.ArgumentParser(description='Shadow detection server with SAM')
+
+    parser.add_argument('-s', '--sam_pth', dest='sam_checkpoint_path',
+        help='Path to SAM pth-checkpoint.', required=True)
+    parser.add_argument('-m', '--sam_type', dest='sam_model_type',
+        help='SAM model type (vit_h, vit_b, etc.).', required=True)
+    parser.add_argument('--sam_backend', dest='sam_backend',
+        help='SAM inference backend (ONNX Runtime runs on CPU).', required=False,
+        choices=sam_mask_gen_config.BACKENDS, default=sam_mask_gen_config.TORCH_BACKEND)
+    parser.add_argument('--sam_threads', dest='num_sam_threads',
+        help='Number of CPU threads of ONNX Runtime (all cores, if absent).',
+        required=False, type=int, default=None)
+    parser.add_argument('--sam_onnx_dir', dest='sam_onnx_dir_path',
+        help='Folder of exported SAM ONNX models (beside the checkpoint, if absent).',
+        required=False, default=None)
+
+    parser.add_argument('-a', '--alpha_threshold', dest='alpha_channel_threshold',
+        help='Transparency threshold for smoothing [0..255].', required=False,
+        type=int, default=150)
+
+    parser.add_argument('--unix_socket', dest='unix_socket_path',
+        help='Path of Unix socket to listen to (TCP port, if absent).', required=False, default=None)
+    parser.add_argument('--host', dest='host',
+        help='Host to listen to.', required=False, default='127.0.0.1')
+    parser.add_argument('--port', dest='port',
+        help='TCP port to listen to.', required=False, type=int, default=8765)
+
+    parser.add_argument('--mask_root', dest='mask_root_path',
+        help='Folder of mask paths requested by clients (masks only beside images, if absent).',
+        required=False, default=None)
+
+    parser.add_argument('--batch_size', dest='max_batch_size',
+        help='Max number of images detected in one batch.', required=False, type=int, default=4)
+    parser.add_argument('--batch_timeout_ms', dest='batch_timeout_ms',
+        help='Time to wait for more images after the first one of a batch.',
+        required=False, type=float, default=10.0)
+
+    stage_metrics.add_metrics_args(parser)
+
+    return parser.parse_args(argv[1:])
+
+
+def main(argv):
+    parsed_args = parse_args(argv)
+    from src.machine_learning.segmentation.sam import sam_multi_mask_gen
+
+    sam_checkpoint_path = pathlib.Path(parsed_args.sam_checkpoint_path)
+    if not sam_checkpoint_path.is_file():
+        logging.error(f'Wrong {sam_checkpoint_path}.')
+        return os.EX_NOINPUT
+
+    alpha_channel_threshold = parsed_args.alpha_channel_threshold
+    if not (0 <= alpha_channel_threshold <= 255):
+        logging.error(f'Incorrect alpha channel threshold.')
+        return os.EX_NOINPUT
+    if parsed_args.max_batch_size <= 0 or parsed_args.batch_timeout_ms < 0:
+        logging.error(f'Incorrect batch size or timeout.')
+        return os.EX_USAGE
+
+    shadow_detect_config = sam_shadow_detection.SamShadowDetectionConfig()
+    sam_mask_inference = sam_multi_mask_gen.SamMultiMaskInference(
+        sam_auto_mask_generator_config=shadow_detect_config.sam_config,
+        sam_checkpoint=sam_checkpoint_path, sam_model_type=parsed_args.sam_model_type,
+        backend=parsed_args.sam_backend, num_threads=parsed_args.num_sam_threads,
+        onnx_dir=parsed_args.sam_onnx_dir_path)
+
+    # Metrics are always collected to be served at /health and /metrics.
+    stage_metrics.enable_metrics()
+    metrics_reporter = stage_metrics.start_metrics_reporter(parsed_args)
+    detector = shadow_detection_server.BatchingShadowDetector(
+        sam_mask_inference, shadow_detect_config, alpha_channel_threshold,
+        max_batch_size=parsed_args.max_batch_size,
+        batch_timeout_in_seconds=parsed_args.batch_timeout_ms / 1000)
+    server = shadow_detection_server.create_server(
+        detector, parsed_args.host, parsed_args.port, parsed_args.unix_socket_path,
+        mask_root_path=parsed_args.mask_root_path)
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(os.EX_OK))
+
+    logging.info(f'Serving shadow detection at {parsed_args.unix_socket_path or server.server_address}.')
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        logging.info('Stopping shadow detection server.')
+    finally:
+        server.server_close()
+        detector.stop()
+        if metrics_reporter:
+            metrics_reporter.stop()
+    return os.EX_OK
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    sys.exit(main(sys.argv))
@@ -2,10 +2,220 @@
 
 # Methods for shadow region selection.
 
+import collections
 
 import numpy as np
-import skimage.color
-import skimage.io
+
+
+# Non-transparent region masks, their pixel counts and gray quantiles (regions x quantiles).
+RegionStats = collections.namedtuple(
+    'RegionStats', ['area_masks', 'area_sums', 'quantiles', 'area_quantiles'])
+
+# skimage.color.rgb2gray weights of red, green and blue in 1/10000.
+GRAY_WEIGHTS = (2125, 7154, 721)
+NUM_GRAY_LEVELS = 256
+
+
+# Pixels of image rows converted to gray at once (bounds uint32 temporaries).
+GRAY_CHUNK_PIXELS = 1 << 20
+# Pixels of a label map counted in one bincount (bounds its intp copy of labels).
+BINCOUNT_CHUNK_PIXELS = 1 << 22
+
+
+def get_gray_levels(img_rgba):
+    """Gets uint8 gray of the image blended over white background.
+
+    The same as rgb2gray(rgba2rgb(img_rgba)) rounded to [0..255] levels, but
+    computed in integers by chunks of rows without float copies of the image.
+    """
+    gray_levels = np.empty(img_rgba.shape[:2], dtype=np.uint8)
+    rows_per_chunk = max(1, GRAY_CHUNK_PIXELS // max(1, img_rgba.shape[1]))
+    for chunk_start in range(0, img_rgba.shape[0], rows_per_chunk):
+        chunk_rgba = img_rgba[chunk_start:chunk_start + rows_per_chunk]
+        alpha = chunk_rgba[:, :, 3].astype(np.uint32)
+        weighted_gray = np.multiply(chunk_rgba[:, :, 0], GRAY_WEIGHTS[0], dtype=np.uint32)
+        weighted_channel = np.empty_like(weighted_gray)
+        for channel_idx in (1, 2):
+            np.multiply(chunk_rgba[:, :, channel_idx], GRAY_WEIGHTS[channel_idx],
+                        out=weighted_channel, dtype=np.uint32)
+            weighted_gray += weighted_channel
+        weighted_gray *= alpha
+        # Transparency of white background: 10000 * 255 * (255 - alpha).
+        np.subtract(255, alpha, out=alpha)
+        alpha *= 10000 * 255
+        weighted_gray += alpha
+        # Every weighted sum is 10000 * 255 times the rounded gray level.
+        weighted_gray += 10000 * 255 // 2
+        weighted_gray //= 10000 * 255
+        gray_levels[chunk_start:chunk_start + rows_per_chunk] = weighted_gray
+    return gray_levels
+
+
+def get_label_dtype(num_labels):
+    """Gets the smallest dtype of labels [0..num_labels) combined with gray levels."""
+    return np.uint16 if num_labels * NUM_GRAY_LEVELS <= 1 << 16 else np.int32
+
+
+def count_labeled_gray_levels(labels, gray_levels, num_labels):
+    """Counts gray levels of every label combining them in place into the label map.
+
+    Returns:
+      Histograms of gray levels (labels x 256).
+    """
+    labels *= NUM_GRAY_LEVELS
+    labels += gray_levels
+    labels = labels.reshape(-1)
+    histograms = np.zeros(num_labels * NUM_GRAY_LEVELS, dtype=np.int64)
+    for chunk_start in range(0, len(labels), BINCOUNT_CHUNK_PIXELS):
+        histograms += np.bincount(
+            labels[chunk_start:chunk_start + BINCOUNT_CHUNK_PIXELS],
+            minlength=len(histograms))
+    return histograms.reshape(num_labels, NUM_GRAY_LEVELS)
+
+
+def get_mask_atoms(masks):
+    """Splits image pixels into atoms of the same mask membership.
+
+    Returns:
+      Atom pixel counts, atom mask membership (atoms x masks) and label map of pixel atoms.
+    """
+    img_shape = masks[0].shape
+    num_bytes = max(1, (len(masks) + 7) // 8)
+
+    packed_membership = np.zeros((img_shape[0] * img_shape[1], num_bytes), dtype=np.uint8)
+    for mask_idx, mask in enumerate(masks):
+        packed_membership[:, mask_idx // 8] |= (
+            mask.reshape(-1).astype(np.uint8) << (7 - mask_idx % 8))
+    packed_signatures = np.ascontiguousarray(packed_membership).view(
+        np.dtype((np.void, num_bytes))).reshape(-1)
+    unique_signatures, atom_labels, atom_counts = np.unique(
+        packed_signatures, return_inverse=True, return_counts=True)
+
+    atom_membership = np.unpackbits(
+        unique_signatures.view(np.uint8).reshape(-1, num_bytes), axis=1,
+        count=len(masks)).astype(bool)
+    return atom_counts, atom_membership, atom_labels.reshape(img_shape)
+
+
+def get_region_histograms(gray_levels, area_masks):
+    """Counts gray levels of every region.
+
+    Disjoint regions are counted in one bincount over a region label map,
+    overlapping ones by a bincount of every region pixels.
+
+    Args:
+      gray_levels: Image uint8 gray levels.
+      area_masks: Region binary masks.
+
+    Returns:
+      Histograms of gray levels (regions x 256).
+    """
+    if not area_masks:
+        return np.zeros((0, NUM_GRAY_LEVELS), dtype=np.int64)
+
+    num_labels = len(area_masks) + 1
+    region_labels = np.zeros(gray_levels.shape, dtype=get_label_dtype(num_labels))
+    num_region_pixels = 0
+    for region_idx, area_mask in enumerate(area_masks):
+        region_labels[area_mask] = region_idx + 1
+        num_region_pixels += np.count_nonzero(area_mask)
+    if np.count_nonzero(region_labels) == num_region_pixels:
+        return count_labeled_gray_levels(region_labels, gray_levels, num_labels)[1:]
+
+    del region_labels
+    # Overlapping regions are counted one by one in O(area) without sorting pixels.
+    return np.stack([
+        np.bincount(gray_levels[area_mask], minlength=NUM_GRAY_LEVELS) for area_mask in area_masks
+    ]).astype(np.int64, copy=False)
+
+
+def get_histogram_quantiles(histograms, quantiles):
+    """Gets quantiles of counted values as np.quantile (linear interpolation) of the values does.
+
+    Args:
+      histograms: Counts of values [0..bins) of every region (regions x bins).
+      quantiles: Quantiles to compute.
+
+    Returns:
+      Quantile values (regions x quantiles).
+    """
+    cumulative_counts = np.cumsum(histograms, axis=1)
+    last_positions = np.maximum(cumulative_counts[:, -1:] - 1, 0)
+    positions = np.asarray(quantiles, dtype=np.float64)[np.newaxis, :] * last_positions
+    lower_positions = np.floor(positions).astype(np.int64)
+    upper_positions = np.minimum(lower_positions + 1, last_positions)
+    # Value of a position in sorted values is the number of bins ending before it.
+    lower_values, upper_values = (
+        np.count_nonzero(
+            cumulative_counts[:, np.newaxis, :] <= sorted_positions[:, :, np.newaxis], axis=2)
+        for sorted_positions in (lower_positions, upper_positions))
+    return lower_values + (positions - lower_positions) * (upper_values - lower_values)
+
+
+def compute_region_stats(
+    img_rgba, binary_masks, quantiles,
+    min_non_transparent_area_mask_sum=10,
+    alpha_channel_threshold=150):
+    """Computes areas and gray quantiles of non-transparent parts of the regions.
+
+    Quantiles are taken from 256-level gray histograms of the regions.
+
+    Args:
+      img_rgba: Source image RGBa-array.
+      binary_masks: List of region binary masks.
+      quantiles: Gray quantiles to compute for every region.
+      min_non_transparent_area_mask_sum: Min size of a region to filter the smallest ones.
+      alpha_channel_threshold: Threshold to filter out transparent pixels [0..255].
+
+    Returns:
+      RegionStats of the regions not smaller than the min size.
+    """
+    non_transparent_pixels = img_rgba[:, :, 3] >= alpha_channel_threshold
+    quantiles = tuple(quantiles)
+
+    area_masks, area_sums = [], []
+    for area_mask in binary_masks:
+        non_transparent_area_mask = np.logical_and(area_mask, non_transparent_pixels)
+        non_transparent_area_mask_sum = non_transparent_area_mask.sum()
+        if non_transparent_area_mask_sum < min_non_transparent_area_mask_sum:
+            continue
+        area_masks.append(non_transparent_area_mask)
+        area_sums.append(non_transparent_area_mask_sum)
+
+    region_histograms = get_region_histograms(get_gray_levels(img_rgba), area_masks)
+    area_quantiles = get_histogram_quantiles(region_histograms, quantiles) / (NUM_GRAY_LEVELS - 1)
+    return RegionStats(
+        area_masks, np.array(area_sums, dtype=np.int64), quantiles,
+        area_quantiles.reshape(len(area_masks), len(quantiles)))
+
+
+def select_darker_regions(
+    area_sums, target_area_max_quantiles, other_area_min_quantiles,
+    total_brightest_area_min_share):
+    """Selects the regions which are darker than most of all the rest regions.
+
+    Leading dimensions of the quantiles and the share are configurations
+    evaluated at once.
+
+    Args:
+      area_sums: Region areas (regions).
+      target_area_max_quantiles: Color percentiles of regions as dark ones (... x regions).
+      other_area_min_quantiles: Color percentiles of regions as bright ones (... x regions).
+      total_brightest_area_min_share: Min share of regions lighter than the darker ones (...).
+
+    Returns:
+      Boolean array of the darker regions (... x regions).
+    """
+    total_area_sum = area_sums.sum()
+    lighter_areas = (
+        np.asarray(target_area_max_quantiles)[..., :, np.newaxis] <=
+        np.asarray(other_area_min_quantiles)[..., np.newaxis, :])
+    # A region is not compared with itself.
+    diagonal = np.arange(len(area_sums))
+    lighter_areas[..., diagonal, diagonal] = False
+    other_area_sums = lighter_areas @ area_sums
+    return (other_area_sums / max(total_area_sum, 1) >
+            np.asarray(total_brightest_area_min_share)[..., np.newaxis])
 
 
 def get_darker_then_most_of_rest(
@@ -28,37 +238,10 @@ def get_darker_then_most_of_rest(
     Returns:
       List af the darkest region binary masks.
     """
-    non_transparent_pixels = img_rgba[:, :, 3] >= alpha_channel_threshold
-    img_gray = skimage.color.rgb2gray(skimage.color.rgba2rgb(img_rgba))
-
-    total_area_sum = 0
-    non_transparent_areas = []
-    non_transparent_area_sums = []
-    area_max_quantiles = []
-    area_min_quantiles = []
-
-    for area_mask in binary_masks:
-        non_transparent_area_mask = np.logical_and(area_mask, non_transparent_pixels)
-        non_transparent_area_mask_sum = non_transparent_area_mask.sum()
-        if non_transparent_area_mask_sum < min_non_transparent_area_mask_sum:
-            continue
-        total_area_sum += non_transparent_area_mask_sum
-        non_transparent_areas.append(non_transparent_area_mask)
-        non_transparent_area_sums.append(non_transparent_area_mask_sum)
-        area_max_quantiles.append(np.quantile(
-            img_gray[non_transparent_area_mask], target_area_max_quantile))
-        area_min_quantiles.append(np.quantile(
-            img_gray[non_transparent_area_mask], other_area_min_quantile))
-
-    darker_area_masks = []
-    for target_area_idx, target_area_mask in enumerate(non_transparent_areas):
-        other_area_sum = 0
-        for other_area_idx, other_area_mask in enumerate(non_transparent_areas):
-            if target_area_idx == other_area_idx:
-                continue
-
-            if area_max_quantiles[target_area_idx] <= area_min_quantiles[other_area_idx]:
-                other_area_sum += non_transparent_area_sums[other_area_idx]
-        if other_area_sum / total_area_sum > total_brightest_area_min_share:
-            darker_area_masks.append(target_area_mask)
-    return darker_area_masks
+    region_stats = compute_region_stats(
+        img_rgba, binary_masks, (target_area_max_quantile, other_area_min_quantile),
+        min_non_transparent_area_mask_sum, alpha_channel_threshold)
+    darker_areas = select_darker_regions(
+        region_stats.area_sums, region_stats.area_quantiles[:, 0], region_stats.area_quantiles[:, 1],
+        total_brightest_area_min_share)
+    return [area_mask for area_mask, is_darker in zip(region_stats.area_masks, darker_areas) if is_darker]
@@ -29,3 +29,41 @@ def get_random_row_col(img_width, img_height, width_margin, height_margin):
         random_col = img_height // 2
 
     return random_row, random_col
+
+
+def get_random_non_overlapping_row_cols(img_height, img_width, obj_shapes, max_attempts=50):
+    """Gets random centers of objects which boxes do not overlap within the image.
+
+    Larger objects are placed first, every object takes the first random
+    position not overlapping already placed ones.
+
+    Args:
+      img_height: Target image height.
+      img_width: Target image width.
+      obj_shapes: Object {height, width} sizes.
+      max_attempts: Number of random positions to try for every object.
+
+    Returns:
+      List of object center rows and columns (None for objects not placed). Too large
+      objects are centered along the dimension they do not fit in.
+    """
+    placed_boxes = []
+    obj_row_cols = [None] * len(obj_shapes)
+    for obj_idx in sorted(range(len(obj_shapes)), key=lambda idx: -obj_shapes[idx][0] * obj_shapes[idx][1]):
+        obj_height, obj_width = obj_shapes[obj_idx][:2]
+        for _ in range(max_attempts):
+            center_row = (
+                random.randint(obj_height // 2, img_height - obj_height + obj_height // 2)
+                if obj_height < img_height else img_height // 2)
+            center_col = (
+                random.randint(obj_width // 2, img_width - obj_width + obj_width // 2)
+                if obj_width < img_width else img_width // 2)
+            top, left = center_row - obj_height // 2, center_col - obj_width // 2
+            box = (top, left, top + obj_height, left + obj_width)
+            if not any(box[0] < placed_box[2] and placed_box[0] < box[2] and
+                       box[1] < placed_box[3] and placed_box[1] < box[3]
+                       for placed_box in placed_boxes):
+                placed_boxes.append(box)
+                obj_row_cols[obj_idx] = (center_row, center_col)
+                break
+    return obj_row_cols
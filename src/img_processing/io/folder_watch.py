@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+
+# Polling of a folder tree for new or changed files with a persistent index of processed ones.
+
+import json
+import logging
+import os
+import pathlib
+import time
+
+
+class FileIndex:
+    """Modification times and sizes of processed files (by relative paths) saved in JSON."""
+
+    def __init__(self, index_path):
+        self.index_path = pathlib.Path(index_path)
+        self.file_stats = {}
+        self.modified = False
+
+    @classmethod
+    def load(cls, index_path):
+        """Loads index (empty one, if there is no readable index)."""
+        file_index = cls(index_path)
+        try:
+            with open(file_index.index_path) as index_file:
+                file_index.file_stats = {
+                    rel_path: tuple(file_stat) for rel_path, file_stat in json.load(index_file).items()}
+        except (OSError, ValueError):
+            pass
+        return file_index
+
+    def __len__(self):
+        return len(self.file_stats)
+
+    def is_processed(self, rel_path, file_stat):
+        return self.file_stats.get(rel_path) == file_stat
+
+    def mark_processed(self, rel_path, file_stat):
+        self.file_stats[rel_path] = file_stat
+        self.modified = True
+
+    def forget(self, rel_path):
+        if self.file_stats.pop(rel_path, None) is not None:
+            self.modified = True
+
+    def save(self):
+        if not self.modified:
+            return
+        tmp_index_path = self.index_path.with_name(self.index_path.name + '.tmp')
+        with open(tmp_index_path, 'w') as index_file:
+            json.dump(self.file_stats, index_file)
+            index_file.flush()
+            os.fsync(index_file.fileno())
+        os.replace(tmp_index_path, self.index_path)
+        self.modified = False
+
+
+class FolderPoller:
+    """Finds files not in the index or changed since they were processed.
+
+    Folders are listed again only when their modification time changes (a file
+    is added, removed or renamed), files being debounced are checked directly,
+    so a poll of a large unchanged tree costs a stat per folder. Full scans also
+    find files rewritten in place and forget removed ones.
+    """
+
+    def __init__(self, root_dir_path, file_index, ignored_suffixes=(), debounce_in_seconds=2.0):
+        """Makes poller.
+
+        Args:
+          root_dir_path: Root of the watched folder tree.
+          file_index: FileIndex of processed files.
+          ignored_suffixes: Suffixes of file names to skip (e.g. outputs written beside inputs).
+          debounce_in_seconds: Time a file size and modification time must stay the same.
+        """
+        self.root_dir_path = pathlib.Path(root_dir_path)
+        self.file_index = file_index
+        self.ignored_suffixes = tuple(ignored_suffixes) + ('.tmp',)
+        self.debounce_in_seconds = debounce_in_seconds
+        # Relative folder paths and their modification times and sub-folder names.
+        self.dir_states = {}
+        # Relative file paths and their (modification time, size) and the time it was seen.
+        self.pending_files = {}
+
+    def _is_ignored(self, file_name):
+        return (file_name.startswith('.') or file_name.endswith(self.ignored_suffixes) or
+                file_name == self.file_index.index_path.name)
+
+    def _scan_dir(self, rel_dir_path, full_scan, listed_files):
+        dir_path = self.root_dir_path / rel_dir_path
+        try:
+            dir_mtime_ns = dir_path.stat().st_mtime_ns
+        except OSError:
+            self.dir_states.pop(rel_dir_path, None)
+            return
+        dir_state = self.dir_states.get(rel_dir_path)
+        if not full_scan and dir_state and dir_state[0] == dir_mtime_ns:
+            sub_dir_names = dir_state[1]
+        else:
+            sub_dir_names = []
+            try:
+                with os.scandir(dir_path) as dir_entries:
+                    for dir_entry in dir_entries:
+                        if dir_entry.is_dir(follow_symlinks=False):
+                            if not dir_entry.name.startswith('.'):
+                                sub_dir_names.append(dir_entry.name)
+                        elif dir_entry.is_file() and not self._is_ignored(dir_entry.name):
+                            listed_files[os.path.join(rel_dir_path, dir_entry.name)] = dir_entry
+            except OSError as error:
+                logging.warning(f'{dir_path} is not listed: {error}')
+                return
+            self.dir_states[rel_dir_path] = (dir_mtime_ns, sub_dir_names)
+        for sub_dir_name in sub_dir_names:
+            self._scan_dir(os.path.join(rel_dir_path, sub_dir_name), full_scan, listed_files)
+
+    def poll(self, full_scan=False):
+        """Finds new or changed files which have not changed for the debounce time.
+
+        Args:
+          full_scan: List all the folders (the first poll always lists them).
+
+        Returns:
+          List of ready file paths, their relative paths and (modification time, size)
+          to mark them as processed in the index.
+        """
+        full_scan = full_scan or not self.dir_states
+        listed_files = {}
+        self._scan_dir('', full_scan, listed_files)
+        if full_scan:
+            for rel_path in set(self.file_index.file_stats) - set(listed_files):
+                self.file_index.forget(rel_path)
+
+        now = time.time()
+        ready_files = []
+        for rel_path in sorted(set(listed_files) | set(self.pending_files)):
+            try:
+                dir_entry = listed_files.get(rel_path)
+                file_stat = dir_entry.stat() if dir_entry else (self.root_dir_path / rel_path).stat()
+            except OSError:
+                self.pending_files.pop(rel_path, None)
+                continue
+            file_stat = (file_stat.st_mtime_ns, file_stat.st_size)
+            if self.file_index.is_processed(rel_path, file_stat):
+                self.pending_files.pop(rel_path, None)
+                continue
+
+            pending_file = self.pending_files.get(rel_path)
+            if pending_file and pending_file[0] == file_stat:
+                is_ready = now - pending_file[1] >= self.debounce_in_seconds
+            else:
+                # A file not modified for the debounce time is ready at once.
+                is_ready = now - file_stat[0] / 1e9 >= self.debounce_in_seconds
+                self.pending_files[rel_path] = (file_stat, now)
+            if is_ready:
+                self.pending_files.pop(rel_path)
+                ready_files.append((self.root_dir_path / rel_path, rel_path, file_stat))
+        return ready_files
@@ -3,14 +3,14 @@
 # Helpers for image reading.
 
 from src.img_processing.base import image
+from src.img_processing.io import rgba_read
 
 import logging
 import os
 import re
 
 import imghdr
-import numpy as np
-import skimage.io
+import PIL.Image
 
 
 def list_image_file_from_dir(
@@ -49,6 +49,22 @@ def list_image_file_from_dir(
             yield from list_image_file_from_dir(dir_path, ignore_non_images, recursive)
 
 
+def read_image_shape(file_path):
+    """Reads image height and width from the file header without decoding pixels.
+
+    Args:
+      file_path: Image file path.
+
+    Returns:
+      Image {height, width} or None, if the file is not a readable image.
+    """
+    try:
+        with PIL.Image.open(str(file_path)) as img:
+            return img.height, img.width
+    except (OSError, ValueError):
+        return None
+
+
 def load_images_from_dir(dir_path, recursive=False, ignore_non_images=False):
     """Loads images from disk skipping auxiliary files.
 
@@ -68,10 +84,7 @@ def load_images_from_dir(dir_path, recursive=False, ignore_non_images=False):
             continue
 
         try:
-            img_rgba = skimage.io.imread(str(file_path))
-            if img_rgba.shape[-1] == 3:
-                img_rgba = np.insert(img_rgba, 3, 255, axis=2)
-            yield image.RawImage(path=file_path, rgba=img_rgba)
+            yield image.RawImage(path=file_path, rgba=rgba_read.read_rgba(file_path))
         except ValueError:
             if not ignore_non_images:
                 logging.warning(f"{file_path} is not an image.")
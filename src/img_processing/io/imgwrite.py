@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+
+# Helpers for image writing.
+
+from src.img_processing.base import memory_budget
+from src.img_processing.io import mask_io
+from src.monitoring import stage_metrics
+
+import logging
+import queue
+import threading
+
+import numpy as np
+import PIL.Image
+
+
+class ImageWriteError(Exception):
+    """Failure of one or more background image writes."""
+
+    def __init__(self, failed_writes):
+        super().__init__('{} image writes failed: {}'.format(
+            len(failed_writes), ', '.join(str(file_path) for file_path, _ in failed_writes[:5])))
+        self.failed_writes = failed_writes
+
+
+def write_image(file_path, pixels, file_format='png', png_compress_level=6):
+    """Writes image array to the file.
+
+    Args:
+      file_path: Output file path.
+      pixels: Image array (gray, RGB or RGBa).
+      file_format: 'png', uncompressed 'npy' or None for the format of the file extension.
+      png_compress_level: Zlib compression level [0..9] of PNG files.
+    """
+    if file_format == AsyncImageWriter.NPY_FORMAT:
+        np.save(str(file_path), pixels, allow_pickle=False)
+    elif file_format is None:
+        PIL.Image.fromarray(pixels).save(str(file_path))
+    else:
+        PIL.Image.fromarray(pixels).save(
+            str(file_path), format='PNG', compress_level=png_compress_level)
+
+
+class AsyncImageWriter:
+    """Writes images in a thread pool fed through a bounded queue.
+
+    Binary masks queued with write_mask are written in the mask format
+    (1-bit PNG or bit-packed *.bmask) or as other images, if it is None.
+    """
+
+    PNG_FORMAT = 'png'
+    NPY_FORMAT = 'npy'
+    FILE_FORMATS = (PNG_FORMAT, NPY_FORMAT)
+
+    def __init__(self, num_threads=4, max_queue_size=64,
+                 file_format=PNG_FORMAT, png_compress_level=6, mask_format=None):
+        if file_format not in self.FILE_FORMATS:
+            raise ValueError(f'Unsupported {file_format} image format.')
+        if mask_format is not None and mask_format not in mask_io.MASK_FORMATS:
+            raise ValueError(f'Unsupported {mask_format} mask format.')
+        self.file_format = file_format
+        self.mask_format = mask_format
+        self.png_compress_level = png_compress_level
+
+        self.write_queue = queue.Queue(maxsize=max_queue_size)
+        self.failed_writes = []
+        self.failed_writes_lock = threading.Lock()
+        self.write_threads = [
+            threading.Thread(target=self._write_queued, name=f'image-writer-{thread_idx}', daemon=True)
+            for thread_idx in range(max(1, num_threads))]
+        for write_thread in self.write_threads:
+            write_thread.start()
+
+    @property
+    def file_ext(self):
+        return self.file_format
+
+    @property
+    def mask_file_ext(self):
+        return self.mask_format or self.file_format
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        try:
+            self.close()
+        except ImageWriteError:
+            if exc_type is None:
+                raise
+            logging.exception('Image writes failed while handling another error.')
+
+    def _write_queued(self):
+        while True:
+            write_job = self.write_queue.get()
+            try:
+                if write_job is None:
+                    return
+                file_path, pixels, is_mask = write_job
+                with stage_metrics.get_metrics().stage('write'):
+                    if is_mask and self.mask_format:
+                        mask_io.write_mask(file_path, pixels, self.mask_format, self.png_compress_level)
+                    else:
+                        write_image(file_path, pixels, self.file_format, self.png_compress_level)
+            except Exception as write_error:
+                with self.failed_writes_lock:
+                    self.failed_writes.append((write_job[0], write_error))
+            finally:
+                if write_job is not None:
+                    memory_budget.get_memory_accountant().release(
+                        memory_budget.MemoryAccountant.WRITE_QUEUE, write_job[1].nbytes)
+                self.write_queue.task_done()
+
+    def write(self, file_path, pixels, is_mask=False):
+        """Queues the image array to be written.
+
+        Blocks while the queue is full or queued arrays exceed the memory budget.
+        The array must not be modified after that.
+        """
+        if not self.write_threads:
+            raise ValueError('Image writer is closed.')
+        memory_budget.get_memory_accountant().acquire(
+            memory_budget.MemoryAccountant.WRITE_QUEUE, pixels.nbytes)
+        self.write_queue.put((file_path, pixels, is_mask))
+
+    def write_mask(self, file_path, mask):
+        """Queues the binary mask array to be written in the mask format (see write)."""
+        self.write(file_path, mask, is_mask=True)
+
+    def flush(self):
+        """Waits for all the queued images to be written.
+
+        Raises:
+          ImageWriteError: Some of the writes since the last flush failed.
+        """
+        self.write_queue.join()
+        with self.failed_writes_lock:
+            failed_writes, self.failed_writes = self.failed_writes, []
+        if failed_writes:
+            raise ImageWriteError(failed_writes)
+
+    def close(self):
+        """Flushes queued images and stops writing threads."""
+        if not self.write_threads:
+            return
+        try:
+            self.flush()
+        finally:
+            for _ in self.write_threads:
+                self.write_queue.put(None)
+            for write_thread in self.write_threads:
+                write_thread.join()
+            self.write_threads = []
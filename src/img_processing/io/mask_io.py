@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+
+# Binary mask files: bit-packed *.bmask and 1-bit PNG.
+
+import io
+import os
+import struct
+
+import numpy as np
+import PIL.Image
+
+
+PNG_FORMAT = 'png'
+BMASK_FORMAT = 'bmask'
+MASK_FORMATS = (PNG_FORMAT, BMASK_FORMAT)
+
+# Magic, height and width followed by row-major bits of the mask padded to bytes.
+BMASK_MAGIC = b'BMSK'
+BMASK_HEADER = struct.Struct('<4sII')
+
+
+class MaskFileError(ValueError):
+    """Mask file is malformed or truncated."""
+
+
+def pack_mask(mask):
+    """Encodes binary mask (non-zero pixels) to *.bmask bytes."""
+    mask = np.asarray(mask)
+    if mask.ndim == 3:
+        mask = mask[:, :, 0]
+    return BMASK_HEADER.pack(BMASK_MAGIC, mask.shape[0], mask.shape[1]) + np.packbits(mask != 0).tobytes()
+
+
+def get_packed_mask_size(mask_shape):
+    return BMASK_HEADER.size + (mask_shape[0] * mask_shape[1] + 7) // 8
+
+
+def _unpack_header(header_bytes, file_name='mask'):
+    if len(header_bytes) < BMASK_HEADER.size:
+        raise MaskFileError(f'{file_name} header is truncated.')
+    magic, height, width = BMASK_HEADER.unpack_from(header_bytes)
+    if magic != BMASK_MAGIC:
+        raise MaskFileError(f'{file_name} is not a bit-packed mask.')
+    return height, width
+
+
+def unpack_mask(packed_bytes, file_name='mask'):
+    """Decodes *.bmask bytes to boolean mask.
+
+    Raises:
+      MaskFileError: The bytes are not a complete bit-packed mask.
+    """
+    height, width = _unpack_header(packed_bytes, file_name)
+    if len(packed_bytes) != get_packed_mask_size((height, width)):
+        raise MaskFileError(f'{file_name} holds {len(packed_bytes)} of '
+                            f'{get_packed_mask_size((height, width))} bytes.')
+    return np.unpackbits(
+        np.frombuffer(packed_bytes, dtype=np.uint8, offset=BMASK_HEADER.size),
+        count=height * width).reshape(height, width).astype(bool)
+
+
+def read_bmask_shape(file_path):
+    """Reads mask {height, width} from *.bmask header and checks the file holds all the mask bytes.
+
+    Raises:
+      MaskFileError: The file is malformed or truncated.
+    """
+    with open(file_path, 'rb') as bmask_file:
+        mask_shape = _unpack_header(bmask_file.read(BMASK_HEADER.size), file_path)
+        file_size = os.fstat(bmask_file.fileno()).st_size
+    if file_size != get_packed_mask_size(mask_shape):
+        raise MaskFileError(
+            f'{file_path} holds {file_size} of {get_packed_mask_size(mask_shape)} bytes.')
+    return mask_shape
+
+
+def _to_1bit_image(mask):
+    mask = np.asarray(mask)
+    if mask.ndim == 3:
+        mask = mask[:, :, 0]
+    return PIL.Image.fromarray(mask != 0)
+
+
+def encode_mask_png(mask, png_compress_level=6):
+    """Encodes binary mask (non-zero pixels) to 1-bit PNG bytes."""
+    png_bytes = io.BytesIO()
+    _to_1bit_image(mask).save(png_bytes, format='PNG', compress_level=png_compress_level)
+    return png_bytes.getvalue()
+
+
+def get_mask_format(file_path):
+    return BMASK_FORMAT if str(file_path).endswith('.' + BMASK_FORMAT) else PNG_FORMAT
+
+
+def write_mask(file_path, mask, mask_format=None, png_compress_level=6):
+    """Writes binary mask.
+
+    Args:
+      file_path: Output file path.
+      mask: Mask array (non-zero pixels are set).
+      mask_format: 'bmask', 1-bit 'png' or None for the format of the file extension.
+      png_compress_level: Zlib compression level [0..9] of PNG files.
+    """
+    if (mask_format or get_mask_format(file_path)) == BMASK_FORMAT:
+        with open(file_path, 'wb') as bmask_file:
+            bmask_file.write(pack_mask(mask))
+    else:
+        _to_1bit_image(mask).save(str(file_path), format='PNG', compress_level=png_compress_level)
+
+
+def read_mask(file_path):
+    """Reads binary mask from *.bmask or any PIL image file (non-zero pixels of the first channel).
+
+    Returns:
+      Boolean mask array.
+
+    Raises:
+      MaskFileError: The *.bmask file is malformed or truncated.
+      OSError: The image file is not readable.
+    """
+    if get_mask_format(file_path) == BMASK_FORMAT:
+        with open(file_path, 'rb') as bmask_file:
+            return unpack_mask(bmask_file.read(), file_path)
+    with PIL.Image.open(str(file_path)) as mask_img:
+        mask = np.asarray(mask_img)
+    if mask.ndim == 3:
+        mask = mask[:, :, 0]
+    return mask != 0
@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+
+# Decoding of gray, RGB, RGBa and 16-bit images into HxWx4 uint8 RGBa-arrays.
+
+import io
+
+import cv2
+import numpy as np
+
+
+_UINT8_TO_RGBA_CONVERSIONS = {1: cv2.COLOR_GRAY2RGBA, 3: cv2.COLOR_BGR2RGBA, 4: cv2.COLOR_BGRA2RGBA}
+
+
+def _get_num_channels(pixels):
+    return pixels.shape[2] if pixels.ndim == 3 else 1
+
+
+def _check_rgba_out(pixels, out):
+    expected_shape = (pixels.shape[0], pixels.shape[1], 4)
+    if out is None:
+        return np.empty(expected_shape, dtype=np.uint8)
+    if out.shape != expected_shape or out.dtype != np.uint8:
+        raise ValueError(f'{out.shape} {out.dtype} buffer does not fit {expected_shape} RGBa-image.')
+    return out
+
+
+def _copy_to_uint8(channel, out_channel):
+    if channel.dtype == np.uint8:
+        np.copyto(out_channel, channel)
+    elif channel.dtype == np.uint16:
+        np.right_shift(channel, 8, out=out_channel, casting='unsafe')
+    elif channel.dtype == np.bool_:
+        np.multiply(channel, 255, out=out_channel, casting='unsafe')
+    elif np.issubdtype(channel.dtype, np.floating):
+        np.multiply(np.clip(channel, 0.0, 1.0), 255, out=out_channel, casting='unsafe')
+    else:
+        raise ValueError(f'Unsupported {channel.dtype} image pixels.')
+
+
+def to_rgba(pixels, out=None, bgr=False):
+    """Converts gray, gray with alpha, RGB or RGBa array into RGBa-array.
+
+    Args:
+      pixels: HxW or HxWxC (C in 1..4) array of uint8, uint16, bool or [0..1] float pixels.
+      out: HxWx4 uint8 array to write to (allocated, if None).
+      bgr: Color channels are in BGR(A) order as OpenCV decodes them.
+
+    Returns:
+      HxWx4 uint8 RGBa-array (the output array).
+    """
+    num_channels = _get_num_channels(pixels)
+    if num_channels not in (1, 2, 3, 4):
+        raise ValueError(f'Unsupported {pixels.shape} image shape.')
+    out = _check_rgba_out(pixels, out)
+
+    if pixels.dtype == np.uint8 and num_channels != 2 and (bgr or num_channels == 1):
+        cv2.cvtColor(pixels, _UINT8_TO_RGBA_CONVERSIONS[num_channels], dst=out)
+        return out
+    if pixels.dtype == np.uint8 and num_channels == 4:
+        np.copyto(out, pixels)
+        return out
+
+    if num_channels <= 2:
+        gray = pixels if pixels.ndim == 2 else pixels[:, :, 0]
+        _copy_to_uint8(gray, out[:, :, 0])
+        out[:, :, 1] = out[:, :, 0]
+        out[:, :, 2] = out[:, :, 0]
+    else:
+        for out_channel_idx, channel_idx in enumerate((2, 1, 0) if bgr else (0, 1, 2)):
+            _copy_to_uint8(pixels[:, :, channel_idx], out[:, :, out_channel_idx])
+    if num_channels in (2, 4):
+        _copy_to_uint8(pixels[:, :, num_channels - 1], out[:, :, 3])
+    else:
+        out[:, :, 3] = 255
+    return out
+
+
+def read_rgba(file_path, out=None):
+    """Decodes image file into RGBa-array.
+
+    OpenCV decodes the file keeping its channels and bit depth into its own
+    buffer (Python bindings take no destination), so only 8-bit RGBa is
+    converted in place. Gray, RGB and 16-bit images cost two allocations:
+    the decoded buffer and the output array it is expanded into at once
+    (pass a reused out not to allocate the latter).
+
+    Args:
+      file_path: Image file path.
+      out: HxWx4 uint8 array to decode to (allocated, if None).
+
+    Returns:
+      HxWx4 uint8 RGBa-array.
+
+    Raises:
+      ValueError: The file is not a readable image.
+    """
+    return _decoded_to_rgba(
+        cv2.imread(str(file_path), cv2.IMREAD_UNCHANGED), lambda: _imread_with_skimage(str(file_path)),
+        file_path, out)
+
+
+def decode_rgba(encoded_bytes, out=None):
+    """Decodes image file content into RGBa-array.
+
+    Decoded buffers are converted as read_rgba converts them.
+
+    Args:
+      encoded_bytes: Bytes of an image file.
+      out: HxWx4 uint8 array to decode to (allocated, if None).
+
+    Returns:
+      HxWx4 uint8 RGBa-array.
+
+    Raises:
+      ValueError: The bytes are not a readable image.
+    """
+    encoded_buffer = np.frombuffer(encoded_bytes, dtype=np.uint8)
+    pixels = cv2.imdecode(encoded_buffer, cv2.IMREAD_UNCHANGED) if encoded_buffer.size else None
+    return _decoded_to_rgba(
+        pixels, lambda: _imread_with_skimage(io.BytesIO(encoded_bytes)), 'Image content', out)
+
+
+def _imread_with_skimage(image_file):
+    # skimage is imported only for the rare formats OpenCV does not decode.
+    import skimage.io
+
+    return skimage.io.imread(image_file)
+
+
+def _decoded_to_rgba(pixels, fallback_imread, image_name, out):
+    if pixels is None:
+        # Formats OpenCV does not decode (e.g. GIF).
+        # noinspection PyBroadException
+        try:
+            pixels = fallback_imread()
+        except Exception as error:
+            raise ValueError(f'{image_name} is not an image: {error}')
+        if pixels.ndim == 4:
+            pixels = pixels[0]  # The first frame of an animation.
+        return to_rgba(pixels, out=out)
+
+    if out is None and pixels.dtype == np.uint8 and _get_num_channels(pixels) == 4:
+        return cv2.cvtColor(pixels, cv2.COLOR_BGRA2RGBA, dst=pixels)
+    # Other images are expanded from the decoded buffer into the output array.
+    return to_rgba(pixels, out=out, bgr=True)
@@ -31,20 +31,37 @@ def get_random_tile_row_col(
     """Gets row and column of the randomly cropped tile.
 
     Args:
-      c: Cropped tile {height, width}.
+      tile_shape: Cropped tile {height, width}.
       target_shape: Target image {height, width}.
       target_paddings: Left, right, top and bottom paddings in the target image.
 
     Returns:
       Row and column offsets of the randomly cropped tile to fit the source image.
     """
+    tile_rows, tile_cols = get_tile_row_col_ranges(tile_shape, target_shape, target_paddings)
+    return random.choice(tile_rows), random.choice(tile_cols)
+
+
+def get_tile_row_col_ranges(
+        tile_shape, target_shape, target_paddings=image_parts.Paddings.zeros()):
+    """Gets all the rows and columns where the tile can be cropped.
+
+    Args:
+      tile_shape: Cropped tile {height, width}.
+      target_shape: Target image {height, width}.
+      target_paddings: Left, right, top and bottom paddings in the target image.
+
+    Returns:
+      Ranges of row and column offsets of the tile fitting the source image
+      (single zero offsets, if the tile does not fit).
+    """
     tile_width, tile_height = tile_shape[1], tile_shape[0]
     img_width, img_height = target_shape[1], target_shape[0]
     if not any_tile_fit(tile_shape, target_shape, target_paddings):
-        return 0, 0
+        return range(0, 1), range(0, 1)
 
-    random_tile_row = random.randrange(
-        target_paddings.top, img_height - max(tile_height, target_paddings.bottom))
-    random_tile_col = random.randrange(
-        target_paddings.left, img_width - max(tile_width, target_paddings.right))
-    return random_tile_row, random_tile_col
+    tile_rows = range(target_paddings.top, max(
+        target_paddings.top + 1, img_height - max(tile_height, target_paddings.bottom)))
+    tile_cols = range(target_paddings.left, max(
+        target_paddings.left + 1, img_width - max(tile_width, target_paddings.right)))
+    return tile_rows, tile_cols
@@ -1,6 +1,8 @@
 #!/usr/bin/python3
 
 from src.img_processing.editing import cropping
+from src.img_processing.io import imgwrite
+from src.img_processing.io import rgba_read
 from src.img_processing.tiling import tile_breaking
 
 import argparse
@@ -8,8 +10,6 @@ import os
 import pathlib
 import sys
 
-import skimage.io
-
 
 def parse_args(argv):
     # Parse input arguments.
@@ -35,12 +35,12 @@ def main(argv):
     tile_width = parses_args.tile_width
     tile_height = parses_args.tile_height
 
-    img_rgba = skimage.io.imread(str(input_img_path))
+    img_rgba = rgba_read.read_rgba(input_img_path)
     tile_top_left_row, tile_top_left_col = (
         tile_breaking.get_random_tile_row_col((tile_height, tile_width), img_rgba.shape))
     tile_rgba = cropping.crop_rgba(
         img_rgba, tile_top_left_row, tile_top_left_col, tile_width, tile_height)
-    skimage.io.imsave(str(output_img_path), tile_rgba)
+    imgwrite.write_image(output_img_path, tile_rgba, file_format=None)
 
     return os.EX_OK
 
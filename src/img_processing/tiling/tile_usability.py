@@ -0,0 +1,206 @@
+#!/usr/bin/python3
+
+# Index of tile positions on opaque textured areas of target images.
+
+import collections
+import json
+import logging
+import os
+import pathlib
+import tempfile
+import zipfile
+
+import numpy as np
+
+
+# Min share of opaque tile pixels, min standard deviation of their luminance
+# and alpha channel threshold [0..255] of opaque pixels.
+TileUsabilityCriteria = collections.namedtuple('TileUsabilityCriteria', [
+    'min_opaque_share', 'min_luminance_std', 'alpha_channel_threshold'])
+
+LUMINANCE_WEIGHTS = np.array([0.299, 0.587, 0.114])
+
+
+def summed_area_table(values):
+    """Gets summed-area table padded with zero top row and left column.
+
+    Sum of values[top:bottom, left:right] is then
+    sat[bottom, right] - sat[top, right] - sat[bottom, left] + sat[top, left].
+    """
+    sat = np.zeros((values.shape[0] + 1, values.shape[1] + 1), dtype=np.int64)
+    np.cumsum(values, axis=0, dtype=np.int64, out=sat[1:, 1:])
+    np.cumsum(sat[1:, 1:], axis=1, out=sat[1:, 1:])
+    return sat
+
+
+def get_tile_sums(sat, tile_shape, tile_rows, tile_cols):
+    """Gets sums of all the tiles with top-left corners in the row and column ranges (step 1)."""
+    tile_height, tile_width = tile_shape[:2]
+    top, left = tile_rows.start, tile_cols.start
+    bottom, right = top + tile_height, left + tile_width
+    num_rows, num_cols = len(tile_rows), len(tile_cols)
+    return (sat[bottom:bottom + num_rows, right:right + num_cols] -
+            sat[top:top + num_rows, right:right + num_cols] -
+            sat[bottom:bottom + num_rows, left:left + num_cols] +
+            sat[top:top + num_rows, left:left + num_cols])
+
+
+class TileUsability:
+    """Bits of usable tile positions of one target checked in O(1)."""
+
+    CACHE_FILE_SUFFIX = '.tile_usability.npz'
+
+    def __init__(self, tile_rows, tile_cols, usable_bits):
+        """Makes index.
+
+        Args:
+          tile_rows: Range of tile top-left rows.
+          tile_cols: Range of tile top-left columns.
+          usable_bits: Packed (row-major) bits of usable positions.
+        """
+        self.tile_rows = tile_rows
+        self.tile_cols = tile_cols
+        self.usable_bits = usable_bits
+        self.num_usable = int(np.unpackbits(
+            usable_bits, count=len(tile_rows) * len(tile_cols)).sum())
+
+    def __len__(self):
+        return len(self.tile_rows) * len(self.tile_cols)
+
+    @classmethod
+    def from_rgba(cls, rgba, tile_shape, tile_rows, tile_cols, criteria):
+        """Finds usable tile positions with summed-area tables of opaque pixels and their luminance.
+
+        Args:
+          rgba: Target image RGBa-array.
+          tile_shape: Cropped tile {height, width}.
+          tile_rows: Range of tile top-left rows.
+          tile_cols: Range of tile top-left columns.
+          criteria: TileUsabilityCriteria.
+        """
+        tile_num_pixels = tile_shape[0] * tile_shape[1]
+        opaque_pixels = rgba[:, :, 3] >= criteria.alpha_channel_threshold
+        num_opaque = get_tile_sums(summed_area_table(opaque_pixels), tile_shape, tile_rows, tile_cols)
+        usable = num_opaque >= criteria.min_opaque_share * tile_num_pixels
+        usable &= num_opaque > 0
+
+        if criteria.min_luminance_std > 0:
+            luminance = np.rint(rgba[:, :, :3] @ LUMINANCE_WEIGHTS).astype(np.int64)
+            luminance[~opaque_pixels] = 0
+            num_opaque = np.maximum(num_opaque, 1).astype(np.float64)
+            luminance_means = get_tile_sums(
+                summed_area_table(luminance), tile_shape, tile_rows, tile_cols) / num_opaque
+            luminance_variances = get_tile_sums(
+                summed_area_table(luminance * luminance), tile_shape, tile_rows, tile_cols
+            ) / num_opaque - luminance_means * luminance_means
+            usable &= luminance_variances >= criteria.min_luminance_std ** 2
+
+        return cls(tile_rows, tile_cols, np.packbits(usable.ravel()))
+
+    def is_usable(self, tile_top_left_rows, tile_top_left_cols):
+        """Checks tile positions (arrays of rows and columns)."""
+        row_idx = np.asarray(tile_top_left_rows, dtype=np.int64) - self.tile_rows.start
+        col_idx = np.asarray(tile_top_left_cols, dtype=np.int64) - self.tile_cols.start
+        within = ((row_idx >= 0) & (row_idx < len(self.tile_rows)) &
+                  (col_idx >= 0) & (col_idx < len(self.tile_cols)))
+        bit_idx = np.where(within, row_idx * len(self.tile_cols) + col_idx, 0)
+        usable_bytes = self.usable_bits[bit_idx >> 3].astype(np.int64)
+        return within & (((usable_bytes >> (7 - (bit_idx & 7))) & 1) == 1)
+
+    def get_usable_row_cols(self):
+        """Gets rows and columns of all the usable tile positions."""
+        row_idx, col_idx = np.divmod(np.flatnonzero(np.unpackbits(
+            self.usable_bits, count=len(self))), len(self.tile_cols))
+        return self.tile_rows.start + row_idx, self.tile_cols.start + col_idx
+
+    @classmethod
+    def get_cache_path(cls, target_path):
+        target_path = pathlib.Path(target_path)
+        return target_path.with_name(target_path.name + cls.CACHE_FILE_SUFFIX)
+
+    @staticmethod
+    def get_cache_key(target_path, tile_shape, tile_rows, tile_cols, criteria):
+        target_stat = os.stat(target_path)
+        return json.dumps({
+            'target_mtime_ns': target_stat.st_mtime_ns, 'target_size': target_stat.st_size,
+            'tile_shape': list(tile_shape[:2]),
+            'tile_rows': [tile_rows.start, len(tile_rows)], 'tile_cols': [tile_cols.start, len(tile_cols)],
+            'criteria': criteria._asdict(),
+        }, sort_keys=True)
+
+    def save(self, cache_path, cache_key):
+        # Processes indexing the same target write their own temporary files.
+        cache_path = pathlib.Path(cache_path)
+        tmp_cache_fd, tmp_cache_path = tempfile.mkstemp(
+            prefix=cache_path.name + '.', suffix='.tmp', dir=cache_path.parent)
+        try:
+            with os.fdopen(tmp_cache_fd, 'wb') as cache_file:
+                np.savez(cache_file, usable_bits=self.usable_bits, cache_key=np.array(cache_key))
+            os.replace(tmp_cache_path, cache_path)
+        except BaseException:
+            os.unlink(tmp_cache_path)
+            raise
+
+    @classmethod
+    def load(cls, cache_path, cache_key, tile_rows, tile_cols):
+        """Loads index, if it is cached with the same key (None for missing or corrupt cache)."""
+        try:
+            with np.load(str(cache_path)) as cached_usability:
+                if str(cached_usability['cache_key']) != cache_key:
+                    return None
+                return cls(tile_rows, tile_cols, cached_usability['usable_bits'])
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            return None
+
+
+def get_tile_usability(target_image_file, tile_shape, tile_rows, tile_cols, criteria):
+    """Loads cached index of the target or builds and caches it beside the target.
+
+    Args:
+      target_image_file: Target ImageFile.
+      tile_shape: Cropped tile {height, width}.
+      tile_rows: Range of tile top-left rows.
+      tile_cols: Range of tile top-left columns.
+      criteria: TileUsabilityCriteria.
+
+    Returns:
+      TileUsability or None, if the target is malformed.
+    """
+    cache_path = TileUsability.get_cache_path(target_image_file.path)
+    cache_key = TileUsability.get_cache_key(
+        target_image_file.path, tile_shape, tile_rows, tile_cols, criteria)
+    tile_usability = TileUsability.load(cache_path, cache_key, tile_rows, tile_cols)
+    if tile_usability is not None:
+        return tile_usability
+
+    target_image = target_image_file.load()
+    if not target_image:
+        return None
+    with target_image:
+        tile_usability = TileUsability.from_rgba(
+            target_image.rgba, tile_shape, tile_rows, tile_cols, criteria)
+    try:
+        tile_usability.save(cache_path, cache_key)
+    except OSError as error:
+        logging.warning(f'Tile usability of {target_image_file} is not cached: {error}')
+    return tile_usability
+
+
+def are_tiles_usable(tile_usabilities, target_idx, tile_top_left_rows, tile_top_left_cols):
+    """Checks tile positions of several targets.
+
+    Args:
+      tile_usabilities: TileUsability per target.
+      target_idx: Array of target indices.
+      tile_top_left_rows: Array of tile rows.
+      tile_top_left_cols: Array of tile columns.
+
+    Returns:
+      Boolean array of usable tiles.
+    """
+    usable = np.zeros(len(target_idx), dtype=bool)
+    for target_idx_value in np.unique(target_idx):
+        target_tiles = np.flatnonzero(target_idx == target_idx_value)
+        usable[target_tiles] = tile_usabilities[target_idx_value].is_usable(
+            tile_top_left_rows[target_tiles], tile_top_left_cols[target_tiles])
+    return usable
@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+
+# Progress of dataset generation to resume or append it.
+
+import json
+import os
+import random
+
+
+class GenerationCheckpoint:
+    """Generation parameters and progress saved in the output folder."""
+
+    FILE_NAME = 'generation_checkpoint.json'
+
+    def __init__(self, generation_params=None, seed=0):
+        self.generation_params = generation_params or {}
+        self.seed = seed
+
+        self.num_of_outputs = 0
+        self.param_space_size = 0
+        self.next_draw_idx = 0
+        self.output_idx = 0
+        self.failed_output_idx = 0
+        self.subdir_name_len = 0
+        self.sample_index_file_name = ''
+        self.random_state = None
+
+    def __repr__(self):
+        return '{} of {} outputs ({} drawn)'.format(
+            self.output_idx, self.num_of_outputs, self.next_draw_idx)
+
+    def capture_random_state(self):
+        version, internal_state, gauss_next = random.getstate()
+        self.random_state = [version, list(internal_state), gauss_next]
+
+    def restore_random_state(self):
+        if self.random_state:
+            version, internal_state, gauss_next = self.random_state
+            random.setstate((version, tuple(internal_state), gauss_next))
+
+    def save(self, dir_path, file_name=None):
+        checkpoint_path = dir_path / (file_name or self.FILE_NAME)
+        tmp_checkpoint_path = checkpoint_path.with_name(checkpoint_path.name + '.tmp')
+        with open(tmp_checkpoint_path, 'w') as checkpoint_file:
+            json.dump(self.__dict__, checkpoint_file)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(tmp_checkpoint_path, checkpoint_path)
+
+    @classmethod
+    def load(cls, dir_path, file_name=None):
+        """Loads checkpoint from the folder.
+
+        Args:
+          dir_path: Output folder of the generation.
+          file_name: Checkpoint file name of a generated partition (optional).
+
+        Returns:
+          GenerationCheckpoint or None, if there is no readable checkpoint.
+        """
+        try:
+            with open(dir_path / (file_name or cls.FILE_NAME)) as checkpoint_file:
+                saved_fields = json.load(checkpoint_file)
+        except (OSError, ValueError):
+            return None
+
+        checkpoint = cls()
+        checkpoint.__dict__.update(saved_fields)
+        return checkpoint
@@ -0,0 +1,182 @@
+#!/usr/bin/python3
+
+# Partitions of dataset generation split between nodes and manifests of their outputs.
+
+import hashlib
+import json
+import os
+import re
+
+
+PARTITION_RE = re.compile(r'^(?P<idx>\d+)/(?P<num>\d+)$')
+
+
+def parse_partition(partition_text):
+    """Parses 'k/N' partition.
+
+    Returns:
+      Partition index [0..N) and number of partitions or None, if the text is malformed.
+    """
+    partition_match = PARTITION_RE.match(partition_text.strip())
+    if not partition_match:
+        return None
+    partition_idx, num_partitions = int(partition_match.group('idx')), int(partition_match.group('num'))
+    if not 0 <= partition_idx < num_partitions:
+        return None
+    return partition_idx, num_partitions
+
+
+def get_partition_prefix(partition_idx, num_partitions):
+    """Gets prefix of partition subfolder and file names (empty, if there is one partition)."""
+    if num_partitions <= 1:
+        return ''
+    return 'p{:0{}d}of{}'.format(partition_idx, len(str(num_partitions - 1)), num_partitions)
+
+
+def get_partition_num_of_outputs(num_of_outputs, partition_idx, num_partitions):
+    """Gets share of the outputs generated by the partition (the first ones take the remainder)."""
+    return max(0, num_of_outputs - partition_idx + num_partitions - 1) // num_partitions
+
+
+def get_partition_file_name(partition_prefix, file_name):
+    return f'{partition_prefix}.{file_name}' if partition_prefix else file_name
+
+
+def list_partition_paths(dir_path, partition_prefix):
+    """Lists partition subfolders and files: <prefix>, <prefix>-* and <prefix>.*."""
+    if not partition_prefix or not dir_path.is_dir():
+        return []
+    return sorted(
+        path for path in dir_path.iterdir()
+        if path.name == partition_prefix or path.name.startswith((partition_prefix + '-', partition_prefix + '.')))
+
+
+def hash_file_list(file_paths, with_sizes=True):
+    """Hashes file paths relative to their common folder (and file sizes).
+
+    Nodes mounting the same files at different paths get the same hash.
+
+    Returns:
+      Hex digest of the ordered file list.
+    """
+    file_paths = [str(file_path) for file_path in file_paths]
+    common_dir_path = (
+        os.path.commonpath([os.path.dirname(file_path) for file_path in file_paths]) if file_paths else '')
+    file_list_hash = hashlib.sha256()
+    for file_path in file_paths:
+        file_list_hash.update(os.path.relpath(file_path, common_dir_path).encode())
+        if with_sizes:
+            file_list_hash.update(b'\0%d' % os.path.getsize(file_path))
+        file_list_hash.update(b'\n')
+    return file_list_hash.hexdigest()
+
+
+class GenerationManifest:
+    """Outputs of generated partitions saved in the output folder."""
+
+    FILE_NAME = 'generation_manifest.json'
+
+    def __init__(self, generation_params=None, seed=0, partitions=()):
+        self.generation_params = generation_params or {}
+        self.seed = seed
+        self.partitions = [list(partition) for partition in partitions]
+
+        self.num_of_outputs = 0
+        self.output_idx = 0
+        self.failed_output_idx = 0
+        self.subdir_names = []
+        self.sample_index_file_names = []
+
+    def __repr__(self):
+        return '{} of {} outputs of {} partitions'.format(
+            self.output_idx, self.num_of_outputs,
+            ', '.join(f'{partition_idx}/{num_partitions}'
+                      for partition_idx, num_partitions in self.partitions))
+
+    @property
+    def is_complete(self):
+        return self.output_idx >= self.num_of_outputs
+
+    @classmethod
+    def from_checkpoint(cls, checkpoint, partition_idx, num_partitions, subdir_names):
+        """Makes manifest of one partition from its generation checkpoint."""
+        manifest = cls(checkpoint.generation_params, checkpoint.seed, [(partition_idx, num_partitions)])
+        manifest.num_of_outputs = checkpoint.num_of_outputs
+        manifest.output_idx = checkpoint.output_idx
+        manifest.failed_output_idx = checkpoint.failed_output_idx
+        manifest.subdir_names = list(subdir_names)
+        manifest.sample_index_file_names = [checkpoint.sample_index_file_name]
+        return manifest
+
+    def save(self, dir_path, file_name=None):
+        manifest_path = dir_path / (file_name or self.FILE_NAME)
+        tmp_manifest_path = manifest_path.with_name(manifest_path.name + '.tmp')
+        with open(tmp_manifest_path, 'w') as manifest_file:
+            json.dump(self.__dict__, manifest_file, indent=2, sort_keys=True)
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+        os.replace(tmp_manifest_path, manifest_path)
+
+    @classmethod
+    def load(cls, manifest_path):
+        """Loads manifest.
+
+        Returns:
+          GenerationManifest or None, if there is no readable manifest.
+        """
+        try:
+            with open(manifest_path) as manifest_file:
+                saved_fields = json.load(manifest_file)
+        except (OSError, ValueError):
+            return None
+
+        manifest = cls()
+        manifest.__dict__.update(saved_fields)
+        return manifest
+
+    @classmethod
+    def list_partition_manifest_paths(cls, dir_path):
+        return sorted(dir_path.glob('*.' + cls.FILE_NAME))
+
+
+def merge_manifests(manifests):
+    """Merges manifests of disjoint partitions of the same generation.
+
+    Args:
+      manifests: Collection of GenerationManifest.
+
+    Returns:
+      Merged GenerationManifest and sorted indices of missing partitions.
+
+    Raises:
+      ValueError: Manifests are of different generations or overlapping partitions.
+    """
+    if not manifests:
+        raise ValueError('No manifests to merge.')
+    first_manifest = manifests[0]
+    num_partitions = first_manifest.partitions[0][1]
+    merged_manifest = GenerationManifest(first_manifest.generation_params, first_manifest.seed)
+    for manifest in manifests:
+        if (manifest.generation_params != first_manifest.generation_params or
+                manifest.seed != first_manifest.seed):
+            raise ValueError(f'{manifest} is generated with other parameters or seed.')
+        for partition_idx, manifest_num_partitions in manifest.partitions:
+            if manifest_num_partitions != num_partitions:
+                raise ValueError(f'{manifest} is split into other number of partitions.')
+            if [partition_idx, num_partitions] in merged_manifest.partitions:
+                raise ValueError(f'{partition_idx}/{num_partitions} partition is merged twice.')
+            merged_manifest.partitions.append([partition_idx, num_partitions])
+        merged_manifest.num_of_outputs += manifest.num_of_outputs
+        merged_manifest.output_idx += manifest.output_idx
+        merged_manifest.failed_output_idx += manifest.failed_output_idx
+        merged_manifest.subdir_names.extend(manifest.subdir_names)
+        merged_manifest.sample_index_file_names.extend(manifest.sample_index_file_names)
+
+    merged_manifest.partitions.sort()
+    merged_manifest.subdir_names.sort()
+    if len(set(merged_manifest.subdir_names)) != len(merged_manifest.subdir_names):
+        raise ValueError('Partitions share subfolder names.')
+    missing_partitions = sorted(
+        set(range(num_partitions)) -
+        {partition_idx for partition_idx, _ in merged_manifest.partitions})
+    return merged_manifest, missing_partitions
@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+
+# The script to merge dataset partitions generated by src_rotate_resize_to_target_main --partition k/N.
+#
+# Usage:
+#   python generation_merge_main.py \
+#     --dataset_dirs <node0_output_dir>,<node1_output_dir> --output_dir <merged_dataset_dir>
+#
+# Partition subfolders, sample indices, checkpoints and manifests are moved from
+# the dataset folders into the output one (partitions generated into the output
+# folder stay in place). Sample indices of the partitions are merged into one
+# index to exclude with --sample_index and the merged manifest lists all the partitions.
+
+import os, sys
+SCRIPT_DIRS = os.path.dirname(os.path.abspath(__file__)).split(os.sep)
+sys.path.append(os.path.join(os.sep, *SCRIPT_DIRS[:SCRIPT_DIRS.index('src')]))
+
+from src.machine_learning.datasets.augmentation import generation_manifest
+from src.machine_learning.datasets.augmentation.records import sample_id_index
+
+import argparse
+import logging
+import pathlib
+import shutil
+
+import numpy as np
+
+
+def parse_args(argv):
+    # Parse input arguments.
+    parser = argparse.ArgumentParser(description='Merge Generated Partitions')
+    parser.add_argument('-d', '--dataset_dirs', dest='dataset_dir_paths',
+                        help='Comma-separated output folders of the partitions.', required=True)
+    parser.add_argument('-o', '--output_dir', dest='output_dir_path',
+                        help='Merged dataset folder.', required=True)
+    parser.add_argument('--allow_incomplete', dest='allow_incomplete', action='store_true',
+                        help='Merge, even if some partitions are missing or not generated to the end.')
+
+    return parser.parse_args(argv[1:])
+
+
+def merge_sample_indices(sample_index_paths):
+    """Merges exact indices or Bloom filters of the same size.
+
+    Returns:
+      Merged SampleIdIndex or SampleIdBloomFilter or None, if the indices are not mergeable.
+    """
+    sample_indices = [
+        sample_id_index.load_sample_index(sample_index_path) for sample_index_path in sample_index_paths]
+    if all(isinstance(sample_index, sample_id_index.SampleIdIndex) for sample_index in sample_indices):
+        return sample_id_index.SampleIdIndex(np.concatenate(
+            [sample_index.sorted_hashes for sample_index in sample_indices]))
+
+    first_index = sample_indices[0]
+    if not all(isinstance(sample_index, sample_id_index.SampleIdBloomFilter) and
+               sample_index.num_bits == first_index.num_bits and
+               sample_index.num_hashes == first_index.num_hashes for sample_index in sample_indices):
+        return None
+    merged_filter = sample_id_index.SampleIdBloomFilter(capacity=1)
+    merged_filter.num_bits, merged_filter.num_hashes = first_index.num_bits, first_index.num_hashes
+    merged_filter.bits = np.bitwise_or.reduce([sample_index.bits for sample_index in sample_indices])
+    merged_filter.num_added = sum(len(sample_index) for sample_index in sample_indices)
+    return merged_filter
+
+
+def main(argv):
+    parsed_args = parse_args(argv)
+    dataset_dir_paths = [
+        pathlib.Path(dataset_dir_path) for dataset_dir_path in parsed_args.dataset_dir_paths.split(',')]
+    output_dir_path = pathlib.Path(parsed_args.output_dir_path)
+    for dataset_dir_path in dataset_dir_paths:
+        if not dataset_dir_path.is_dir():
+            logging.error('%s is not a dir.', dataset_dir_path)
+            return os.EX_NOINPUT
+    if output_dir_path.is_file():
+        logging.error('%s is a file.', output_dir_path)
+        return os.EX_NOINPUT
+
+    dataset_dirs_and_manifests = []
+    for dataset_dir_path in dataset_dir_paths:
+        for manifest_path in generation_manifest.GenerationManifest.list_partition_manifest_paths(
+                dataset_dir_path):
+            manifest = generation_manifest.GenerationManifest.load(manifest_path)
+            if not manifest or not manifest.partitions:
+                logging.error('Malformed %s manifest.', manifest_path)
+                return os.EX_DATAERR
+            dataset_dirs_and_manifests.append((dataset_dir_path, manifest))
+    if not dataset_dirs_and_manifests:
+        logging.error('No partition manifests in %s.', parsed_args.dataset_dir_paths)
+        return os.EX_NOINPUT
+
+    try:
+        merged_manifest, missing_partitions = generation_manifest.merge_manifests(
+            [manifest for _, manifest in dataset_dirs_and_manifests])
+    except ValueError as error:
+        logging.error('Partitions are not merged: %s', error)
+        return os.EX_DATAERR
+    incomplete_manifests = [
+        manifest for _, manifest in dataset_dirs_and_manifests if not manifest.is_complete]
+    if missing_partitions or incomplete_manifests:
+        log_fn = logging.warning if parsed_args.allow_incomplete else logging.error
+        if missing_partitions:
+            log_fn('Missing %s partitions of %d.', ', '.join(str(partition_idx)
+                   for partition_idx in missing_partitions), merged_manifest.partitions[0][1])
+        for manifest in incomplete_manifests:
+            log_fn('Incomplete partition: %s.', manifest)
+        if not parsed_args.allow_incomplete:
+            return os.EX_DATAERR
+
+    partition_moves = []
+    for dataset_dir_path, manifest in dataset_dirs_and_manifests:
+        if output_dir_path.exists() and dataset_dir_path.resolve() == output_dir_path.resolve():
+            continue
+        for partition_idx, num_partitions in manifest.partitions:
+            for partition_path in generation_manifest.list_partition_paths(
+                    dataset_dir_path, generation_manifest.get_partition_prefix(partition_idx, num_partitions)):
+                partition_moves.append((partition_path, output_dir_path / partition_path.name))
+    existing_paths = [moved_path for _, moved_path in partition_moves if moved_path.exists()]
+    if existing_paths:
+        logging.error('%s already exist in the output folder.', ', '.join(
+            moved_path.name for moved_path in existing_paths))
+        return os.EX_CANTCREAT
+    output_dir_path.mkdir(parents=True, exist_ok=True)
+    for partition_path, moved_path in partition_moves:
+        shutil.move(str(partition_path), str(moved_path))
+    logging.info('%d partition files and subfolders moved to %s.', len(partition_moves), output_dir_path)
+
+    sample_index_paths = [
+        output_dir_path / sample_index_file_name
+        for sample_index_file_name in merged_manifest.sample_index_file_names
+        if (output_dir_path / sample_index_file_name).is_file()]
+    merged_sample_index = merge_sample_indices(sample_index_paths) if sample_index_paths else None
+    if merged_sample_index is not None:
+        merged_sample_index.save(output_dir_path / merged_sample_index.FILE_NAME)
+        merged_manifest.sample_index_file_names = [merged_sample_index.FILE_NAME]
+    else:
+        logging.warning('Sample indices of the partitions are not merged.')
+    merged_manifest.save(output_dir_path)
+
+    logging.info('Merged %s (%d failed) in %d subfolders.', merged_manifest,
+                 merged_manifest.failed_output_idx, len(merged_manifest.subdir_names))
+    return os.EX_OK
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    sys.exit(main(sys.argv))
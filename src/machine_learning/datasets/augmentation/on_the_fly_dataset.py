@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+
+# Augmented samples generated inside DataLoader workers without writing them.
+
+from src.img_processing.base import image_parts
+
+from src.machine_learning.datasets.augmentation import src_in_target_augmentation
+from src.machine_learning.datasets.augmentation.records.angle_and_size_augmentation import AngledResizedSrcInTargetDesc
+from src.machine_learning.datasets.augmentation.sampling import param_space_sampler
+from src.monitoring import stage_metrics
+
+import collections
+import logging
+import multiprocessing
+import pathlib
+import random
+
+import numpy as np
+import torch
+
+
+class DecodedImageCache:
+    """LRU cache of decoded images bounded by their pixel bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.images = collections.OrderedDict()
+        self.held_bytes = 0
+
+    def get(self, image_file):
+        """Gets decoded image (None, if it is malformed) decoding it on a miss."""
+        if image_file.path in self.images:
+            self.images.move_to_end(image_file.path)
+            return self.images[image_file.path]
+
+        image = image_file.load()
+        image_nbytes = image.rgba.nbytes if image else 0
+        while self.images and self.held_bytes + image_nbytes > self.max_bytes:
+            _, evicted_image = self.images.popitem(last=False)
+            if evicted_image:
+                self.held_bytes -= evicted_image.rgba.nbytes
+                evicted_image.release()
+        self.images[image_file.path] = image
+        self.held_bytes += image_nbytes
+        return image
+
+    def clear(self):
+        for image in self.images.values():
+            if image:
+                image.release()
+        self.images.clear()
+        self.held_bytes = 0
+
+
+class OnTheFlyAugmentationDataset(torch.utils.data.IterableDataset):
+    """Sources fit into target tiles as src_rotate_resize_to_target_main does.
+
+    Yields (augmented tile, scaled mask, scaled mask of mask) float tensors
+    of CHW shapes scaled to [0..1]. Workers draw disjoint partitions of the
+    same sample space permutation, seed their own random generators and
+    cache decoded sources and targets separately. The epoch is shared with
+    worker processes, so persistent workers draw the epoch set last.
+    """
+
+    def __init__(self, src_dir_path, targets_dir_path, tile_shape,
+                 src_obj_width_bounds, src_obj_angle_bounds=(0, 180),
+                 scaled_mask_shape=(32, 32), target_paddings=None,
+                 alpha_channel_threshold=230, num_samples_per_epoch=None,
+                 seed=0, batch_size=256, cache_size_mb=512):
+        """Creates the dataset reading only image headers.
+
+        Args:
+          src_dir_path: Folder with source object images.
+          targets_dir_path: Folder with target images.
+          tile_shape: Cropped tile {height, width}.
+          src_obj_width_bounds: Low and upper boundaries of augmented object width.
+          src_obj_angle_bounds: Low and upper boundaries of augmented object angle.
+          scaled_mask_shape: Scaled mask {height, width}.
+          target_paddings: Paddings in the target images (no paddings, if None).
+          alpha_channel_threshold: Threshold to filter out transparent pixels [0..255].
+          num_samples_per_epoch: Number of samples of all workers (whole space, if None).
+          seed: Seed of sample space permutations and of the workers.
+          batch_size: Number of samples drawn at once and grouped by targets.
+          cache_size_mb: Max size of decoded images cached by every worker.
+        """
+        super().__init__()
+        self.tile_shape = tuple(tile_shape)
+        self.scaled_mask_shape = tuple(scaled_mask_shape)
+        self.alpha_channel_threshold = alpha_channel_threshold
+        self.num_samples_per_epoch = num_samples_per_epoch
+        self.seed = seed
+        self.batch_size = batch_size
+        self.cache_size_bytes = cache_size_mb * 1024 * 1024
+        # Shared memory value seen by worker copies of the dataset.
+        self._shared_epoch = multiprocessing.Value('q', 0, lock=False)
+
+        self.target_image_files, target_tile_ranges = src_in_target_augmentation.list_target_files(
+            pathlib.Path(targets_dir_path), self.tile_shape,
+            target_paddings or image_parts.Paddings())
+        self.src_obj_img_files, src_width_ranges = src_in_target_augmentation.list_src_obj_files(
+            pathlib.Path(src_dir_path), *src_obj_width_bounds)
+        if not self.target_image_files or not self.src_obj_img_files:
+            raise ValueError(f'No target images in {targets_dir_path} or sources in {src_dir_path}.')
+        self.param_space = param_space_sampler.AugmentationParamSpace(
+            target_tile_ranges, src_width_ranges,
+            range(src_obj_angle_bounds[0], src_obj_angle_bounds[1] + 1))
+
+    def __len__(self):
+        return min(self.num_samples_per_epoch or len(self.param_space), len(self.param_space))
+
+    @property
+    def epoch(self):
+        return self._shared_epoch.value
+
+    def set_epoch(self, epoch):
+        """Sets the epoch drawing another permutation of the sample space (in all the workers)."""
+        self._shared_epoch.value = epoch
+
+    def __iter__(self):
+        worker_info = torch.utils.data.get_worker_info()
+        worker_id, num_workers = (
+            (worker_info.id, worker_info.num_workers) if worker_info else (0, 1))
+        epoch = self.epoch
+        epoch_seed = int(np.random.SeedSequence([self.seed, epoch]).generate_state(1)[0])
+        # Tile positions of the objects are chosen with python random.
+        random.seed(int(np.random.SeedSequence(
+            [self.seed, epoch, worker_id]).generate_state(1)[0]))
+
+        sampler = param_space_sampler.ParamSpaceSampler(
+            self.param_space, seed=epoch_seed, partition_idx=worker_id, num_partitions=num_workers)
+        num_worker_samples = len(self) // num_workers + (worker_id < len(self) % num_workers)
+        target_cache = DecodedImageCache(self.cache_size_bytes // 2)
+        src_obj_cache = DecodedImageCache(self.cache_size_bytes // 2)
+        metrics = stage_metrics.get_metrics()
+        try:
+            while num_worker_samples > 0:
+                sampled_params = sampler.draw(min(self.batch_size, num_worker_samples))
+                if not len(sampled_params.target_idx):
+                    return
+                num_worker_samples -= len(sampled_params.target_idx)
+                for target_idx in np.unique(sampled_params.target_idx):
+                    target_image_file = self.target_image_files[target_idx]
+                    with metrics.stage('decode_target'):
+                        target_image = target_cache.get(target_image_file)
+                    if not target_image:
+                        logging.error('Malformed target %s.', target_image_file)
+                        continue
+                    for sample_idx in np.flatnonzero(sampled_params.target_idx == target_idx):
+                        sample = self._augment_sample(
+                            target_image_file, target_image, src_obj_cache, sampled_params, sample_idx)
+                        if sample is not None:
+                            yield sample
+        finally:
+            target_cache.clear()
+            src_obj_cache.clear()
+
+    def _augment_sample(self, target_image_file, target_image, src_obj_cache, sampled_params, sample_idx):
+        src_obj_img_file = self.src_obj_img_files[sampled_params.src_idx[sample_idx]]
+        with stage_metrics.get_metrics().stage('decode_source'):
+            src_obj_img = src_obj_cache.get(src_obj_img_file)
+        if not src_obj_img:
+            logging.error('Malformed source %s.', src_obj_img_file)
+            return None
+
+        aug_sample_desc = AngledResizedSrcInTargetDesc.from_src_and_target_file(
+            src_img_file=src_obj_img_file, target_image_file=target_image_file)
+        aug_sample_desc.tile_top_left_row = int(sampled_params.tile_top_left_row[sample_idx])
+        aug_sample_desc.tile_top_left_col = int(sampled_params.tile_top_left_col[sample_idx])
+        aug_sample_desc.tile_height, aug_sample_desc.tile_width = self.tile_shape
+        aug_sample_desc.angle_in_degrees = int(sampled_params.angle_in_degrees[sample_idx])
+        aug_sample_desc.scaled_width_in_pixels = int(sampled_params.scaled_width_in_pixels[sample_idx])
+
+        # noinspection PyBroadException
+        try:
+            file_desc_to_pixels = src_in_target_augmentation.augment_sample(
+                target_image, src_obj_img, aug_sample_desc,
+                self.scaled_mask_shape[1], self.scaled_mask_shape[0], self.alpha_channel_threshold)
+        except Exception:
+            logging.exception('Augmentation %s.', aug_sample_desc)
+            return None
+
+        augmented_tile_rgb = file_desc_to_pixels[AngledResizedSrcInTargetDesc.AUGMENTED_TILE][:, :, :3]
+        return (
+            torch.from_numpy(np.ascontiguousarray(augmented_tile_rgb)).permute(2, 0, 1).float().div_(255),
+            _mask_to_tensor(file_desc_to_pixels[AngledResizedSrcInTargetDesc.TARGET_SCALED_MASK]),
+            _mask_to_tensor(file_desc_to_pixels[AngledResizedSrcInTargetDesc.TARGET_SCALED_MASK_OF_MASK]))
+
+
+def _mask_to_tensor(mask):
+    return torch.from_numpy(np.ascontiguousarray(mask)).unsqueeze(0).float().div_(255)
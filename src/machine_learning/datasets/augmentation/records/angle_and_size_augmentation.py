@@ -1,6 +1,9 @@
 #!/usr/bin/python3
 
+from src.machine_learning.datasets.augmentation.records import sample_id_index
+
 import collections
+import json
 import os
 import re
 
@@ -29,6 +32,7 @@ class AngledResizedSrcInTargetDesc:
 
     ALL_RECORD_FILES = {
         TARGET_TILE, AUGMENTED_TILE, AUGMENTED_SRC, TARGET_MASK, TARGET_SCALED_MASK, TARGET_SCALED_MASK_OF_MASK}
+    MASK_RECORD_FILES = {TARGET_MASK, TARGET_SCALED_MASK, TARGET_SCALED_MASK_OF_MASK}
 
     def __init__(self, combined_augmented_file_prefix=''):
         self.combined_augmented_file_prefix = combined_augmented_file_prefix
@@ -63,6 +67,13 @@ class AngledResizedSrcInTargetDesc:
             self.angle_in_degrees, self.scaled_width_in_pixels,
             self.tile_top_left_row, self.tile_top_left_col)
 
+    @property
+    def sample_hash(self):
+        return int(sample_id_index.hash_sample_fields(
+            sample_id_index.hash_file_prefix(self.combined_augmented_file_prefix),
+            self.angle_in_degrees, self.scaled_width_in_pixels,
+            self.tile_top_left_row, self.tile_top_left_col)[0])
+
     @classmethod
     def from_src_and_target_file(cls, src_img_file, target_image_file):
         return cls(combined_augmented_file_prefix=cls.combine_augmented_file_names(
@@ -112,6 +123,83 @@ class AngledResizedSrcInTargetDesc:
         return dir_path.joinpath(self.combine_record_file_name(file_desc, ext))
 
 
+class MultiObjectSrcInTargetDesc(AngledResizedSrcInTargetDesc):
+    """Descriptor of several resized and rotated objects augmented in one target tile.
+
+    Sample files are named after the first placed object at the tile position,
+    drawn params of every object are kept only in the objects record which
+    lists the tile, all the placed objects and their boxes in the tile, masks
+    combine all of them.
+    """
+
+    OBJECTS = RecordFileType('objects')
+    OBJECTS_FILE_EXT = 'json'
+
+    ALL_RECORD_FILES = AngledResizedSrcInTargetDesc.ALL_RECORD_FILES | {OBJECTS}
+
+    def __init__(self, object_descs, tile_top_left_row, tile_top_left_col):
+        """Makes descriptor of objects in the same tile.
+
+        Args:
+          object_descs: AngledResizedSrcInTargetDesc of every object.
+          tile_top_left_row: Row of the tile top left corner in the target.
+          tile_top_left_col: Column of the tile top left corner in the target.
+        """
+        first_object_desc = object_descs[0]
+        super().__init__(first_object_desc.combined_augmented_file_prefix)
+        self.tile_top_left_row = tile_top_left_row
+        self.tile_top_left_col = tile_top_left_col
+        self.angle_in_degrees = first_object_desc.angle_in_degrees
+        self.scaled_width_in_pixels = first_object_desc.scaled_width_in_pixels
+        self.tile_width = getattr(first_object_desc, 'tile_width', 0)
+        self.tile_height = getattr(first_object_desc, 'tile_height', 0)
+
+        self.object_descs = list(object_descs)
+        # Object {top, left, bottom, right} boxes in the tile (None for not placed objects).
+        self.object_boxes = [None] * len(self.object_descs)
+
+    @property
+    def first_placed_object_desc(self):
+        """Gets descriptor of the first placed object (of the first object, if none is placed)."""
+        for object_desc, object_box in zip(self.object_descs, self.object_boxes):
+            if object_box:
+                return object_desc
+        return self.object_descs[0]
+
+    def name_after_first_placed_object(self):
+        """Names the tile files after the first placed object keeping the tile position."""
+        first_placed_object_desc = self.first_placed_object_desc
+        self.combined_augmented_file_prefix = first_placed_object_desc.combined_augmented_file_prefix
+        self.angle_in_degrees = first_placed_object_desc.angle_in_degrees
+        self.scaled_width_in_pixels = first_placed_object_desc.scaled_width_in_pixels
+
+    def to_objects_record(self):
+        """Gets JSON-serializable record of placed objects."""
+        return {
+            'tile': {
+                'top': self.tile_top_left_row, 'left': self.tile_top_left_col,
+                'width': self.tile_width, 'height': self.tile_height},
+            'objects': [{
+                'sample_id': object_desc.sample_id,
+                'angle': object_desc.angle_in_degrees,
+                'width': object_desc.scaled_width_in_pixels,
+                'box': list(object_box),
+            } for object_desc, object_box in zip(self.object_descs, self.object_boxes) if object_box],
+        }
+
+    def save_objects_record(self, dir_path):
+        objects_record_path = self.create_saved_file_path(
+            dir_path, self.OBJECTS, self.OBJECTS_FILE_EXT)
+        with open(objects_record_path, 'w') as objects_record_file:
+            json.dump(self.to_objects_record(), objects_record_file)
+        return objects_record_path
+
+    @staticmethod
+    def load_objects_record(file_path):
+        with open(file_path) as objects_record_file:
+            return json.load(objects_record_file)
+
+
 class AngledResizedSrcInTargetFileDesc:
     """Descriptor of one file which set represents resized and rotated object augmented in target image."""
 
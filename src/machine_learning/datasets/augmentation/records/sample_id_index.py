@@ -0,0 +1,171 @@
+#!/usr/bin/python3
+
+# Compact persistent indices of generated sample ids.
+
+from src.machine_learning.datasets.augmentation.sampling import param_space_sampler
+
+import hashlib
+import math
+import os
+import pathlib
+
+import numpy as np
+
+
+def hash_file_prefix(combined_augmented_file_prefix):
+    """Gets 64-bit hash of combined source and target file prefix."""
+    return np.uint64(int.from_bytes(hashlib.blake2b(
+        combined_augmented_file_prefix.encode('utf-8'), digest_size=8).digest(), 'little'))
+
+
+def hash_sample_fields(
+        prefix_hashes, angles_in_degrees, scaled_widths_in_pixels,
+        tile_top_left_rows, tile_top_left_cols):
+    """Gets 64-bit hashes of augmented sample descriptor fields.
+
+    Args:
+      prefix_hashes: Hashes of combined augmented file prefixes.
+      angles_in_degrees: Rotation angles.
+      scaled_widths_in_pixels: Source object widths.
+      tile_top_left_rows: Rows of tile top left corners.
+      tile_top_left_cols: Columns of tile top left corners.
+
+    Returns:
+      Array of uint64 sample hashes.
+    """
+    sample_hashes = param_space_sampler.splitmix64(prefix_hashes)
+    for field_values in (angles_in_degrees, scaled_widths_in_pixels,
+                         tile_top_left_rows, tile_top_left_cols):
+        sample_hashes = param_space_sampler.splitmix64(
+            sample_hashes ^ np.asarray(field_values, dtype=np.int64).astype(np.uint64))
+    return sample_hashes
+
+
+def _save_atomically(file_path, save_fn):
+    file_path = pathlib.Path(file_path)
+    tmp_file_path = file_path.with_name(file_path.name + '.tmp')
+    with open(tmp_file_path, 'wb') as tmp_file:
+        save_fn(tmp_file)
+    os.replace(tmp_file_path, file_path)
+
+
+class SampleIdIndex:
+    """Exact index of sample hashes kept as a sorted uint64 array."""
+
+    FILE_NAME = 'sample_ids.npy'
+
+    def __init__(self, sample_hashes=None):
+        self.sorted_hashes = np.unique(np.asarray(
+            sample_hashes if sample_hashes is not None else [], dtype=np.uint64))
+        self.pending_hashes = []
+
+    def __len__(self):
+        self._merge_pending()
+        return len(self.sorted_hashes)
+
+    def _merge_pending(self):
+        if self.pending_hashes:
+            self.sorted_hashes = np.unique(np.concatenate(
+                [self.sorted_hashes] + self.pending_hashes))
+            self.pending_hashes = []
+
+    def contains(self, sample_hashes):
+        """Checks which of the given hashes are in the index.
+
+        Args:
+          sample_hashes: Array of uint64 sample hashes.
+
+        Returns:
+          Boolean array of the same shape.
+        """
+        self._merge_pending()
+        sample_hashes = np.asarray(sample_hashes, dtype=np.uint64)
+        if not len(self.sorted_hashes):
+            return np.zeros(sample_hashes.shape, dtype=bool)
+        positions = np.minimum(
+            np.searchsorted(self.sorted_hashes, sample_hashes), len(self.sorted_hashes) - 1)
+        return self.sorted_hashes[positions] == sample_hashes
+
+    def add(self, sample_hashes):
+        self.pending_hashes.append(np.asarray(sample_hashes, dtype=np.uint64).ravel())
+
+    def save(self, file_path):
+        self._merge_pending()
+        _save_atomically(file_path, lambda index_file: np.save(index_file, self.sorted_hashes))
+
+    @classmethod
+    def load(cls, file_path):
+        index = cls()
+        index.sorted_hashes = np.load(str(file_path))
+        return index
+
+
+class SampleIdBloomFilter:
+    """Approximate index of sample hashes with a configured false positive rate.
+
+    A generated sample might be rarely considered as an existing one,
+    but no duplicate is ever missed.
+    """
+
+    FILE_NAME = 'sample_ids.bloom.npz'
+
+    def __init__(self, capacity, false_positive_rate=0.001):
+        self.num_bits = max(8, math.ceil(
+            -capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / max(1, capacity) * math.log(2)))
+        self.bits = np.zeros((self.num_bits + 7) // 8, dtype=np.uint8)
+        self.num_added = 0
+
+    def __len__(self):
+        return self.num_added
+
+    def _bit_positions(self, sample_hashes):
+        sample_hashes = np.asarray(sample_hashes, dtype=np.uint64).ravel()
+        first_hashes = sample_hashes[:, None]
+        second_hashes = param_space_sampler.splitmix64(sample_hashes)[:, None] | np.uint64(1)
+        with np.errstate(over='ignore'):
+            return (first_hashes + np.arange(self.num_hashes, dtype=np.uint64) * second_hashes
+                    ) % np.uint64(self.num_bits)
+
+    def contains(self, sample_hashes):
+        """Checks which of the given hashes are (probably) in the filter.
+
+        Args:
+          sample_hashes: Array of uint64 sample hashes.
+
+        Returns:
+          Boolean array of the same shape.
+        """
+        bit_positions = self._bit_positions(sample_hashes)
+        bit_values = self.bits[bit_positions >> np.uint64(3)] >> (
+            bit_positions & np.uint64(7)).astype(np.uint8) & 1
+        return np.all(bit_values, axis=1).reshape(np.shape(sample_hashes))
+
+    def add(self, sample_hashes):
+        bit_positions = self._bit_positions(sample_hashes).ravel()
+        np.bitwise_or.at(
+            self.bits, bit_positions >> np.uint64(3),
+            np.left_shift(1, bit_positions & np.uint64(7)).astype(np.uint8))
+        self.num_added += np.size(sample_hashes)
+
+    def save(self, file_path):
+        _save_atomically(file_path, lambda index_file: np.savez(
+            index_file, bits=self.bits, num_bits=self.num_bits,
+            num_hashes=self.num_hashes, num_added=self.num_added))
+
+    @classmethod
+    def load(cls, file_path):
+        with np.load(str(file_path)) as saved_filter:
+            bloom_filter = cls(capacity=1)
+            bloom_filter.bits = saved_filter['bits']
+            bloom_filter.num_bits = int(saved_filter['num_bits'])
+            bloom_filter.num_hashes = int(saved_filter['num_hashes'])
+            bloom_filter.num_added = int(saved_filter['num_added'])
+            return bloom_filter
+
+
+def load_sample_index(file_path):
+    """Loads exact or Bloom filter index depending on the file name."""
+    if pathlib.Path(file_path).suffix == '.npz':
+        return SampleIdBloomFilter.load(file_path)
+    return SampleIdIndex.load(file_path)
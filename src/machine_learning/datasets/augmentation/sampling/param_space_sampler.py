@@ -0,0 +1,197 @@
+#!/usr/bin/python3
+
+# Collision-free sampling of (target, source, tile position, angle, width) space.
+
+import collections
+
+import numpy as np
+
+
+SampledParams = collections.namedtuple('SampledParams', [
+    'target_idx', 'src_idx', 'tile_top_left_row', 'tile_top_left_col',
+    'angle_in_degrees', 'scaled_width_in_pixels'])
+
+
+def splitmix64(values):
+    """Mixes bits of 64-bit unsigned integers (SplitMix64 finalizer).
+
+    Args:
+      values: Integer array.
+
+    Returns:
+      Array of uint64 hashes of the same shape.
+    """
+    with np.errstate(over='ignore'):
+        z = np.atleast_1d(np.asarray(values, dtype=np.uint64)) + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+def clip_range(values_range, low_value, upper_value):
+    """Gets values of the range (keeping its step) within [low_value..upper_value]."""
+    first_idx = max(0, -(-(low_value - values_range.start) // values_range.step))
+    return range(values_range.start + first_idx * values_range.step,
+                 min(values_range.stop, upper_value + 1), values_range.step)
+
+
+class FeistelPermutation:
+    """Keyed bijection of [0..domain_size) evaluated on index arrays.
+
+    Balanced Feistel network over the smallest even-bit domain covering
+    the given size with cycle walking to stay within the size.
+    """
+
+    def __init__(self, domain_size, seed, num_rounds=4):
+        if not 0 < domain_size < 2 ** 63:
+            raise ValueError(f'Unsupported permutation domain size {domain_size}.')
+        self.domain_size = domain_size
+
+        half_bits = max(1, (int(domain_size - 1).bit_length() + 1) // 2)
+        self.half_bits = np.uint64(half_bits)
+        self.half_mask = np.uint64((1 << half_bits) - 1)
+        self.round_keys = np.random.default_rng(seed).integers(
+            0, 2 ** 64, size=num_rounds, dtype=np.uint64, endpoint=False)
+
+    def _permute_bits(self, values):
+        left, right = values >> self.half_bits, values & self.half_mask
+        for round_key in self.round_keys:
+            left, right = right, left ^ (splitmix64(right ^ round_key) & self.half_mask)
+        return (left << self.half_bits) | right
+
+    def permute(self, indices):
+        """Maps indices from [0..domain_size) to their unique permuted positions."""
+        permuted = self._permute_bits(np.atleast_1d(np.asarray(indices, dtype=np.uint64)))
+        out_of_domain = permuted >= np.uint64(self.domain_size)
+        while np.any(out_of_domain):
+            permuted[out_of_domain] = self._permute_bits(permuted[out_of_domain])
+            out_of_domain = permuted >= np.uint64(self.domain_size)
+        return permuted.astype(np.int64)
+
+
+class AugmentationParamSpace:
+    """Enumerated space of augmented sample parameters.
+
+    Every (target, source) pair holds a block of tile rows x tile columns x
+    angles x source widths samples, so any sample has a unique flat index.
+    """
+
+    def __init__(self, target_tile_ranges, src_width_ranges, angle_range):
+        """Creates the space.
+
+        Args:
+          target_tile_ranges: List of (tile rows range, tile columns range) per target.
+          src_width_ranges: List of scaled width ranges (with steps) per source.
+          angle_range: Range of angles in degrees (with step).
+        """
+        self.num_targets = len(target_tile_ranges)
+        self.num_sources = len(src_width_ranges)
+
+        self.tile_row_starts = np.array([rows.start for rows, _ in target_tile_ranges], dtype=np.int64)
+        self.tile_col_starts = np.array([cols.start for _, cols in target_tile_ranges], dtype=np.int64)
+        self.num_tile_rows = np.array([len(rows) for rows, _ in target_tile_ranges], dtype=np.int64)
+        self.num_tile_cols = np.array([len(cols) for _, cols in target_tile_ranges], dtype=np.int64)
+
+        self.width_starts = np.array([widths.start for widths in src_width_ranges], dtype=np.int64)
+        self.width_steps = np.array([widths.step for widths in src_width_ranges], dtype=np.int64)
+        self.num_widths = np.array([len(widths) for widths in src_width_ranges], dtype=np.int64)
+
+        self.angle_start = angle_range.start
+        self.angle_step = angle_range.step
+        self.num_angles = len(angle_range)
+
+        block_sizes = [
+            int(rows) * int(cols) * self.num_angles * int(widths)
+            for rows, cols in zip(self.num_tile_rows, self.num_tile_cols)
+            for widths in self.num_widths]
+        self.size = sum(block_sizes)
+        if self.size >= 2 ** 63:
+            raise ValueError(f'Too large sample space of {self.size} samples.')
+        self.block_ends = np.cumsum(np.array(block_sizes, dtype=np.int64))
+
+    def __len__(self):
+        return self.size
+
+    def decode(self, flat_indices):
+        """Converts flat sample indices to sample parameters.
+
+        Args:
+          flat_indices: Integer array of indices in [0..size).
+
+        Returns:
+          SampledParams of arrays.
+        """
+        flat_indices = np.asarray(flat_indices, dtype=np.int64)
+        block_idx = np.searchsorted(self.block_ends, flat_indices, side='right')
+        local_idx = flat_indices - (self.block_ends[block_idx] - self._block_sizes(block_idx))
+        target_idx, src_idx = np.divmod(block_idx, self.num_sources)
+
+        local_idx, width_idx = np.divmod(local_idx, self.num_widths[src_idx])
+        local_idx, angle_idx = np.divmod(local_idx, self.num_angles)
+        row_idx, col_idx = np.divmod(local_idx, self.num_tile_cols[target_idx])
+
+        return SampledParams(
+            target_idx=target_idx, src_idx=src_idx,
+            tile_top_left_row=self.tile_row_starts[target_idx] + row_idx,
+            tile_top_left_col=self.tile_col_starts[target_idx] + col_idx,
+            angle_in_degrees=self.angle_start + angle_idx * self.angle_step,
+            scaled_width_in_pixels=self.width_starts[src_idx] + width_idx * self.width_steps[src_idx])
+
+    def _block_sizes(self, block_idx):
+        target_idx, src_idx = np.divmod(block_idx, self.num_sources)
+        return (self.num_tile_rows[target_idx] * self.num_tile_cols[target_idx] *
+                self.num_angles * self.num_widths[src_idx])
+
+
+class ParamSpaceSampler:
+    """Draws samples from the space without replacement in batches.
+
+    Samplers with the same seed and different partitions draw disjoint samples.
+    """
+
+    def __init__(self, param_space, seed, next_draw_idx=0, partition_idx=0, num_partitions=1):
+        """Creates the sampler.
+
+        Args:
+          param_space: AugmentationParamSpace to sample.
+          seed: Seed of the space permutation.
+          next_draw_idx: Number of already drawn samples to skip.
+          partition_idx: Index of the drawn partition [0..num_partitions).
+          num_partitions: Number of disjoint partitions of the permuted space.
+        """
+        if not 0 <= partition_idx < num_partitions:
+            raise ValueError(f'Invalid {partition_idx} partition of {num_partitions}.')
+        self.param_space = param_space
+        self.seed = seed
+        self.next_draw_idx = next_draw_idx
+        self.partition_idx = partition_idx
+        self.num_partitions = num_partitions
+        self.permutation = (
+            FeistelPermutation(len(param_space), seed) if len(param_space) else None)
+
+    @property
+    def partition_size(self):
+        return max(0, len(self.param_space) - self.partition_idx + self.num_partitions - 1
+                   ) // self.num_partitions
+
+    @property
+    def num_remaining(self):
+        return max(0, self.partition_size - self.next_draw_idx)
+
+    def draw(self, batch_size):
+        """Draws next samples never drawn before.
+
+        Args:
+          batch_size: Max number of samples to draw.
+
+        Returns:
+          SampledParams of arrays (shorter than batch_size, if the space is exhausted).
+        """
+        batch_size = min(batch_size, self.num_remaining)
+        draw_indices = np.arange(
+            self.next_draw_idx, self.next_draw_idx + batch_size, dtype=np.int64
+        ) * self.num_partitions + self.partition_idx
+        self.next_draw_idx += batch_size
+        flat_indices = (
+            self.permutation.permute(draw_indices) if batch_size else draw_indices)
+        return self.param_space.decode(flat_indices)
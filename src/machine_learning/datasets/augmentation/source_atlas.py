@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+
+# Source objects pre-rendered at a grid of angles and widths in a memory-mapped atlas.
+
+from src.img_processing.augmentation import rotate_resize_crop
+from src.img_processing.base import image
+
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import pathlib
+
+import numpy as np
+
+
+class SourceAtlas:
+    """Rotated and resized source objects packed one after another in a flat file.
+
+    Objects of every source are rendered for all the grid angles and all the
+    grid widths of the source, so (source, angle, width) locate the object
+    offset in the index without searching.
+    """
+
+    PIXELS_FILE_NAME = 'atlas_pixels.bin'
+    INDEX_FILE_NAME = 'atlas_index.npz'
+    META_FILE_NAME = 'atlas_meta.json'
+
+    def __init__(self, atlas_dir_path):
+        """Maps the atlas built in the folder.
+
+        Raises:
+          OSError, ValueError: The atlas is absent or incomplete.
+        """
+        self.atlas_dir_path = pathlib.Path(atlas_dir_path)
+        with open(self.atlas_dir_path / self.META_FILE_NAME) as meta_file:
+            self.meta = json.load(meta_file)
+        with np.load(self.atlas_dir_path / self.INDEX_FILE_NAME) as atlas_index:
+            self.entry_offsets = atlas_index['entry_offsets']
+            self.entry_shapes = atlas_index['entry_shapes']
+            self.src_entry_starts = atlas_index['src_entry_starts']
+            self.src_width_starts = atlas_index['src_width_starts']
+            self.src_num_widths = atlas_index['src_num_widths']
+        self.pixels = (
+            np.memmap(self.atlas_dir_path / self.PIXELS_FILE_NAME, dtype=np.uint8, mode='r')
+            if self.entry_offsets[-1] else np.zeros(0, dtype=np.uint8))
+
+    @property
+    def angle_range(self):
+        return range(*self.meta['angle_range'])
+
+    @property
+    def width_step(self):
+        return self.meta['width_step']
+
+    @property
+    def alpha_channel_threshold(self):
+        return self.meta['alpha_channel_threshold']
+
+    def get_content_hash(self):
+        """Hashes the atlas grid and index, but not paths of its sources.
+
+        Returns:
+          Hex digest equal for atlases of the same sources built on different nodes.
+        """
+        content_hash = hashlib.sha256(json.dumps([
+            self.meta['angle_range'], self.width_step, self.alpha_channel_threshold]).encode())
+        for index_array in (self.entry_offsets, self.entry_shapes, self.src_entry_starts,
+                            self.src_width_starts, self.src_num_widths):
+            content_hash.update(np.ascontiguousarray(index_array, dtype=np.int64).tobytes())
+        return content_hash.hexdigest()
+
+    def list_src_obj_files(self):
+        """Gets source ImageFile objects and scaled width ranges of the atlas."""
+        src_obj_img_files = [
+            image.ImageFile(pathlib.Path(src_file_path)) for src_file_path in self.meta['src_files']]
+        src_width_ranges = [
+            range(width_start, width_start + num_widths * self.width_step, self.width_step)
+            for width_start, num_widths in zip(self.src_width_starts, self.src_num_widths)]
+        return src_obj_img_files, src_width_ranges
+
+    def lookup(self, src_idx, angle_in_degrees, scaled_width_in_pixels):
+        """Gets pre-rendered object nearest to the angle and width on the grid.
+
+        Returns:
+          Writable RGBa-array copy of the object.
+        """
+        angle_range = self.angle_range
+        angle_idx = min(len(angle_range) - 1, max(0, round(
+            (angle_in_degrees - angle_range.start) / angle_range.step)))
+        width_idx = min(self.src_num_widths[src_idx] - 1, max(0, round(
+            (scaled_width_in_pixels - self.src_width_starts[src_idx]) / self.width_step)))
+        entry_idx = (
+            self.src_entry_starts[src_idx] + angle_idx * self.src_num_widths[src_idx] + width_idx)
+        entry_offset = self.entry_offsets[entry_idx]
+        entry_height, entry_width = self.entry_shapes[entry_idx]
+        return np.array(self.pixels[
+            entry_offset:entry_offset + entry_height * entry_width * 4
+        ].reshape(entry_height, entry_width, 4))
+
+
+def render_src_obj(src_obj_img_file, angle_range, width_range, alpha_channel_threshold):
+    """Renders alpha-trimmed source object at all the grid angles and widths.
+
+    Returns:
+      List of RGBa-arrays ordered by angles and then by widths or None, if the source is malformed.
+    """
+    src_obj_img = src_obj_img_file.load()
+    if not src_obj_img:
+        return None
+    with src_obj_img:
+        trimmed_rgba = np.copy(rotate_resize_crop.alpha_trim_rgba(
+            src_obj_img.rgba, alpha_channel_threshold))
+    return [
+        rotate_resize_crop.rotate_resize_crop_rgba_img(
+            trimmed_rgba, angle_in_degrees, scaled_width_in_pixels, alpha_channel_threshold)
+        for angle_in_degrees in angle_range
+        for scaled_width_in_pixels in width_range]
+
+
+def build_source_atlas(
+        src_obj_img_files, src_width_ranges, atlas_dir_path,
+        angle_range, alpha_channel_threshold, num_threads=4):
+    """Renders source objects and packs them into the atlas folder.
+
+    Args:
+      src_obj_img_files: Source ImageFile objects.
+      src_width_ranges: Scaled width ranges (with the same step) per source.
+      atlas_dir_path: Output folder of the atlas.
+      angle_range: Range of angles in degrees (with step).
+      alpha_channel_threshold: Threshold to filter out transparent pixels [0..255].
+      num_threads: Number of rendering threads.
+
+    Returns:
+      SourceAtlas.
+    """
+    atlas_dir_path = pathlib.Path(atlas_dir_path)
+    atlas_dir_path.mkdir(parents=True, exist_ok=True)
+    (atlas_dir_path / SourceAtlas.META_FILE_NAME).unlink(missing_ok=True)
+    width_steps = {width_range.step for width_range in src_width_ranges}
+    if len(width_steps) > 1:
+        raise ValueError(f'Different source width steps {width_steps}.')
+
+    entry_offsets, entry_shapes, atlas_src_files, atlas_width_ranges = [0], [], [], []
+    with open(atlas_dir_path / SourceAtlas.PIXELS_FILE_NAME, 'wb') as pixels_file, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+        # Sources are rendered in chunks to bound memory of not yet written objects.
+        for chunk_start in range(0, len(src_obj_img_files), num_threads * 4):
+            chunk_files = src_obj_img_files[chunk_start:chunk_start + num_threads * 4]
+            chunk_width_ranges = src_width_ranges[chunk_start:chunk_start + num_threads * 4]
+            for src_obj_img_file, width_range, rendered_rgbas in zip(
+                    chunk_files, chunk_width_ranges, executor.map(
+                        lambda file_and_widths: render_src_obj(
+                            file_and_widths[0], angle_range, file_and_widths[1],
+                            alpha_channel_threshold),
+                        zip(chunk_files, chunk_width_ranges))):
+                if rendered_rgbas is None:
+                    logging.error('Malformed source %s.', src_obj_img_file)
+                    continue
+                for rendered_rgba in rendered_rgbas:
+                    pixels_file.write(np.ascontiguousarray(rendered_rgba, dtype=np.uint8).tobytes())
+                    entry_offsets.append(entry_offsets[-1] + rendered_rgba.size)
+                    entry_shapes.append(rendered_rgba.shape[:2])
+                atlas_src_files.append(str(src_obj_img_file.path))
+                atlas_width_ranges.append(width_range)
+            logging.info('%d of %d sources rendered.',
+                         min(chunk_start + num_threads * 4, len(src_obj_img_files)), len(src_obj_img_files))
+        pixels_file.flush()
+        os.fsync(pixels_file.fileno())
+
+    src_num_widths = np.array([len(width_range) for width_range in atlas_width_ranges], dtype=np.int64)
+    np.savez(
+        atlas_dir_path / SourceAtlas.INDEX_FILE_NAME,
+        entry_offsets=np.array(entry_offsets, dtype=np.int64),
+        entry_shapes=np.array(entry_shapes, dtype=np.int64).reshape(-1, 2),
+        src_entry_starts=np.concatenate([[0], np.cumsum(src_num_widths * len(angle_range))]),
+        src_width_starts=np.array(
+            [width_range.start for width_range in atlas_width_ranges], dtype=np.int64),
+        src_num_widths=src_num_widths)
+
+    # Meta-data is written last to mark the atlas as complete.
+    with open(atlas_dir_path / SourceAtlas.META_FILE_NAME, 'w') as meta_file:
+        json.dump({
+            'src_files': atlas_src_files,
+            'angle_range': [angle_range.start, angle_range.stop, angle_range.step],
+            'width_step': width_steps.pop() if width_steps else 1,
+            'alpha_channel_threshold': alpha_channel_threshold,
+        }, meta_file)
+    return SourceAtlas(atlas_dir_path)
@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+
+# The script to pre-render source objects at a grid of angles and widths.
+#
+# Usage:
+#   python source_atlas_main.py \
+#     --low_src_width 15 --upper_src_width 60 --width_step 3 \
+#     --low_src_angle 0 --upper_src_angle 180 --angle_step 5 \
+#     --src_dir <path_of_augmented_img_dir> --atlas_dir <atlas_dir>
+#
+# The atlas is used by src_rotate_resize_to_target_main with --src_atlas.
+
+import os, sys
+SCRIPT_DIRS = os.path.dirname(os.path.abspath(__file__)).split(os.sep)
+sys.path.append(os.path.join(os.sep, *SCRIPT_DIRS[:SCRIPT_DIRS.index('src')]))
+
+import argparse
+import logging
+import pathlib
+
+
+def parse_args(argv):
+    # Parse input arguments.
+    parser = argparse.ArgumentParser(description='Pre-render Source Atlas')
+    parser.add_argument('-s', '--src_dir', dest='src_dir_path',
+                        help='Folder with source object images.', required=True)
+    parser.add_argument('-o', '--atlas_dir', dest='atlas_dir_path',
+                        help='Output folder of the atlas.', required=True)
+
+    parser.add_argument('-l', '--low_src_width', dest='low_src_obj_width',
+                        help='Low boundary of augmented object width.', required=True, type=int)
+    parser.add_argument('-u', '--upper_src_width', dest='upper_src_obj_width',
+                        help='Height boundary of augmented object width.', required=True, type=int)
+    parser.add_argument('--width_step', dest='width_step',
+                        help='Step between augmented object widths.', required=False, type=int, default=1)
+
+    parser.add_argument('-b', '--low_src_angle', dest='low_src_obj_angle_degrees',
+                        help='Low boundary of augmented object angle.',
+                        required=False, type=int, default=0)
+    parser.add_argument('-c', '--upper_src_angle', dest='upper_src_obj_angle_degrees',
+                        help='Height boundary of augmented object angle.',
+                        required=False, type=int, default=180)
+    parser.add_argument('--angle_step', dest='angle_step',
+                        help='Step between augmented object angles.', required=False, type=int, default=5)
+
+    parser.add_argument('-a', '--alpha_threshold', dest='alpha_channel_threshold',
+                        help='Transparency threshold for smoothing [0..255].', required=False,
+                        type=int, default=230)
+    parser.add_argument('--threads', dest='num_threads',
+                        help='Number of rendering threads.', required=False, type=int, default=4)
+
+    return parser.parse_args(argv[1:])
+
+
+def main(argv):
+    parsed_args = parse_args(argv)
+    from src.machine_learning.datasets.augmentation import source_atlas
+    from src.machine_learning.datasets.augmentation import src_in_target_augmentation
+
+    src_dir_path = pathlib.Path(parsed_args.src_dir_path)
+    if not src_dir_path.is_dir():
+        logging.error('%s is not a dir.', src_dir_path)
+        return os.EX_NOINPUT
+
+    if not (0 < parsed_args.low_src_obj_width <= parsed_args.upper_src_obj_width):
+        logging.error('Incorrect augmented object width boundaries.')
+        return os.EX_NOINPUT
+    if not (parsed_args.low_src_obj_angle_degrees <= parsed_args.upper_src_obj_angle_degrees):
+        logging.error('Incorrect augmented object angle boundaries.')
+        return os.EX_NOINPUT
+    if parsed_args.width_step <= 0 or parsed_args.angle_step <= 0:
+        logging.error('Width and angle steps must be positive.')
+        return os.EX_NOINPUT
+    if not (0 <= parsed_args.alpha_channel_threshold <= 255):
+        logging.error('Incorrect source object transparency threshold.')
+        return os.EX_NOINPUT
+
+    src_obj_img_files, src_width_ranges = src_in_target_augmentation.list_src_obj_files(
+        src_dir_path, parsed_args.low_src_obj_width, parsed_args.upper_src_obj_width,
+        parsed_args.width_step)
+    if not src_obj_img_files:
+        logging.warning('No source images.')
+        return os.EX_NOINPUT
+
+    atlas = source_atlas.build_source_atlas(
+        src_obj_img_files, src_width_ranges, parsed_args.atlas_dir_path,
+        range(parsed_args.low_src_obj_angle_degrees, parsed_args.upper_src_obj_angle_degrees + 1,
+              parsed_args.angle_step),
+        parsed_args.alpha_channel_threshold, num_threads=parsed_args.num_threads)
+    logging.info('%d objects of %d sources rendered into %d bytes.',
+                 len(atlas.entry_shapes), len(atlas.meta['src_files']), atlas.entry_offsets[-1])
+    return os.EX_OK
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    sys.exit(main(sys.argv))
@@ -0,0 +1,278 @@
+#!/usr/bin/python3
+
+# Methods to fit rotated/scaled source objects into target image tiles.
+
+from src.img_processing.augmentation import adjust_overlay
+from src.img_processing.augmentation import rotate_resize_crop
+from src.img_processing.editing import cropping
+from src.img_processing.editing import random_selection
+from src.img_processing.io import imgread
+from src.img_processing.mask import scale_mask
+from src.img_processing.tiling import tile_breaking
+from src.img_processing.tiling import tile_usability
+
+from src.machine_learning.datasets.augmentation.records.angle_and_size_augmentation import AngledResizedSrcInTargetDesc
+from src.machine_learning.datasets.augmentation.records.angle_and_size_augmentation import MultiObjectSrcInTargetDesc
+from src.monitoring import stage_metrics
+
+import logging
+import re
+
+import numpy as np
+
+
+LABELING_FILE_REGEXP = re.compile(r'(.*\.ini|.*\.xcf|.*\.psd)')
+
+
+def list_target_files(targets_dir_path, tile_shape, target_paddings):
+    """Lists target images where tiles can be cropped reading only image headers.
+
+    Args:
+      targets_dir_path: Folder with target images.
+      tile_shape: Cropped tile {height, width}.
+      target_paddings: Left, right, top and bottom paddings in the target images.
+
+    Returns:
+      List of target ImageFile objects and list of their tile row and column ranges.
+    """
+    target_image_files, target_tile_ranges = [], []
+    for target_image_file in imgread.list_image_file_from_dir(
+            targets_dir_path, recursive=True,
+            ignore_non_images=True, ignored_file_regexp=LABELING_FILE_REGEXP):
+        target_shape = imgread.read_image_shape(target_image_file.path)
+        if not target_shape:
+            logging.error('Malformed target %s.', target_image_file)
+            continue
+        if not (target_paddings.within_width(target_shape[1]) and
+                target_paddings.within_height(target_shape[0])):
+            logging.error('%s padding mismatch %s.', target_paddings, target_image_file)
+            continue
+        if not tile_breaking.any_tile_fit(tile_shape, target_shape, target_paddings):
+            logging.error('Too small target %s.', target_image_file)
+            continue
+        target_image_files.append(target_image_file)
+        target_tile_ranges.append(tile_breaking.get_tile_row_col_ranges(
+            tile_shape, target_shape, target_paddings))
+    return target_image_files, target_tile_ranges
+
+
+def get_target_tile_usabilities(target_image_files, target_tile_ranges, tile_shape, criteria):
+    """Gets indices of usable target tiles (cached beside targets) and drops targets without them.
+
+    Args:
+      target_image_files: List of target ImageFile objects.
+      target_tile_ranges: List of their tile row and column ranges.
+      tile_shape: Cropped tile {height, width}.
+      criteria: TileUsabilityCriteria.
+
+    Returns:
+      Lists of target ImageFile objects, their tile row and column ranges
+      and TileUsability objects of targets with usable tiles.
+    """
+    usable_target_image_files, usable_target_tile_ranges, tile_usabilities = [], [], []
+    for target_image_file, (tile_rows, tile_cols) in zip(target_image_files, target_tile_ranges):
+        target_tile_usability = tile_usability.get_tile_usability(
+            target_image_file, tile_shape, tile_rows, tile_cols, criteria)
+        if target_tile_usability is None:
+            logging.error('Malformed target %s.', target_image_file)
+            continue
+        if not target_tile_usability.num_usable:
+            logging.error('No usable tiles in target %s.', target_image_file)
+            continue
+        usable_target_image_files.append(target_image_file)
+        usable_target_tile_ranges.append((tile_rows, tile_cols))
+        tile_usabilities.append(target_tile_usability)
+    return usable_target_image_files, usable_target_tile_ranges, tile_usabilities
+
+
+def list_src_obj_files(
+        src_dir_path, lower_bound_of_src_obj_width, upper_bound_of_src_obj_width, width_step=1):
+    """Lists source object images reading only image headers.
+
+    Args:
+      src_dir_path: Folder with source object images.
+      lower_bound_of_src_obj_width: Low boundary of augmented object width.
+      upper_bound_of_src_obj_width: Upper boundary of augmented object width.
+      width_step: Step between augmented object widths.
+
+    Returns:
+      List of source ImageFile objects and list of their scaled width ranges.
+    """
+    src_obj_img_files, src_width_ranges = [], []
+    for src_obj_img_file in imgread.list_image_file_from_dir(
+            src_dir_path, recursive=True,
+            ignore_non_images=True, ignored_file_regexp=LABELING_FILE_REGEXP):
+        src_obj_shape = imgread.read_image_shape(src_obj_img_file.path)
+        if not src_obj_shape:
+            logging.error('Malformed source %s.', src_obj_img_file)
+            continue
+        src_obj_img_files.append(src_obj_img_file)
+        src_width_ranges.append(range(
+            min(src_obj_shape[1], lower_bound_of_src_obj_width),
+            min(src_obj_shape[1], upper_bound_of_src_obj_width) + 1, width_step))
+    return src_obj_img_files, src_width_ranges
+
+
+def augment_sample(
+        target_image, src_obj_img, aug_sample_desc,
+        scaled_mask_width, scaled_mask_height, alpha_channel_threshold,
+        augmented_obj_rgba=None):
+    """Overlays source image over the target tile with the specified augmentations.
+
+    Args:
+      target_image: Target image.
+      src_obj_img: Source image (transparent pixels to outline the contour).
+      aug_sample_desc: Meta-data of augmented sample.
+      scaled_mask_width: Width of scaled mask.
+      scaled_mask_height: Height of scaled mask.
+      alpha_channel_threshold: Threshold to filter out transparent pixels [0..255].
+      augmented_obj_rgba: Already rotated and resized source (e.g. from SourceAtlas),
+                          the source image is not used then.
+
+    Returns:
+      Dictionary of record file types and their pixel arrays.
+    """
+    metrics = stage_metrics.get_metrics()
+
+    # Prepare the target tile.
+    with metrics.stage('crop'):
+        tile_rgba = cropping.crop_rgba(
+            target_image.rgba,
+            aug_sample_desc.tile_top_left_row, aug_sample_desc.tile_top_left_col,
+            aug_sample_desc.tile_width, aug_sample_desc.tile_height)
+
+    # Take next augmented source object.
+    if augmented_obj_rgba is None:
+        with metrics.stage('rotate'):
+            augmented_obj_rgba = rotate_resize_crop.rotate_resize_crop_rgba_img(
+                src_obj_img.rgba,
+                aug_sample_desc.angle_in_degrees, aug_sample_desc.scaled_width_in_pixels,
+                alpha_channel_threshold)
+
+    # Find random place in the tile.
+    augmented_obj_center_row, augmented_obj_center_col = (
+        random_selection.get_random_row_col(
+            tile_rgba.shape[1], tile_rgba.shape[0],
+            augmented_obj_rgba.shape[1] // 2, augmented_obj_rgba.shape[0] // 2))
+
+    with metrics.stage('blend'):
+        (target_with_augmented_rgba,
+         augmented_src_rgba, binary_mask) = adjust_overlay.saliency_blend_into_largest(
+            tile_rgba, augmented_obj_rgba,
+            augmented_obj_center_row, augmented_obj_center_col,
+            alpha_channel_threshold, tiny_img_max_side_size=20)
+
+    with metrics.stage('scale_mask'):
+        scaled_mask, mask_of_mask = scale_mask.scale_binary_mask(
+            binary_mask, scaled_mask_width, scaled_mask_height,
+            borderline_ratio_thold=0.5)
+
+    return {
+        AngledResizedSrcInTargetDesc.AUGMENTED_TILE : target_with_augmented_rgba,
+        AngledResizedSrcInTargetDesc.TARGET_TILE : tile_rgba,
+        AngledResizedSrcInTargetDesc.AUGMENTED_SRC : augmented_src_rgba,
+        AngledResizedSrcInTargetDesc.TARGET_MASK : binary_mask,
+        AngledResizedSrcInTargetDesc.TARGET_SCALED_MASK : scaled_mask,
+        AngledResizedSrcInTargetDesc.TARGET_SCALED_MASK_OF_MASK : mask_of_mask,
+    }
+
+
+def group_tile_objects(target_idx, objects_per_tile):
+    """Groups sampled objects of the same targets into tiles in the order they are sampled.
+
+    Args:
+      target_idx: Target indices of sampled objects.
+      objects_per_tile: Max number of objects in one tile.
+
+    Returns:
+      Index of the first object of every object tile (the tile position is taken from it,
+      the other objects keep their drawn params as sample ids).
+    """
+    target_idx = np.asarray(target_idx)
+    target_order = np.argsort(target_idx, kind='stable')
+    _, first_target_positions, target_inverse = np.unique(
+        target_idx[target_order], return_index=True, return_inverse=True)
+    ordered_positions = np.arange(len(target_idx))
+    positions_in_target = ordered_positions - first_target_positions[target_inverse]
+    first_objects = np.empty_like(target_order)
+    first_objects[target_order] = target_order[
+        ordered_positions - positions_in_target % objects_per_tile]
+    return first_objects
+
+
+def augment_multi_object_sample(
+        target_image, src_objs_and_descs, multi_obj_sample_desc,
+        scaled_mask_width, scaled_mask_height, alpha_channel_threshold):
+    """Overlays several source images over the target tile blending it once.
+
+    Objects are placed at random not overlapping positions, objects which do not
+    fit are skipped (their boxes are None in the sample descriptor).
+
+    Args:
+      target_image: Target image.
+      src_objs_and_descs: Source images (transparent pixels to outline the contour), their
+                          AngledResizedSrcInTargetDesc and already augmented sources (or None).
+      multi_obj_sample_desc: MultiObjectSrcInTargetDesc of the tile to set object boxes.
+      scaled_mask_width: Width of scaled mask.
+      scaled_mask_height: Height of scaled mask.
+      alpha_channel_threshold: Threshold to filter out transparent pixels [0..255].
+
+    Returns:
+      Dictionary of record file types and their pixel arrays (masks of all the objects).
+    """
+    metrics = stage_metrics.get_metrics()
+
+    with metrics.stage('crop'):
+        tile_rgba = cropping.crop_rgba(
+            target_image.rgba,
+            multi_obj_sample_desc.tile_top_left_row, multi_obj_sample_desc.tile_top_left_col,
+            multi_obj_sample_desc.tile_width, multi_obj_sample_desc.tile_height)
+
+    augmented_obj_rgbas = []
+    for src_obj_img, aug_sample_desc, augmented_obj_rgba in src_objs_and_descs:
+        if augmented_obj_rgba is None:
+            with metrics.stage('rotate'):
+                augmented_obj_rgba = rotate_resize_crop.rotate_resize_crop_rgba_img(
+                    src_obj_img.rgba,
+                    aug_sample_desc.angle_in_degrees, aug_sample_desc.scaled_width_in_pixels,
+                    alpha_channel_threshold)
+        augmented_obj_rgbas.append(augmented_obj_rgba)
+
+    # Find random not overlapping places in the tile.
+    augmented_obj_row_cols = random_selection.get_random_non_overlapping_row_cols(
+        tile_rgba.shape[0], tile_rgba.shape[1],
+        [augmented_obj_rgba.shape for augmented_obj_rgba in augmented_obj_rgbas])
+    placed_obj_rgbas, placed_obj_rows, placed_obj_cols = [], [], []
+    for obj_idx, (augmented_obj_rgba, obj_row_col) in enumerate(
+            zip(augmented_obj_rgbas, augmented_obj_row_cols)):
+        if not obj_row_col:
+            continue
+        top = obj_row_col[0] - augmented_obj_rgba.shape[0] // 2
+        left = obj_row_col[1] - augmented_obj_rgba.shape[1] // 2
+        multi_obj_sample_desc.object_boxes[obj_idx] = (
+            max(0, top), max(0, left),
+            min(tile_rgba.shape[0], top + augmented_obj_rgba.shape[0]),
+            min(tile_rgba.shape[1], left + augmented_obj_rgba.shape[1]))
+        placed_obj_rgbas.append(augmented_obj_rgba)
+        placed_obj_rows.append(obj_row_col[0])
+        placed_obj_cols.append(obj_row_col[1])
+
+    with metrics.stage('blend'):
+        (target_with_augmented_rgba,
+         augmented_src_rgba, binary_mask) = adjust_overlay.saliency_blend_all_into_largest(
+            tile_rgba, placed_obj_rgbas, placed_obj_rows, placed_obj_cols,
+            alpha_channel_threshold, tiny_img_max_side_size=20)
+
+    with metrics.stage('scale_mask'):
+        scaled_mask, mask_of_mask = scale_mask.scale_binary_mask(
+            binary_mask, scaled_mask_width, scaled_mask_height,
+            borderline_ratio_thold=0.5)
+
+    return {
+        MultiObjectSrcInTargetDesc.AUGMENTED_TILE : target_with_augmented_rgba,
+        MultiObjectSrcInTargetDesc.TARGET_TILE : tile_rgba,
+        MultiObjectSrcInTargetDesc.AUGMENTED_SRC : augmented_src_rgba,
+        MultiObjectSrcInTargetDesc.TARGET_MASK : binary_mask,
+        MultiObjectSrcInTargetDesc.TARGET_SCALED_MASK : scaled_mask,
+        MultiObjectSrcInTargetDesc.TARGET_SCALED_MASK_OF_MASK : mask_of_mask,
+    }
@@ -4,40 +4,65 @@
 #
 # Usage:
 #   python src_rotate_resize_to_target_main.py \
-#     --num_outputs 5 --tiles_per_img 4 \
+#     --num_outputs 5 --tiles_per_img 4 --seed 7 \
 #     --tile_width 128 --tile_height 128 \
 #     --low_obj_width 15 --upper_obj_width 60 \
 #     --src_dir <path_of_augmented_img_dir> --targets_dir <path_of_target_img_dir> \
 #     --output_dir <output_img_path>
+#
+# Interrupted generation continues with the same arguments and --resume,
+# --append adds --num_outputs more samples to the existing output folder.
+# With --src_atlas built by source_atlas_main angles and widths are drawn
+# from the atlas grid and rotated objects are taken from the atlas.
+# With --objects_per_tile N sampled objects of the same target are grouped by
+# N in one tile blended once, --num_outputs still counts objects.
+# With --min_tile_opaque_share or --min_tile_luminance_std only tiles on opaque
+# textured areas are drawn, usable tiles are indexed once and cached beside targets.
+#
+# With --partition k/N and the same --seed N nodes (or processes) generate
+# disjoint shares of --num_outputs into p<k>of<N>-prefixed subfolders with
+# their own checkpoints and manifests, generation_merge_main then merges them:
+#   for k in 0 1 2 3; do
+#     python src_rotate_resize_to_target_main.py ... --seed 7 --partition $k/4 \
+#       --output_dir <output_img_path> &
+#   done; wait
+#   python generation_merge_main.py --dataset_dirs <output_img_path> --output_dir <output_img_path>
+# Source and target files are identified by relative names and sizes (the atlas
+# by its content), so nodes may mount them at different paths.
 
 import os, sys
 SCRIPT_DIRS = os.path.dirname(os.path.abspath(__file__)).split(os.sep)
 sys.path.append(os.path.join(os.sep, *SCRIPT_DIRS[:SCRIPT_DIRS.index('src')]))
 
-from src.img_processing.augmentation import adjust_overlay
-from src.img_processing.augmentation import rotate_resize_crop
 from src.img_processing.base import image_parts
-from src.img_processing.editing import cropping
-from src.img_processing.editing import random_selection
+from src.img_processing.base import memory_budget
 from src.img_processing.io import imgread
-from src.img_processing.mask import scale_mask
-from src.img_processing.tiling import tile_breaking
+from src.img_processing.io import imgwrite
+from src.img_processing.io import mask_io
+from src.img_processing.tiling import tile_usability
 
+from src.machine_learning.datasets.augmentation import generation_checkpoint
+from src.machine_learning.datasets.augmentation import generation_manifest
+from src.machine_learning.datasets.augmentation.records import sample_id_index
 from src.machine_learning.datasets.augmentation.records.angle_and_size_augmentation import AngledResizedSrcInTargetDesc
+from src.machine_learning.datasets.augmentation.records.angle_and_size_augmentation import MultiObjectSrcInTargetDesc
+from src.machine_learning.datasets.augmentation.sampling import param_space_sampler
+from src.monitoring import stage_metrics
 
 import argparse
-import collections
 import logging
 import os
-import re
 import math
 import pathlib
 import random
 import shutil
+import time
+
+import numpy as np
+
 
-import skimage
-import skimage.color
-import skimage.io
+# Max size of a draw in batches, when usable tiles are rare.
+MAX_DRAWN_BATCHES = 8
 
 
 def parse_args(argv):
@@ -54,11 +79,21 @@ def parse_args(argv):
                         required=False, type=int, default=1000)
 
     parser.add_argument('-n', '--num_outputs', dest='num_of_outputs',
-                        help='Total number of augmented images.', required=False,
+                        help='Total number of augmented objects (images, if one per tile).', required=False,
                         type=int, default=1)
+    parser.add_argument('--objects_per_tile', dest='objects_per_tile',
+                        help='Max number of objects augmented in one tile.',
+                        required=False, type=int, default=1)
     parser.add_argument('-i', '--tiles_per_img', dest='num_tiles_per_image',
-                        help='Number of cropped tiles per one target image.', required=False,
-                        type=int, default=4)
+                        help='Average number of cropped tiles per one target image in a batch.',
+                        required=False, type=int, default=4)
+    parser.add_argument('--seed', dest='seed',
+                        help='Seed of the sample space permutation (random, if absent).',
+                        required=False, type=int, default=None)
+    parser.add_argument('--partition', dest='partition',
+                        help='Partition k/N of the generation split between N nodes '
+                             '(needs the same --seed on all of them).',
+                        required=False, default='0/1')
 
     parser.add_argument('-p', '--target_paddings', dest='target_paddings',
                         help='Comma-separated left, right, top, bottom target image paddings.',
@@ -81,6 +116,14 @@ def parse_args(argv):
                         help='Height boundary of augmented object angle.',
                         required=False, type=int, default=180)
 
+    parser.add_argument('--min_tile_opaque_share', dest='min_tile_opaque_share',
+                        help='Min share of opaque tile pixels to use the tile [0..1].',
+                        required=False, type=float, default=None)
+    parser.add_argument('--min_tile_luminance_std', dest='min_tile_luminance_std',
+                        help='Min standard deviation of tile luminance to use the tile '
+                             '(skips blank areas).',
+                        required=False, type=float, default=None)
+
     parser.add_argument('--scaled_mask_width', dest='scaled_mask_width',
                         help='Width of scaled mask.',
                         required=False, type=int, default=32)
@@ -92,11 +135,56 @@ def parse_args(argv):
                         help='Transparency threshold for smoothing [0..255].', required=False,
                         type=int, default=230)
 
+    parser.add_argument('--src_atlas', dest='src_atlas_path',
+                        help='Folder of source objects pre-rendered by source_atlas_main.',
+                        required=False, default=None)
+
+    parser.add_argument('--sample_index', dest='excluded_sample_index_path',
+                        help='Index of already generated samples to skip (*.npy or *.npz).',
+                        required=False, default=None)
+    parser.add_argument('--bloom_filter_fp_rate', dest='bloom_filter_fp_rate',
+                        help='False positive rate of Bloom filter index of generated samples '
+                             '(exact index, if absent).',
+                        required=False, type=float, default=None)
+
+    parser.add_argument('--resume', dest='resume', action='store_true',
+                        help='Continue interrupted generation in the output folder.')
+    parser.add_argument('--append', dest='append', action='store_true',
+                        help='Add --num_outputs more samples to the output folder.')
+    parser.add_argument('--checkpoint_every', dest='checkpoint_every',
+                        help='Number of generated samples between checkpoints.',
+                        required=False, type=int, default=1000)
+
+    parser.add_argument('--output_format', dest='output_format',
+                        help='Format of output image files.', required=False,
+                        choices=imgwrite.AsyncImageWriter.FILE_FORMATS,
+                        default=imgwrite.AsyncImageWriter.PNG_FORMAT)
+    parser.add_argument('--mask_format', dest='mask_format',
+                        help='Format of mask files: 1-bit PNG or bit-packed bmask '
+                             '(as other images, if absent).', required=False,
+                        choices=mask_io.MASK_FORMATS, default=None)
+    parser.add_argument('--png_compress_level', dest='png_compress_level',
+                        help='PNG compression level [0..9].', required=False, type=int, default=6)
+    parser.add_argument('--writer_threads', dest='num_writer_threads',
+                        help='Number of image writing threads.', required=False, type=int, default=4)
+    parser.add_argument('--writer_queue_size', dest='writer_queue_size',
+                        help='Max number of images waiting to be written.',
+                        required=False, type=int, default=64)
+    parser.add_argument('--memory_budget_mb', dest='memory_budget_mb',
+                        help='Memory budget throttling decoded images and queued sample files '
+                             '(unlimited, if absent).',
+                        required=False, type=int, default=None)
+
+    stage_metrics.add_metrics_args(parser)
+
     return parser.parse_args(argv[1:])
 
 
 def main(argv):
     parsed_args = parse_args(argv)
+    from src.machine_learning.datasets.augmentation import source_atlas
+    from src.machine_learning.datasets.augmentation import src_in_target_augmentation
+
     src_dir_path = pathlib.Path(parsed_args.src_dir_path)
     targets_dir_path = pathlib.Path(parsed_args.targets_dir_path)
     output_dir_path = pathlib.Path(parsed_args.output_dir_path)
@@ -114,15 +202,28 @@ def main(argv):
         logging.error('Number of tiles per one image or outputs is 0 or negative.')
         return os.EX_NOINPUT
 
-    shutil.rmtree(output_dir_path)
-    output_dir_path.mkdir(parents=True, exist_ok=True)
-
-    current_subdir_num = 0
-    number_of_subdirs = (
-        math.ceil(float(num_of_outputs) / num_of_samples_in_subdir)
-        if num_of_samples_in_subdir < num_of_outputs else 0)
-    subdir_name_len =  len(str(number_of_subdirs - 1)) if number_of_subdirs > 0 else 0
-    subdir_name_format = "{:0"+ str(subdir_name_len) +"d}" if number_of_subdirs > 0 else ""
+    objects_per_tile = parsed_args.objects_per_tile
+    if objects_per_tile <= 0:
+        logging.error('Number of objects per tile is 0 or negative.')
+        return os.EX_USAGE
+
+    if parsed_args.resume and parsed_args.append:
+        logging.error('Generation can be either resumed or appended.')
+        return os.EX_USAGE
+
+    partition = generation_manifest.parse_partition(parsed_args.partition)
+    if not partition:
+        logging.error('Invalid %s partition, k/N with 0 <= k < N is expected.', parsed_args.partition)
+        return os.EX_USAGE
+    partition_idx, num_partitions = partition
+    if num_partitions > 1 and parsed_args.seed is None and not (parsed_args.resume or parsed_args.append):
+        logging.error('Partitions of the generation need the same --seed.')
+        return os.EX_USAGE
+    partition_prefix = generation_manifest.get_partition_prefix(partition_idx, num_partitions)
+    checkpoint_file_name = generation_manifest.get_partition_file_name(
+        partition_prefix, generation_checkpoint.GenerationCheckpoint.FILE_NAME)
+    num_of_outputs = generation_manifest.get_partition_num_of_outputs(
+        num_of_outputs, partition_idx, num_partitions)
 
     tile_width = parsed_args.tile_width
     tile_height = parsed_args.tile_height
@@ -160,157 +261,500 @@ def main(argv):
         logging.error('Incorrect source object transparency threshold.')
         return os.EX_NOINPUT
 
-    labeling_file_regexp = re.compile(r'(.*\.ini|.*\.xcf|.*\.psd)')
-    target_image_files = collections.deque(imgread.list_image_file_from_dir(
-        targets_dir_path, recursive=True,
-        ignore_non_images=True, ignored_file_regexp=labeling_file_regexp))
-    src_obj_img_files = list(imgread.list_image_file_from_dir(
-        src_dir_path, recursive=True,
-        ignore_non_images=True, ignored_file_regexp=labeling_file_regexp))
-
-    output_idx = 0
-    failed_output_idx = 0
-    random_collision_cnt = 0
-    added_samples = set()
-    while output_idx < num_of_outputs and target_image_files and src_obj_img_files:
-        target_image_file = target_image_files[0]
-        target_image = target_image_file.load()
-        target_image_files.rotate(-1)
-        if not target_image:
-            logging.error('Malformed target %s.', target_image_files[0])
-            target_image_files.pop()  # malformed
-            continue
-
-        if not (target_paddings.within_width(target_image.shape[1]) and
-                target_paddings.within_height(target_image.shape[0])):
-            logging.error('%s padding mismatch %s.', target_paddings, target_image_file)
-            target_image_files.pop()
-            continue
-
-        src_imgs_and_aug_descriptors = []
-
-        img_tile_idx, rest_out_count = 0, num_of_outputs - output_idx
+    if not (0 <= parsed_args.png_compress_level <= 9):
+        logging.error('Incorrect PNG compression level.')
+        return os.EX_NOINPUT
+
+    generation_params = {
+        'num_subdir_samples': num_of_samples_in_subdir,
+        'tile_width': tile_width, 'tile_height': tile_height,
+        'target_paddings': repr(target_paddings),
+        'low_src_obj_width': lower_bound_of_src_obj_width,
+        'upper_src_obj_width': upper_bound_of_src_obj_width,
+        'low_src_obj_angle': lower_obj_angle_degrees, 'upper_src_obj_angle': upper_obj_angle_degrees,
+        'scaled_mask_width': scaled_mask_width, 'scaled_mask_height': scaled_mask_height,
+        'alpha_channel_threshold': alpha_channel_threshold,
+    }
+
+    if objects_per_tile > 1:
+        generation_params['objects_per_tile'] = objects_per_tile
+    if num_partitions > 1:
+        generation_params['num_partitions'] = num_partitions
+
+    tile_usability_criteria = None
+    if parsed_args.min_tile_opaque_share is not None or parsed_args.min_tile_luminance_std is not None:
+        tile_usability_criteria = tile_usability.TileUsabilityCriteria(
+            min_opaque_share=parsed_args.min_tile_opaque_share or 0.0,
+            min_luminance_std=parsed_args.min_tile_luminance_std or 0.0,
+            alpha_channel_threshold=alpha_channel_threshold)
+        if not 0 <= tile_usability_criteria.min_opaque_share <= 1:
+            logging.error('Incorrect min share of opaque tile pixels.')
+            return os.EX_NOINPUT
+        generation_params['tile_usability'] = tile_usability_criteria._asdict()
+
+    src_atlas = None
+    if parsed_args.src_atlas_path:
+        try:
+            src_atlas = source_atlas.SourceAtlas(parsed_args.src_atlas_path)
+        except (OSError, ValueError, KeyError):
+            logging.exception('Malformed source atlas %s.', parsed_args.src_atlas_path)
+            return os.EX_NOINPUT
+        if src_atlas.alpha_channel_threshold != alpha_channel_threshold:
+            logging.error('Source atlas is rendered with %d transparency threshold.',
+                          src_atlas.alpha_channel_threshold)
+            return os.EX_NOINPUT
+        generation_params['src_atlas'] = src_atlas.get_content_hash()
+
+    target_image_files, target_tile_ranges = src_in_target_augmentation.list_target_files(
+        targets_dir_path, (tile_height, tile_width), target_paddings)
+    tile_usabilities, usable_tile_share = None, 1.0
+    if tile_usability_criteria and target_image_files:
+        target_image_files, target_tile_ranges, tile_usabilities = (
+            src_in_target_augmentation.get_target_tile_usabilities(
+                target_image_files, target_tile_ranges,
+                (tile_height, tile_width), tile_usability_criteria))
+        if tile_usabilities:
+            usable_tile_share = (
+                sum(target_tile_usability.num_usable for target_tile_usability in tile_usabilities) /
+                sum(len(target_tile_usability) for target_tile_usability in tile_usabilities))
+            logging.info('%.3f of tile positions are usable.', usable_tile_share)
+    if src_atlas:
+        src_obj_img_files, src_width_ranges = src_atlas.list_src_obj_files()
+        src_width_ranges = [
+            param_space_sampler.clip_range(
+                src_width_range, lower_bound_of_src_obj_width, upper_bound_of_src_obj_width)
+            for src_width_range in src_width_ranges]
+        angle_range = param_space_sampler.clip_range(
+            src_atlas.angle_range, lower_obj_angle_degrees, upper_obj_angle_degrees)
+    else:
+        src_obj_img_files, src_width_ranges = src_in_target_augmentation.list_src_obj_files(
+            src_dir_path, lower_bound_of_src_obj_width, upper_bound_of_src_obj_width)
+        angle_range = range(lower_obj_angle_degrees, upper_obj_angle_degrees + 1)
+
+    if not target_image_files or not src_obj_img_files:
+        logging.warning('No target or source images.')
+        return os.EX_NOINPUT
+
+    # Files are compared by names and sizes, not paths, so partitions generated on
+    # nodes mounting them at different paths are merged.
+    generation_params['target_files'] = generation_manifest.hash_file_list(
+        [target_image_file.path for target_image_file in target_image_files])
+    generation_params['src_files'] = generation_manifest.hash_file_list(
+        [src_obj_img_file.path for src_obj_img_file in src_obj_img_files], with_sizes=not src_atlas)
+
+    if parsed_args.resume or parsed_args.append:
+        checkpoint = generation_checkpoint.GenerationCheckpoint.load(output_dir_path, checkpoint_file_name)
+        if not checkpoint:
+            logging.error('No %s generation checkpoint in %s.', checkpoint_file_name, output_dir_path)
+            return os.EX_NOINPUT
+        if checkpoint.generation_params != generation_params:
+            logging.error('Generation parameters differ from the %s checkpoint ones: %s.',
+                          output_dir_path, checkpoint.generation_params)
+            return os.EX_NOINPUT
+        if parsed_args.append:
+            checkpoint.num_of_outputs = checkpoint.output_idx + num_of_outputs
+        num_of_outputs = checkpoint.num_of_outputs
+        logging.info('Continuing generation of %s.', checkpoint)
+    else:
+        checkpoint = generation_checkpoint.GenerationCheckpoint(
+            generation_params=generation_params,
+            seed=parsed_args.seed if parsed_args.seed is not None else np.random.SeedSequence().entropy)
+        checkpoint.num_of_outputs = num_of_outputs
+        if partition_prefix:
+            # Other partitions might be generated into the same folder.
+            for partition_path in generation_manifest.list_partition_paths(output_dir_path, partition_prefix):
+                if partition_path.is_dir():
+                    shutil.rmtree(partition_path)
+                else:
+                    partition_path.unlink()
+        elif output_dir_path.exists():
+            shutil.rmtree(output_dir_path)
+        output_dir_path.mkdir(parents=True, exist_ok=True)
+
+    number_of_subdirs = (
+        math.ceil(float(num_of_outputs) / num_of_samples_in_subdir)
+        if num_of_samples_in_subdir < num_of_outputs else 0)
+    if number_of_subdirs > 0 and not checkpoint.subdir_name_len:
+        # The width is kept on --append, so a partially filled subdir keeps its name.
+        checkpoint.subdir_name_len = len(str(number_of_subdirs - 1))
+    subdir_name_format = "{:0"+ str(checkpoint.subdir_name_len) +"d}" if number_of_subdirs > 0 else ""
+    if partition_prefix:
+        subdir_name_format = partition_prefix + ('-' + subdir_name_format if subdir_name_format else '')
+    current_subdir_num = (
+        checkpoint.output_idx // num_of_samples_in_subdir if number_of_subdirs > 0 else 0)
+
+    logging.info('Sampling with %d seed.', checkpoint.seed)
+    random.seed(checkpoint.seed * num_partitions + partition_idx)
+    checkpoint.restore_random_state()
+    param_space = param_space_sampler.AugmentationParamSpace(
+        target_tile_ranges, src_width_ranges, angle_range)
+    if checkpoint.param_space_size and checkpoint.param_space_size != len(param_space):
+        logging.error('Source or target images changed since the checkpoint.')
+        return os.EX_NOINPUT
+    checkpoint.param_space_size = len(param_space)
+    sampler = param_space_sampler.ParamSpaceSampler(
+        param_space, seed=checkpoint.seed, next_draw_idx=checkpoint.next_draw_idx,
+        partition_idx=partition_idx, num_partitions=num_partitions)
+    sample_batch_size = max(1, num_tiles_per_image) * objects_per_tile * len(target_image_files)
+
+    excluded_sample_index = None
+    if parsed_args.excluded_sample_index_path:
+        excluded_sample_index = sample_id_index.load_sample_index(
+            parsed_args.excluded_sample_index_path)
+    if checkpoint.sample_index_file_name:
+        generated_sample_index_path = output_dir_path / checkpoint.sample_index_file_name
+        generated_sample_index = (
+            sample_id_index.load_sample_index(generated_sample_index_path)
+            if generated_sample_index_path.is_file() else sample_id_index.SampleIdIndex())
+    elif parsed_args.bloom_filter_fp_rate:
+        generated_sample_index = sample_id_index.SampleIdBloomFilter(
+            capacity=num_of_outputs, false_positive_rate=parsed_args.bloom_filter_fp_rate)
+        generated_sample_index_path = output_dir_path / generation_manifest.get_partition_file_name(
+            partition_prefix, sample_id_index.SampleIdBloomFilter.FILE_NAME)
+    else:
+        generated_sample_index = sample_id_index.SampleIdIndex()
+        generated_sample_index_path = output_dir_path / generation_manifest.get_partition_file_name(
+            partition_prefix, sample_id_index.SampleIdIndex.FILE_NAME)
+    checkpoint.sample_index_file_name = generated_sample_index_path.name
+    file_prefix_hashes = {}
+
+    memory_accountant = memory_budget.get_memory_accountant()
+    if parsed_args.memory_budget_mb:
+        memory_accountant.set_budget(parsed_args.memory_budget_mb * 1024 * 1024)
+    metrics_reporter = stage_metrics.start_metrics_reporter(parsed_args)
+    metrics = stage_metrics.get_metrics()
+    image_writer = imgwrite.AsyncImageWriter(
+        num_threads=parsed_args.num_writer_threads, max_queue_size=parsed_args.writer_queue_size,
+        file_format=parsed_args.output_format, png_compress_level=parsed_args.png_compress_level,
+        mask_format=parsed_args.mask_format or (
+            mask_io.PNG_FORMAT if parsed_args.output_format == imgwrite.AsyncImageWriter.PNG_FORMAT
+            else None))
+
+    output_idx = start_output_idx = checkpoint.output_idx
+    start_time = time.perf_counter()
+    failed_output_idx = checkpoint.failed_output_idx
+    checkpoint_output_idx = output_idx
+    atlas_objs_nbytes = 0
+    while output_idx < num_of_outputs:
+        rest_out_count = num_of_outputs - output_idx
         if number_of_subdirs > 0:
             rest_out_count = min(rest_out_count, (current_subdir_num + 1) * num_of_samples_in_subdir - output_idx)
-        while img_tile_idx < min(num_tiles_per_image, rest_out_count) and src_obj_img_files:
-            src_obj_img_file = random.choice(src_obj_img_files)
-            src_obj_img = src_obj_img_file.load()
-            if (not src_obj_img or not tile_breaking.any_tile_fit(
-                    (tile_height, tile_width), target_image.shape, target_paddings)):
-                logging.error('Malformed or too small source %s.', src_obj_img_file)
-                src_obj_img_files.remove(src_obj_img_file)
-                continue
-            if random_collision_cnt > 10^6:
-                logging.error('Excessive number of random collisions.')
-                sys.exit(-1)
-
-            aug_sample_desc = AngledResizedSrcInTargetDesc.from_src_and_target_file(
-                src_img_file=src_obj_img_file, target_image_file=target_image_file)
-
-            aug_sample_desc.tile_top_left_row, aug_sample_desc.tile_top_left_col = (
-                tile_breaking.get_random_tile_row_col(
-                    (tile_height, tile_width), target_image.shape, target_paddings))
-            aug_sample_desc.tile_width, aug_sample_desc.tile_height = tile_width, tile_height
-            aug_sample_desc.angle_in_degrees = random.randint(
-                lower_obj_angle_degrees, upper_obj_angle_degrees)
-            aug_sample_desc.scaled_width_in_pixels = random.randint(
-                min(src_obj_img.shape[1], lower_bound_of_src_obj_width),
-                min(src_obj_img.shape[1], upper_bound_of_src_obj_width) + 1)
-
-            if aug_sample_desc.sample_id in added_samples:
-                random_collision_cnt += 1
+        num_of_batch_outputs = min(sample_batch_size, rest_out_count)
+        # Draw more to get enough usable tiles (up to a few batches for rarely usable tiles).
+        draw_start_idx = sampler.next_draw_idx
+        sampled_params = sampler.draw(min(
+            math.ceil(num_of_batch_outputs / usable_tile_share),
+            MAX_DRAWN_BATCHES * sample_batch_size))
+        num_of_sampled = len(sampled_params.target_idx)
+        if not num_of_sampled:
+            logging.warning('All the %d possible samples are generated.', len(sampler.param_space))
+            break
+        if tile_usabilities:
+            usable_samples = np.flatnonzero(tile_usability.are_tiles_usable(
+                tile_usabilities, sampled_params.target_idx,
+                sampled_params.tile_top_left_row, sampled_params.tile_top_left_col))
+            if len(usable_samples) > num_of_batch_outputs:
+                # Samples drawn after the last taken one are drawn again by the next batch.
+                usable_samples = usable_samples[:num_of_batch_outputs]
+                num_of_sampled = int(usable_samples[-1]) + 1
+                sampler.next_draw_idx = draw_start_idx + num_of_sampled
+            metrics.count('tiles_unusable', num_of_sampled - len(usable_samples))
+            sampled_params = param_space_sampler.SampledParams(
+                *(sampled_values[usable_samples] for sampled_values in sampled_params))
+            num_of_sampled = len(usable_samples)
+
+        # Objects of the same tile are placed into the tile of the first one, but keep
+        # their drawn params (and sample hashes) not to collide with other draws.
+        first_tile_objects = src_in_target_augmentation.group_tile_objects(
+            sampled_params.target_idx, objects_per_tile)
+        tile_top_left_rows = sampled_params.tile_top_left_row[first_tile_objects]
+        tile_top_left_cols = sampled_params.tile_top_left_col[first_tile_objects]
+
+        for target_idx, src_idx in zip(sampled_params.target_idx, sampled_params.src_idx):
+            if (target_idx, src_idx) not in file_prefix_hashes:
+                file_prefix_hashes[target_idx, src_idx] = sample_id_index.hash_file_prefix(
+                    AngledResizedSrcInTargetDesc.combine_augmented_file_names(
+                        target_image_files[target_idx], src_obj_img_files[src_idx]))
+        sample_hashes = sample_id_index.hash_sample_fields(
+            np.array([file_prefix_hashes[target_idx, src_idx] for target_idx, src_idx in zip(
+                sampled_params.target_idx, sampled_params.src_idx)], dtype=np.uint64),
+            sampled_params.angle_in_degrees, sampled_params.scaled_width_in_pixels,
+            sampled_params.tile_top_left_row, sampled_params.tile_top_left_col)
+        if excluded_sample_index is not None:
+            new_samples = ~excluded_sample_index.contains(sample_hashes)
+            if not np.all(new_samples):
+                logging.info('%d already generated samples skipped.', np.count_nonzero(~new_samples))
+                metrics.count('samples_skipped', np.count_nonzero(~new_samples))
+                sampled_params = param_space_sampler.SampledParams(
+                    *(sampled_values[new_samples] for sampled_values in sampled_params))
+                sample_hashes = sample_hashes[new_samples]
+                first_tile_objects = first_tile_objects[new_samples]
+                tile_top_left_rows = tile_top_left_rows[new_samples]
+                tile_top_left_cols = tile_top_left_cols[new_samples]
+                num_of_sampled = len(sample_hashes)
+        generated_sample_index.add(sample_hashes)
+
+        for target_idx in np.unique(sampled_params.target_idx):
+            # Atlas objects of the previous target are augmented and dropped.
+            memory_accountant.release(memory_budget.MemoryAccountant.CACHES, atlas_objs_nbytes)
+            atlas_objs_nbytes = 0
+
+            target_sample_indices = np.flatnonzero(sampled_params.target_idx == target_idx)
+            target_image_file = target_image_files[target_idx]
+            with metrics.stage('decode_target'):
+                memory_accountant.wait_for_budget(get_decoded_rgba_nbytes(target_image_file))
+                target_image = target_image_file.load()
+            if not target_image:
+                logging.error('Malformed target %s.', target_image_file)
+                failed_output_idx += len(target_sample_indices)
+                metrics.count('samples_failed', len(target_sample_indices))
                 continue
-            src_imgs_and_aug_descriptors.append((src_obj_img, aug_sample_desc))
-
-            img_tile_idx += 1
 
-        # noinspection PyBroadException
-        try:
-            augment_source_in_target(
-                target_image, src_imgs_and_aug_descriptors,
-                scaled_mask_width, scaled_mask_height, alpha_channel_threshold,
+            src_obj_imgs = {}
+            src_imgs_and_aug_descriptors, tile_first_objects, tile_positions = [], [], []
+            for sample_idx in target_sample_indices:
+                src_idx = sampled_params.src_idx[sample_idx]
+                src_obj_img_file = src_obj_img_files[src_idx]
+                augmented_obj_rgba = None
+                if src_atlas:
+                    with metrics.stage('atlas_lookup'):
+                        # Objects are small, so only the bytes already held are checked.
+                        memory_accountant.wait_for_budget(0)
+                        augmented_obj_rgba = src_atlas.lookup(
+                            src_idx, sampled_params.angle_in_degrees[sample_idx],
+                            sampled_params.scaled_width_in_pixels[sample_idx])
+                    memory_accountant.track(
+                        memory_budget.MemoryAccountant.CACHES, augmented_obj_rgba.nbytes)
+                    atlas_objs_nbytes += augmented_obj_rgba.nbytes
+                    src_obj_imgs[src_idx] = None
+                elif src_idx not in src_obj_imgs:
+                    with metrics.stage('decode_source'):
+                        memory_accountant.wait_for_budget(get_decoded_rgba_nbytes(src_obj_img_file))
+                        src_obj_imgs[src_idx] = src_obj_img_file.load()
+                if augmented_obj_rgba is None and not src_obj_imgs[src_idx]:
+                    logging.error('Malformed source %s.', src_obj_img_file)
+                    failed_output_idx += 1
+                    metrics.count('samples_failed')
+                    continue
+
+                aug_sample_desc = AngledResizedSrcInTargetDesc.from_src_and_target_file(
+                    src_img_file=src_obj_img_file, target_image_file=target_image_file)
+                aug_sample_desc.tile_top_left_row = int(sampled_params.tile_top_left_row[sample_idx])
+                aug_sample_desc.tile_top_left_col = int(sampled_params.tile_top_left_col[sample_idx])
+                aug_sample_desc.tile_width, aug_sample_desc.tile_height = tile_width, tile_height
+                aug_sample_desc.angle_in_degrees = int(sampled_params.angle_in_degrees[sample_idx])
+                aug_sample_desc.scaled_width_in_pixels = int(
+                    sampled_params.scaled_width_in_pixels[sample_idx])
+                src_imgs_and_aug_descriptors.append(
+                    (src_obj_imgs[src_idx], aug_sample_desc, augmented_obj_rgba))
+                tile_first_objects.append(first_tile_objects[sample_idx])
+                tile_positions.append(
+                    (int(tile_top_left_rows[sample_idx]), int(tile_top_left_cols[sample_idx])))
+
+            sample_dir_path = (
                 output_dir_path / subdir_name_format.format(current_subdir_num)
-                if number_of_subdirs > 0 else output_dir_path)
-        except Exception:
-            logging.exception('Augmentation %s.', src_imgs_and_aug_descriptors)
-            failed_output_idx += 1
+                if subdir_name_format else output_dir_path)
+            if objects_per_tile > 1:
+                tile_objects, tile_positions_of_first_objects = {}, {}
+                for first_tile_object, tile_position, src_img_and_aug_desc in zip(
+                        tile_first_objects, tile_positions, src_imgs_and_aug_descriptors):
+                    tile_objects.setdefault(first_tile_object, []).append(src_img_and_aug_desc)
+                    tile_positions_of_first_objects[first_tile_object] = tile_position
+                for first_tile_object, src_objs_and_descs in tile_objects.items():
+                    # noinspection PyBroadException
+                    try:
+                        failed_output_idx += augment_sources_in_target_tile(
+                            target_image, src_objs_and_descs,
+                            tile_positions_of_first_objects[first_tile_object],
+                            scaled_mask_width, scaled_mask_height, alpha_channel_threshold,
+                            sample_dir_path, image_writer)
+                    except Exception:
+                        logging.exception('Augmentation %s.', src_objs_and_descs)
+                        failed_output_idx += len(src_objs_and_descs)
+                        metrics.count('samples_failed', len(src_objs_and_descs))
+                continue
 
-        output_idx += len(src_imgs_and_aug_descriptors)
-        added_samples.update(aug_desc.sample_id for src_img, aug_desc in src_imgs_and_aug_descriptors)
+            # noinspection PyBroadException
+            try:
+                augment_source_in_target(
+                    target_image, src_imgs_and_aug_descriptors,
+                    scaled_mask_width, scaled_mask_height, alpha_channel_threshold,
+                    sample_dir_path, image_writer)
+            except Exception:
+                logging.exception('Augmentation %s.', src_imgs_and_aug_descriptors)
+                failed_output_idx += 1
+                metrics.count('samples_failed')
+
+        memory_accountant.release(memory_budget.MemoryAccountant.CACHES, atlas_objs_nbytes)
+        atlas_objs_nbytes = 0
+        output_idx += num_of_sampled
+        metrics.count('samples_generated', num_of_sampled)
+        metrics.set_gauge('output_idx', output_idx)
+        memory_accountant.publish(metrics)
         if number_of_subdirs > 0 and (current_subdir_num + 1) * num_of_samples_in_subdir <= output_idx:
             current_subdir_num += 1
-        if output_idx % 25 < len(src_imgs_and_aug_descriptors):
+        if output_idx % 25 < num_of_sampled:
             logging.info(f"{output_idx - (output_idx % 25)} outputs processed.")
-        if output_idx >= num_of_outputs:
-            break
-
-    if not target_image_files or not src_obj_img_files:
-        logging.warning('No target or source images.')
+        if output_idx - checkpoint_output_idx >= parsed_args.checkpoint_every:
+            try:
+                save_generation_progress(
+                    checkpoint, sampler, output_idx, failed_output_idx,
+                    generated_sample_index, image_writer, output_dir_path, checkpoint_file_name)
+            except imgwrite.ImageWriteError:
+                logging.exception('Generated samples are not saved.')
+                if metrics_reporter:
+                    metrics_reporter.stop()
+                return os.EX_IOERR
+            checkpoint_output_idx = output_idx
+
+    try:
+        save_generation_progress(
+            checkpoint, sampler, output_idx, failed_output_idx,
+            generated_sample_index, image_writer, output_dir_path, checkpoint_file_name)
+        image_writer.close()
+        if partition_prefix:
+            generation_manifest.GenerationManifest.from_checkpoint(
+                checkpoint, partition_idx, num_partitions, [
+                    partition_path.name for partition_path in generation_manifest.list_partition_paths(
+                        output_dir_path, partition_prefix) if partition_path.is_dir()]
+            ).save(output_dir_path, generation_manifest.get_partition_file_name(
+                partition_prefix, generation_manifest.GenerationManifest.FILE_NAME))
+    except imgwrite.ImageWriteError:
+        logging.exception('Generated samples are not saved.')
+        return os.EX_IOERR
+    finally:
+        if metrics_reporter:
+            metrics_reporter.stop()
     if output_idx % 25 != 0:
         logging.info('%d output sets generated%s.', output_idx - failed_output_idx,
             '({} failed)'.format(failed_output_idx) if failed_output_idx else '')
+    generation_duration = time.perf_counter() - start_time
+    logging.info('%d objects generated in %.1fs (%.1f objects/s).',
+                 output_idx - start_output_idx, generation_duration,
+                 (output_idx - start_output_idx) / max(generation_duration, 1e-9))
     return os.EX_OK
 
 
+def get_decoded_rgba_nbytes(image_file):
+    """Estimates bytes of the decoded RGBa-array from the image file header (0, if unreadable)."""
+    img_shape = imgread.read_image_shape(image_file.path)
+    return img_shape[0] * img_shape[1] * 4 if img_shape else 0
+
+
+def save_generation_progress(
+        checkpoint, sampler, output_idx, failed_output_idx,
+        generated_sample_index, image_writer, output_dir_path, checkpoint_file_name=None):
+    """Flushes sample files, saves sample index and then the checkpoint referring to it.
+
+    Args:
+      checkpoint: GenerationCheckpoint to update.
+      sampler: ParamSpaceSampler of the generation.
+      output_idx: Number of generated samples.
+      failed_output_idx: Number of failed samples.
+      generated_sample_index: Index of generated sample ids.
+      image_writer: AsyncImageWriter of sample files.
+      output_dir_path: Output folder.
+      checkpoint_file_name: Checkpoint file name of a generated partition (optional).
+
+    Raises:
+      ImageWriteError: Some of sample files are not written.
+    """
+    image_writer.flush()
+    generated_sample_index.save(output_dir_path / checkpoint.sample_index_file_name)
+    checkpoint.next_draw_idx = sampler.next_draw_idx
+    checkpoint.output_idx = output_idx
+    checkpoint.failed_output_idx = failed_output_idx
+    checkpoint.capture_random_state()
+    checkpoint.save(output_dir_path, checkpoint_file_name)
+
+
 def augment_source_in_target(
         target_image, src_imgs_and_aug_descriptors,
         scaled_mask_width, scaled_mask_height,
-        alpha_channel_threshold, output_dir_path):
+        alpha_channel_threshold, output_dir_path, image_writer):
     """Overlays source image over the target with the specified augmentations.
 
     Args:
       target_image: Target image.
       src_imgs_and_aug_descriptors: collection of source images (transparent
-                                    pixels to outline the contour) and related
-                                    meta-data of augmented sample.
+                                    pixels to outline the contour), related
+                                    meta-data of augmented sample and already
+                                    augmented source objects (or None).
       scaled_mask_width: Width of scaled mask.
       scaled_mask_height: Height of scaled mask.
       alpha_channel_threshold: Threshold to filter out transparent pixels [0..255].
       output_dir_path: Output folder.
+      image_writer: AsyncImageWriter of sample files.
     """
-    for src_obj_img, aug_sample_desc in src_imgs_and_aug_descriptors:
-        # Prepare the target tile.
-        tile_rgba = cropping.crop_rgba(
-            target_image.rgba,
-            aug_sample_desc.tile_top_left_row, aug_sample_desc.tile_top_left_col,
-            aug_sample_desc.tile_width, aug_sample_desc.tile_height)
-
-        # Take next augmented source object.
-        augmented_obj_rgba = rotate_resize_crop.rotate_resize_crop_rgba_img(
-            src_obj_img.rgba,
-            aug_sample_desc.angle_in_degrees, aug_sample_desc.scaled_width_in_pixels,
-            alpha_channel_threshold)
-
-        # Find random place in the tile.
-        augmented_obj_center_row, augmented_obj_center_col = (
-            random_selection.get_random_row_col(
-                tile_rgba.shape[1], tile_rgba.shape[0],
-                augmented_obj_rgba.shape[1] // 2, augmented_obj_rgba.shape[0] // 2))
-
-        (target_with_augmented_rgba,
-         augmented_src_rgba, binary_mask) = adjust_overlay.saliency_blend_into_largest(
-            tile_rgba, augmented_obj_rgba,
-            augmented_obj_center_row, augmented_obj_center_col,
-            alpha_channel_threshold, tiny_img_max_side_size=20)
-
-        scaled_mask, mask_of_mask = scale_mask.scale_binary_mask(
-            binary_mask, scaled_mask_width, scaled_mask_height,
-            borderline_ratio_thold=0.5)
-
-        file_desc_to_rgba = {
-            AngledResizedSrcInTargetDesc.AUGMENTED_TILE : target_with_augmented_rgba,
-            AngledResizedSrcInTargetDesc.TARGET_TILE : tile_rgba,
-            AngledResizedSrcInTargetDesc.AUGMENTED_SRC : augmented_src_rgba,
-            AngledResizedSrcInTargetDesc.TARGET_MASK : binary_mask,
-            AngledResizedSrcInTargetDesc.TARGET_SCALED_MASK : scaled_mask,
-            AngledResizedSrcInTargetDesc.TARGET_SCALED_MASK_OF_MASK : mask_of_mask,
-        }
-        for file_type, pixels in file_desc_to_rgba.items():
-            output_dir_path.mkdir(parents=True, exist_ok=True)
-            skimage.io.imsave(
-                str(aug_sample_desc.create_saved_file_path(output_dir_path, file_type, "png")),
-                pixels, check_contrast=False)
+    from src.machine_learning.datasets.augmentation import src_in_target_augmentation
+
+    metrics = stage_metrics.get_metrics()
+    output_dir_path.mkdir(parents=True, exist_ok=True)
+    for src_obj_img, aug_sample_desc, augmented_obj_rgba in src_imgs_and_aug_descriptors:
+        file_desc_to_rgba = src_in_target_augmentation.augment_sample(
+            target_image, src_obj_img, aug_sample_desc,
+            scaled_mask_width, scaled_mask_height, alpha_channel_threshold,
+            augmented_obj_rgba=augmented_obj_rgba)
+        with metrics.stage('write_queue'):
+            for file_type, pixels in file_desc_to_rgba.items():
+                if file_type in AngledResizedSrcInTargetDesc.MASK_RECORD_FILES:
+                    image_writer.write_mask(
+                        aug_sample_desc.create_saved_file_path(
+                            output_dir_path, file_type, image_writer.mask_file_ext), pixels)
+                else:
+                    image_writer.write(
+                        aug_sample_desc.create_saved_file_path(
+                            output_dir_path, file_type, image_writer.file_ext), pixels)
+        metrics.count('tiles_generated')
+
+
+def augment_sources_in_target_tile(
+        target_image, src_objs_and_descs, tile_position,
+        scaled_mask_width, scaled_mask_height,
+        alpha_channel_threshold, output_dir_path, image_writer):
+    """Overlays several source images over one target tile blending it once.
 
+    Args:
+      target_image: Target image.
+      src_objs_and_descs: collection of source images, related meta-data of
+                          augmented objects in the same tile and already
+                          augmented source objects (or None).
+      tile_position: Row and column of the tile top left corner in the target.
+      scaled_mask_width: Width of scaled mask.
+      scaled_mask_height: Height of scaled mask.
+      alpha_channel_threshold: Threshold to filter out transparent pixels [0..255].
+      output_dir_path: Output folder.
+      image_writer: AsyncImageWriter of sample files.
+
+    Returns:
+      Number of objects not placed in the tile.
+    """
+    from src.machine_learning.datasets.augmentation import src_in_target_augmentation
+
+    metrics = stage_metrics.get_metrics()
+    output_dir_path.mkdir(parents=True, exist_ok=True)
+    multi_obj_sample_desc = MultiObjectSrcInTargetDesc(
+        [aug_sample_desc for _, aug_sample_desc, _ in src_objs_and_descs], *tile_position)
+    file_desc_to_rgba = src_in_target_augmentation.augment_multi_object_sample(
+        target_image, src_objs_and_descs, multi_obj_sample_desc,
+        scaled_mask_width, scaled_mask_height, alpha_channel_threshold)
+    multi_obj_sample_desc.name_after_first_placed_object()
+    num_of_not_placed = multi_obj_sample_desc.object_boxes.count(None)
+    if num_of_not_placed:
+        metrics.count('samples_failed', num_of_not_placed)
+    with metrics.stage('write_queue'):
+        for file_type, pixels in file_desc_to_rgba.items():
+            if file_type in MultiObjectSrcInTargetDesc.MASK_RECORD_FILES:
+                image_writer.write_mask(
+                    multi_obj_sample_desc.create_saved_file_path(
+                        output_dir_path, file_type, image_writer.mask_file_ext), pixels)
+            else:
+                image_writer.write(
+                    multi_obj_sample_desc.create_saved_file_path(
+                        output_dir_path, file_type, image_writer.file_ext), pixels)
+        multi_obj_sample_desc.save_objects_record(output_dir_path)
+    metrics.count('tiles_generated')
+    return num_of_not_placed
 
 if __name__ == '__main__':
     logging.getLogger().setLevel(logging.INFO)
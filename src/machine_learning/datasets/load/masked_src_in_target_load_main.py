@@ -1,49 +1,170 @@
 #!/usr/bin/python3
 
+# The script to validate generated dataset before training.
+#
+# Usage:
+#   python masked_src_in_target_load_main.py \
+#     --dataset_dir <generated dataset dir> --workers 16 --report_json <report path>
+#
+# Tile and scaled mask sizes are taken from the generation checkpoint (or manifest) of
+# the dataset, if they are not given.
+
 import os, sys
 SCRIPT_DIRS = os.path.dirname(os.path.abspath(__file__)).split(os.sep)
 sys.path.append(os.path.join(os.sep, *SCRIPT_DIRS[:SCRIPT_DIRS.index('src')]))
 
+from src.machine_learning.datasets.augmentation import generation_checkpoint
+from src.machine_learning.datasets.augmentation import generation_manifest
 from src.machine_learning.datasets.augmentation.records.angle_and_size_augmentation import AngledResizedSrcInTargetDesc
-from src.machine_learning.datasets.augmentation.records.angle_and_size_augmentation import AngledResizedSrcInTargetFileDesc
+from src.machine_learning.datasets.augmentation.records.angle_and_size_augmentation import MultiObjectSrcInTargetDesc
+from src.machine_learning.datasets.load import sample_validation
 
 import argparse
-import glob
+import concurrent.futures
+import functools
+import json
 import logging
 import pathlib
+import time
 
 
 def parse_args(argv):
     # Parse input arguments.
-    parser = argparse.ArgumentParser(description='Fit Sources into Targets')
+    parser = argparse.ArgumentParser(description='Validate Generated Dataset')
     parser.add_argument('-d', '--dataset_dir', dest='root_dataset_dir',
                         help='Root of all the dataset files.', required=True)
+    parser.add_argument('-w', '--tile_width', dest='tile_width',
+                        help='Width of the cropped tile (from the checkpoint, if absent).',
+                        required=False, type=int, default=None)
+    parser.add_argument('-t', '--tile_height', dest='tile_height',
+                        help='Height of the cropped tile (from the checkpoint, if absent).',
+                        required=False, type=int, default=None)
+    parser.add_argument('--scaled_mask_width', dest='scaled_mask_width',
+                        help='Width of scaled mask (from the checkpoint, if absent).',
+                        required=False, type=int, default=None)
+    parser.add_argument('--scaled_mask_height', dest='scaled_mask_height',
+                        help='Height of scaled mask (from the checkpoint, if absent).',
+                        required=False, type=int, default=None)
+
+    parser.add_argument('--workers', dest='num_workers',
+                        help='Number of validating threads or processes.',
+                        required=False, type=int, default=os.cpu_count())
+    parser.add_argument('--processes', dest='use_processes', action='store_true',
+                        help='Validate in processes instead of threads.')
+    parser.add_argument('--chunk_size', dest='chunk_size',
+                        help='Number of samples validated by one task.',
+                        required=False, type=int, default=256)
+    parser.add_argument('--full_decode', dest='full_decode', action='store_true',
+                        help='Decode all pixels instead of verifying file checksums.')
+    parser.add_argument('--report_json', dest='report_json_path',
+                        help='Path to JSON list of invalid samples and their errors.', required=False)
 
     return parser.parse_args(argv[1:])
 
 
+def list_samples(root_dataset_dir):
+    """Groups dataset files by samples.
+
+    Returns:
+      Dictionary of sample ids and dictionaries of their file type suffixes and paths.
+    """
+    aug_samples = {}
+    for dir_path, _, file_names in os.walk(root_dataset_dir):
+        for file_name in file_names:
+            file_path = os.path.join(dir_path, file_name)
+            aug_sample_desc, aug_sample_file_desc = AngledResizedSrcInTargetDesc.parse_sample_file_path(file_path)
+            if aug_sample_desc:
+                aug_samples.setdefault(aug_sample_desc.sample_id, {})[
+                    aug_sample_file_desc.target_file_desc.suffix] = file_path
+    return aug_samples
+
+
+def get_expected_shapes(parsed_args, root_dataset_dir):
+    """Gets tile and scaled mask {height, width} from arguments, generation checkpoint or manifest."""
+    generation_params = {}
+    checkpoint = generation_checkpoint.GenerationCheckpoint.load(root_dataset_dir)
+    if checkpoint:
+        generation_params = checkpoint.generation_params
+    else:
+        # Partitions share the generation parameters.
+        manifest_paths = [root_dataset_dir / generation_manifest.GenerationManifest.FILE_NAME] + (
+            generation_manifest.GenerationManifest.list_partition_manifest_paths(root_dataset_dir))
+        for manifest_path in manifest_paths:
+            manifest = generation_manifest.GenerationManifest.load(manifest_path)
+            if manifest:
+                generation_params = manifest.generation_params
+                break
+    tile_width = parsed_args.tile_width or generation_params.get('tile_width')
+    tile_height = parsed_args.tile_height or generation_params.get('tile_height')
+    scaled_mask_width = parsed_args.scaled_mask_width or generation_params.get('scaled_mask_width')
+    scaled_mask_height = parsed_args.scaled_mask_height or generation_params.get('scaled_mask_height')
+    return (
+        (tile_height, tile_width) if tile_width and tile_height else None,
+        (scaled_mask_height, scaled_mask_width) if scaled_mask_width and scaled_mask_height else None)
+
+
 def main(argv):
     parsed_args = parse_args(argv)
 
-    root_dataset_dir = parsed_args.root_dataset_dir
+    root_dataset_dir = pathlib.Path(parsed_args.root_dataset_dir)
+    if not root_dataset_dir.is_dir():
+        logging.error('%s is not a dir.', root_dataset_dir)
+        return os.EX_NOINPUT
+    if parsed_args.num_workers <= 0 or parsed_args.chunk_size <= 0:
+        logging.error('Number of workers and chunk size must be positive.')
+        return os.EX_USAGE
 
-    aug_samples = {}
+    start_time = time.perf_counter()
+    aug_samples = list_samples(root_dataset_dir)
+    tile_shape, scaled_mask_shape = get_expected_shapes(parsed_args, root_dataset_dir)
+    logging.info('%d samples listed in %.1fs, expected tile %s and scaled mask %s shapes.',
+                 len(aug_samples), time.perf_counter() - start_time, tile_shape, scaled_mask_shape)
+
+    invalid_samples = {}
+    all_file_suffixes = {file_type.suffix for file_type in AngledResizedSrcInTargetDesc.ALL_RECORD_FILES}
+    all_multi_obj_file_suffixes = {
+        file_type.suffix for file_type in MultiObjectSrcInTargetDesc.ALL_RECORD_FILES}
+    for sample_id, sample_files in aug_samples.items():
+        if MultiObjectSrcInTargetDesc.OBJECTS.suffix in sample_files:
+            if set(sample_files) != all_multi_obj_file_suffixes:
+                invalid_samples[sample_id] = ['Missing {} sample files.'.format(', '.join(
+                    str(file_suffix) for file_suffix in all_multi_obj_file_suffixes - set(sample_files)))]
+        elif set(sample_files) != all_file_suffixes:
+            invalid_samples[sample_id] = ['Missing {} sample files.'.format(', '.join(
+                str(file_suffix) for file_suffix in all_file_suffixes - set(sample_files)))]
+
+    sample_items = sorted(aug_samples.items())
+    sample_chunks = [
+        sample_items[chunk_start:chunk_start + parsed_args.chunk_size]
+        for chunk_start in range(0, len(sample_items), parsed_args.chunk_size)]
+    executor_type = (
+        concurrent.futures.ProcessPoolExecutor if parsed_args.use_processes
+        else concurrent.futures.ThreadPoolExecutor)
+    num_validated = 0
+    with executor_type(max_workers=parsed_args.num_workers) as executor:
+        for chunk_samples, chunk_invalid_samples in zip(sample_chunks, executor.map(
+                functools.partial(
+                    sample_validation.validate_samples, tile_shape=tile_shape,
+                    scaled_mask_shape=scaled_mask_shape, full_decode=parsed_args.full_decode),
+                sample_chunks)):
+            for sample_id, errors in chunk_invalid_samples:
+                invalid_samples.setdefault(sample_id, []).extend(errors)
+                for error in errors:
+                    logging.error('%s: %s', sample_id, error)
+            num_validated += len(chunk_samples)
+            if num_validated % 100000 < len(chunk_samples):
+                logging.info('%d samples validated.', num_validated)
 
-    for globPath in glob.iglob(os.path.join(root_dataset_dir, '**/**'), recursive=True):
-        checked_path = pathlib.Path(globPath)
-        if checked_path.is_file():
-            aug_sample_desc, aug_sample_file_desc = AngledResizedSrcInTargetDesc.parse_sample_file_path(checked_path)
-            if aug_sample_desc and aug_sample_desc.sample_id not in aug_samples:
-                aug_samples[aug_sample_desc.sample_id] = aug_sample_desc
-            if aug_sample_desc and aug_sample_desc not in aug_samples:
-                aug_samples[aug_sample_desc.sample_id].add_file_desc(aug_sample_file_desc)
-
-    # TODO (odruzh): validate samples
-    for sample_key, sample_desc in aug_samples.items():
-        if set(sample_desc.get_all_file_types()) != set(AngledResizedSrcInTargetDesc.ALL_RECORD_FILES):
-            logging.error("%s has missing sample files.", sample_key)
-
-    logging.info("%d total samples.", len(aug_samples))
+    logging.info('%d total samples, %d invalid, validated in %.1fs.',
+                 len(aug_samples), len(invalid_samples), time.perf_counter() - start_time)
+    if parsed_args.report_json_path:
+        with open(parsed_args.report_json_path, 'w') as report_file:
+            json.dump({
+                'dataset_dir': str(root_dataset_dir.resolve()),
+                'num_samples': len(aug_samples),
+                'invalid_samples': dict(sorted(invalid_samples.items())),
+            }, report_file, indent=2)
+    return os.EX_DATAERR if invalid_samples else os.EX_OK
 
 
 if __name__ == '__main__':
@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+
+# Integrity checks of generated sample files reading only their headers.
+
+from src.img_processing.io import mask_io
+
+from src.machine_learning.datasets.augmentation.records.angle_and_size_augmentation import AngledResizedSrcInTargetDesc
+from src.machine_learning.datasets.augmentation.records.angle_and_size_augmentation import MultiObjectSrcInTargetDesc
+
+import math
+import os
+
+import numpy as np
+import PIL.Image
+
+
+TILE_FILE_TYPES = (
+    AngledResizedSrcInTargetDesc.AUGMENTED_TILE, AngledResizedSrcInTargetDesc.TARGET_TILE,
+    AngledResizedSrcInTargetDesc.AUGMENTED_SRC, AngledResizedSrcInTargetDesc.TARGET_MASK)
+SCALED_MASK_FILE_TYPES = (
+    AngledResizedSrcInTargetDesc.TARGET_SCALED_MASK,
+    AngledResizedSrcInTargetDesc.TARGET_SCALED_MASK_OF_MASK)
+MASK_FILE_TYPES = (AngledResizedSrcInTargetDesc.TARGET_MASK,) + SCALED_MASK_FILE_TYPES
+
+
+class SampleFileError(Exception):
+    """Sample file is corrupt, truncated or of unexpected shape."""
+
+
+def read_npy_header_shape(file_path):
+    """Reads array shape from *.npy header and checks the file holds all the array bytes."""
+    with open(file_path, 'rb') as npy_file:
+        try:
+            version = np.lib.format.read_magic(npy_file)
+            if version == (1, 0):
+                shape, _, dtype = np.lib.format.read_array_header_1_0(npy_file)
+            else:
+                shape, _, dtype = np.lib.format.read_array_header_2_0(npy_file)
+        except ValueError as error:
+            raise SampleFileError(f'{file_path} header is malformed: {error}')
+        expected_file_size = npy_file.tell() + math.prod(shape) * dtype.itemsize
+        file_size = os.fstat(npy_file.fileno()).st_size
+    if file_size != expected_file_size:
+        raise SampleFileError(f'{file_path} holds {file_size} of {expected_file_size} bytes.')
+    return shape
+
+
+def read_image_header_shape(file_path, full_decode=False):
+    """Reads image {height, width, channels} checking the file integrity.
+
+    Args:
+      file_path: PNG (or other PIL image), *.npy or *.bmask file path.
+      full_decode: Decode pixels instead of verifying chunk checksums of the file.
+
+    Returns:
+      Tuple of height, width and number of channels.
+
+    Raises:
+      SampleFileError: The file is corrupt or truncated.
+    """
+    if mask_io.get_mask_format(file_path) == mask_io.BMASK_FORMAT:
+        try:
+            shape = mask_io.read_bmask_shape(file_path)
+            if full_decode:
+                mask_io.read_mask(file_path)
+        except mask_io.MaskFileError as error:
+            raise SampleFileError(str(error))
+        return shape + (1,)
+
+    if str(file_path).endswith('.npy'):
+        shape = read_npy_header_shape(file_path)
+        if full_decode:
+            np.load(file_path, mmap_mode='r').max(initial=0)
+        return (shape[0], shape[1], shape[2] if len(shape) > 2 else 1) if len(shape) >= 2 else shape
+
+    try:
+        with PIL.Image.open(file_path) as img:
+            shape = (img.height, img.width, len(img.getbands()))
+            if full_decode:
+                img.load()
+            else:
+                img.verify()
+    except (OSError, SyntaxError, ValueError) as error:
+        raise SampleFileError(f'{file_path} is malformed: {error}')
+    return shape
+
+
+def validate_objects_record(file_path, tile_shape=None):
+    """Checks the objects record of a multi-object sample lists objects within the tile.
+
+    Returns:
+      List of errors.
+    """
+    try:
+        objects_record = MultiObjectSrcInTargetDesc.load_objects_record(file_path)
+        object_boxes = [object_record['box'] for object_record in objects_record['objects']]
+        if any(len(object_box) != 4 for object_box in object_boxes):
+            raise ValueError('object box is not top, left, bottom and right')
+    except (ValueError, KeyError, TypeError) as error:
+        return [f'{file_path} is malformed: {error}']
+    if not object_boxes:
+        return [f'{file_path} lists no objects.']
+    errors = []
+    for top, left, bottom, right in object_boxes:
+        if not (0 <= top < bottom and 0 <= left < right and
+                (not tile_shape or (bottom <= tile_shape[0] and right <= tile_shape[1]))):
+            errors.append(f'{file_path} object box {top}, {left}, {bottom}, {right} is outside the tile.')
+    return errors
+
+
+def validate_sample(sample_files, tile_shape=None, scaled_mask_shape=None, full_decode=False):
+    """Validates files of one sample.
+
+    Args:
+      sample_files: Dictionary of record file type suffixes and file paths.
+      tile_shape: Expected tile {height, width} (only the same in all tile files, if None).
+      scaled_mask_shape: Expected scaled mask {height, width} (only the same in both masks, if None).
+      full_decode: Decode pixels instead of verifying chunk checksums of the files.
+
+    Returns:
+      List of errors.
+    """
+    errors, shapes = [], {}
+    for file_suffix, file_path in sample_files.items():
+        if file_suffix == MultiObjectSrcInTargetDesc.OBJECTS.suffix:
+            try:
+                errors.extend(validate_objects_record(file_path, tile_shape))
+            except OSError as error:
+                errors.append(str(error))
+            continue
+        try:
+            shapes[file_suffix] = read_image_header_shape(file_path, full_decode)
+        except (OSError, SampleFileError) as error:
+            errors.append(str(error))
+
+    mask_suffixes = {file_type.suffix for file_type in MASK_FILE_TYPES}
+    for file_types, expected_shape in (
+            (TILE_FILE_TYPES, tile_shape), (SCALED_MASK_FILE_TYPES, scaled_mask_shape)):
+        for file_type in file_types:
+            shape = shapes.get(file_type.suffix)
+            if not shape:
+                continue
+            if len(shape) != 3:
+                errors.append(f'{sample_files[file_type.suffix]} is not an image of {shape} shape.')
+                continue
+            expected_shape = expected_shape or shape[:2]
+            if tuple(shape[:2]) != tuple(expected_shape):
+                errors.append('{} is {}x{} instead of {}x{}.'.format(
+                    sample_files[file_type.suffix], shape[1], shape[0],
+                    expected_shape[1], expected_shape[0]))
+            if file_type.suffix in mask_suffixes and shape[2] != 1:
+                errors.append(f'{sample_files[file_type.suffix]} mask has {shape[2]} channels.')
+    return errors
+
+
+def validate_samples(samples, tile_shape=None, scaled_mask_shape=None, full_decode=False):
+    """Validates chunk of samples (unit of work of pool workers).
+
+    Args:
+      samples: List of sample ids and dictionaries of their file type suffixes and paths.
+      tile_shape: Expected tile {height, width}.
+      scaled_mask_shape: Expected scaled mask {height, width}.
+      full_decode: Decode pixels instead of verifying chunk checksums of the files.
+
+    Returns:
+      List of sample ids and their errors (only invalid samples).
+    """
+    invalid_samples = []
+    for sample_id, sample_files in samples:
+        errors = validate_sample(sample_files, tile_shape, scaled_mask_shape, full_decode)
+        if errors:
+            invalid_samples.append((sample_id, errors))
+    return invalid_samples
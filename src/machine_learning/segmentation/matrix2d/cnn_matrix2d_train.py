@@ -1,115 +1,135 @@
-import os
-
-from PIL import Image
-
-import torch
-from torchvision import models, transforms
-
-
-# Custom Dataset for loading images and masks
-class SegmentationDataset(torch.utils.data.Dataset):
-    def __init__(self, image_dir, mask_dir, transform=None, mask_transform=None):
-        self.image_dir = image_dir
-        self.mask_dir = mask_dir
-        self.transform = transform
-        self.mask_transform = mask_transform
-        self.images = os.listdir(image_dir)
-
-    def __len__(self):
-        return len(self.images)
-
-    def __getitem__(self, idx):
-        img_path = os.path.join(self.image_dir, self.images[idx])
-        mask_path = os.path.join(self.mask_dir, self.images[idx])
-        image = Image.open(img_path).convert("RGB")
-        mask = Image.open(mask_path).convert("L")
-        if self.transform:
-            image = self.transform(image)
-        if self.mask_transform:
-            mask = self.mask_transform(mask)
-        return image, mask
-
-# Load a pre-trained ResNet101 model
-resnet = models.resnet101(pretrained=True)
-
-# Modify the network for semantic segmentation
-class SegNet(torch.nn.Module):
-    def __init__(self, backbone):
-        super(SegNet, self).__init__()
-        self.backbone = torch.nn.Sequential(*list(backbone.children())[:-2])
-        self.conv1x1 = torch.nn.Conv2d(2048, 21, kernel_size=1)  # Adjust number of classes if needed
-        self.upsample = torch.nn.Upsample(size=(32, 32), mode='bilinear', align_corners=True)
-
-    def forward(self, x):
-        x = self.backbone(x)
-        x = self.conv1x1(x)
-        x = self.upsample(x)
-        return x
-
-# Initialize the model, criterion, and optimizer
-model = SegNet(resnet).cuda()
-criterion = torch.nn.CrossEntropyLoss()
-optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
-
-# Define data transforms and load datasets
-transform = transforms.Compose([
-    transforms.Resize((128, 128)),
-    transforms.ToTensor()
-])
-
-mask_transform = transforms.Compose([
-    transforms.Resize((32, 32)),
-    transforms.ToTensor()
-])
-
-train_data = SegmentationDataset(image_dir='path/to/train_images', mask_dir='path/to/train_masks', transform=transform, mask_transform=mask_transform)
-train_loader = torch.utils.data.DataLoader(train_data, batch_size=8, shuffle=True)
-
-val_data = SegmentationDataset(image_dir='path/to/val_images', mask_dir='path/to/val_masks', transform=transform, mask_transform=mask_transform)
-val_loader = torch.utils.data.DataLoader(val_data, batch_size=8, shuffle=False)
-
-# Training loop
-def train(model, loader, criterion, optimizer, device):
-    model.train()
-    running_loss = 0.0
-    for images, masks in loader:
-        images, masks = images.to(device), masks.to(device)
-        optimizer.zero_grad()
-        outputs = model(images)
-        masks = masks.squeeze(1)  # Ensure masks have the right shape
-        loss = criterion(outputs, masks.long())
-        loss.backward()
-        optimizer.step()
-        running_loss += loss.item() * images.size(0)
-    epoch_loss = running_loss / len(loader.dataset)
-    return epoch_loss
-
-# Evaluation loop
-def evaluate(model, loader, criterion, device):
-    model.eval()
-    running_loss = 0.0
-    correct = 0
-    total = 0
-    with torch.no_grad():
-        for images, masks in loader:
-            images, masks = images.to(device), masks.to(device)
-            outputs = model(images)
-            masks = masks.squeeze(1)  # Ensure masks have the right shape
-            loss = criterion(outputs, masks.long())
-            running_loss += loss.item() * images.size(0)
-            _, predicted = torch.max(outputs, 1)
-            total += masks.nelement()
-            correct += (predicted == masks).sum().item()
-    epoch_loss = running_loss / len(loader.dataset)
-    accuracy = 100 * correct / total
-    return epoch_loss, accuracy
-
-device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-
-num_epochs = 10
-for epoch in range(num_epochs):
-    train_loss = train(model, train_loader, criterion, optimizer, device)
-    val_loss, val_accuracy = evaluate(model, val_loader, criterion, device)
-    print(f'Epoch {epoch+1}/{num_epochs}, Train Loss: {train_loss:.4f}, Val Loss: {val_loss:.4f}, Val Accuracy: {val_accuracy:.2f}%')
-
-print("Training completed")
+#!/usr/bin/python3
+
+# The script to train SegNet on images and their segmentation masks.
+#
+# Usage:
+#   python cnn_matrix2d_train.py \
+#     --train_images <dir> --train_masks <dir> --train_cache <dir> \
+#     --val_images <dir> --val_masks <dir> --val_cache <dir> \
+#     --device auto --intra_op_threads 16 --channels_last --bf16 \
+#     --batch_size 8 --grad_accum_steps 4 --output_model segnet.pt
+
+import os, sys
+SCRIPT_DIRS = os.path.dirname(os.path.abspath(__file__)).split(os.sep)
+sys.path.append(os.path.join(os.sep, *SCRIPT_DIRS[:SCRIPT_DIRS.index('src')]))
+
+import argparse
+import logging
+
+
+DEVICES = ('auto', 'cpu', 'cuda')
+
+
+def parse_args(argv):
+    # Parse input arguments.
+    parser = argparse.ArgumentParser(description='Train SegNet')
+    parser.add_argument('--train_images', dest='train_image_dir',
+                        help='Folder with training images.', required=True)
+    parser.add_argument('--train_masks', dest='train_mask_dir',
+                        help='Folder with training masks of the same file names.', required=True)
+    parser.add_argument('--train_cache', dest='train_cache_dir',
+                        help='Folder of decoded training samples (e.g. in /dev/shm).', required=True)
+    parser.add_argument('--val_images', dest='val_image_dir',
+                        help='Folder with validation images.', required=True)
+    parser.add_argument('--val_masks', dest='val_mask_dir',
+                        help='Folder with validation masks of the same file names.', required=True)
+    parser.add_argument('--val_cache', dest='val_cache_dir',
+                        help='Folder of decoded validation samples.', required=True)
+
+    parser.add_argument('--epochs', dest='num_epochs',
+                        help='Number of training epochs.', required=False, type=int, default=10)
+    parser.add_argument('--batch_size', dest='batch_size',
+                        help='Number of samples in a loaded batch.', required=False, type=int, default=8)
+    parser.add_argument('--grad_accum_steps', dest='grad_accum_steps',
+                        help='Number of batches accumulating gradients of one optimizer step.',
+                        required=False, type=int, default=1)
+    parser.add_argument('--lr', dest='learning_rate',
+                        help='Learning rate.', required=False, type=float, default=0.001)
+    parser.add_argument('--no_pretrained', dest='pretrained', action='store_false',
+                        help='Start from random backbone weights instead of ImageNet ones.')
+
+    parser.add_argument('--device', dest='device', choices=DEVICES,
+                        help='Training device (CUDA, if available, for auto).',
+                        required=False, default='auto')
+    parser.add_argument('--intra_op_threads', dest='num_intra_op_threads',
+                        help='Number of threads within CPU operators (torch default, if absent).',
+                        required=False, type=int, default=None)
+    parser.add_argument('--inter_op_threads', dest='num_inter_op_threads',
+                        help='Number of threads running CPU operators in parallel.',
+                        required=False, type=int, default=None)
+    parser.add_argument('--channels_last', dest='channels_last', action='store_true',
+                        help='Keep model weights and input images in channels last layout.')
+    parser.add_argument('--bf16', dest='bf16', action='store_true',
+                        help='Run forward passes in bfloat16 autocast.')
+    parser.add_argument('--loader_workers', dest='num_loader_workers',
+                        help='Number of data loader processes.', required=False, type=int, default=4)
+
+    parser.add_argument('--output_model', dest='output_model_path',
+                        help='Path of saved model state dict.', required=False, default=None)
+
+    return parser.parse_args(argv[1:])
+
+
+def main(argv):
+    parsed_args = parse_args(argv)
+    if parsed_args.grad_accum_steps < 1:
+        logging.error('Incorrect number of gradient accumulation steps.')
+        return os.EX_USAGE
+    from src.machine_learning.segmentation.matrix2d import segnet
+    from src.machine_learning.segmentation.matrix2d import segnet_training
+    from src.machine_learning.segmentation.matrix2d.segmentation_datasets import PreDecodedSegmentationDataset
+    import torch
+
+    device = segnet_training.select_device(parsed_args.device)
+    if parsed_args.num_intra_op_threads:
+        torch.set_num_threads(parsed_args.num_intra_op_threads)
+    if parsed_args.num_inter_op_threads:
+        torch.set_num_interop_threads(parsed_args.num_inter_op_threads)
+    logging.info('Training on %s with %d intra-op and %d inter-op threads.',
+                 device, torch.get_num_threads(), torch.get_num_interop_threads())
+
+    # Initialize the model, criterion, and optimizer
+    model = segnet.create_segnet(pretrained=parsed_args.pretrained).to(device)
+    if parsed_args.channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    criterion = torch.nn.CrossEntropyLoss()
+    optimizer = torch.optim.Adam(model.parameters(), lr=parsed_args.learning_rate)
+
+    # Decode and resize datasets once into memory-mapped caches shared by loader workers
+    loader_options = {
+        'batch_size': parsed_args.batch_size,
+        'num_workers': parsed_args.num_loader_workers,
+        'persistent_workers': parsed_args.num_loader_workers > 0,
+        'pin_memory': device.type == 'cuda',
+    }
+    train_data = PreDecodedSegmentationDataset.from_dirs(
+        image_dir=parsed_args.train_image_dir, mask_dir=parsed_args.train_mask_dir,
+        cache_dir=parsed_args.train_cache_dir)
+    train_loader = torch.utils.data.DataLoader(train_data, shuffle=True, **loader_options)
+    val_data = PreDecodedSegmentationDataset.from_dirs(
+        image_dir=parsed_args.val_image_dir, mask_dir=parsed_args.val_mask_dir,
+        cache_dir=parsed_args.val_cache_dir)
+    val_loader = torch.utils.data.DataLoader(val_data, shuffle=False, **loader_options)
+
+    num_epochs = parsed_args.num_epochs
+    for epoch in range(num_epochs):
+        train_loss, samples_per_second, data_stall_time = segnet_training.train(
+            model, train_loader, criterion, optimizer, device,
+            channels_last=parsed_args.channels_last, bf16=parsed_args.bf16,
+            grad_accum_steps=parsed_args.grad_accum_steps)
+        val_loss, val_accuracy = segnet_training.evaluate(
+            model, val_loader, criterion, device,
+            channels_last=parsed_args.channels_last, bf16=parsed_args.bf16)
+        print(f'Epoch {epoch+1}/{num_epochs}, Train Loss: {train_loss:.4f}, '
+              f'Val Loss: {val_loss:.4f}, Val Accuracy: {val_accuracy:.2f}%, '
+              f'Samples/s: {samples_per_second:.1f}, Data Stall: {data_stall_time:.1f}s')
+
+    if parsed_args.output_model_path:
+        torch.save(model.state_dict(), parsed_args.output_model_path)
+    print("Training completed")
+    return os.EX_OK
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    sys.exit(main(sys.argv))
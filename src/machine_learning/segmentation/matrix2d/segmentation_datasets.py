@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+
+# Datasets of images and segmentation masks.
+
+from src.img_processing.io import mask_io
+
+import concurrent.futures
+import json
+import os
+import pathlib
+
+import numpy as np
+from PIL import Image
+
+import torch
+
+
+IMAGE_SIZE = (128, 128)
+MASK_SIZE = (32, 32)
+
+
+# Custom Dataset for loading images and masks
+class SegmentationDataset(torch.utils.data.Dataset):
+    def __init__(self, image_dir, mask_dir, transform=None, mask_transform=None):
+        self.image_dir = image_dir
+        self.mask_dir = mask_dir
+        self.transform = transform
+        self.mask_transform = mask_transform
+        self.images = os.listdir(image_dir)
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, idx):
+        img_path = os.path.join(self.image_dir, self.images[idx])
+        mask_path = os.path.join(self.mask_dir, self.images[idx])
+        image = Image.open(img_path).convert("RGB")
+        mask = open_image(mask_path).convert("L")
+        if self.transform:
+            image = self.transform(image)
+        if self.mask_transform:
+            mask = self.mask_transform(mask)
+        return image, mask
+
+
+def open_image(img_path):
+    """Opens PIL image or bit-packed mask (as 1-bit image)."""
+    if mask_io.get_mask_format(img_path) == mask_io.BMASK_FORMAT:
+        return Image.fromarray(mask_io.read_mask(img_path))
+    return Image.open(img_path)
+
+
+def decode_resized(img_path, size, mode):
+    """Decodes image converted to the mode and resized as transforms.Resize does.
+
+    Args:
+      img_path: Image file path.
+      size: Resized {height, width}.
+      mode: PIL mode ('RGB' or 'L').
+
+    Returns:
+      Resized uint8 array.
+    """
+    with open_image(img_path) as img:
+        return np.asarray(img.convert(mode).resize(
+            (size[1], size[0]), resample=Image.BILINEAR))
+
+
+class PreDecodedSegmentationDataset(torch.utils.data.Dataset):
+    """Images and masks decoded and resized once into memory-mapped uint8 arrays.
+
+    All DataLoader workers map the same cache files, so they share the pages
+    (placing the cache in /dev/shm keeps it in shared memory).
+    """
+
+    IMAGES_FILE_NAME = 'images.npy'
+    MASKS_FILE_NAME = 'masks.npy'
+    META_FILE_NAME = 'meta.json'
+
+    def __init__(self, cache_dir):
+        self.cache_dir = pathlib.Path(cache_dir)
+        with open(self.cache_dir / self.META_FILE_NAME) as meta_file:
+            self.meta = json.load(meta_file)
+        self.images = None
+        self.masks = None
+
+    def __len__(self):
+        return len(self.meta['names'])
+
+    def __getstate__(self):
+        # Workers map the cache files themselves.
+        state = dict(self.__dict__)
+        state['images'], state['masks'] = None, None
+        return state
+
+    def _map_cache(self):
+        self.images = np.load(self.cache_dir / self.IMAGES_FILE_NAME, mmap_mode='r')
+        self.masks = np.load(self.cache_dir / self.MASKS_FILE_NAME, mmap_mode='r')
+
+    def __getitem__(self, idx):
+        if self.images is None:
+            self._map_cache()
+        image = torch.from_numpy(np.array(self.images[idx])).permute(2, 0, 1).float().div_(255)
+        mask = torch.from_numpy(np.array(self.masks[idx])).unsqueeze(0).float().div_(255)
+        return image, mask
+
+    @classmethod
+    def from_dirs(cls, image_dir, mask_dir, cache_dir,
+                  image_size=IMAGE_SIZE, mask_size=MASK_SIZE, num_threads=8):
+        """Creates dataset decoding images into the cache, if it is absent or stale.
+
+        Args:
+          image_dir: Folder of images.
+          mask_dir: Folder of masks with the same file names.
+          cache_dir: Folder of decoded arrays.
+          image_size: Resized image {height, width}.
+          mask_size: Resized mask {height, width}.
+          num_threads: Number of decoding threads.
+
+        Returns:
+          PreDecodedSegmentationDataset.
+        """
+        cache_dir = pathlib.Path(cache_dir)
+        names = sorted(os.listdir(image_dir))
+        meta = {
+            'image_dir': str(pathlib.Path(image_dir).resolve()),
+            'mask_dir': str(pathlib.Path(mask_dir).resolve()),
+            'image_size': list(image_size), 'mask_size': list(mask_size),
+            'names': names,
+            # Samples regenerated in place (even of the same size) make the cache stale.
+            'file_stats': [
+                [file_stat.st_size, file_stat.st_mtime_ns]
+                for name in names
+                for file_stat in (os.stat(os.path.join(image_dir, name)),
+                                  os.stat(os.path.join(mask_dir, name)))],
+        }
+        try:
+            with open(cache_dir / cls.META_FILE_NAME) as meta_file:
+                if json.load(meta_file) == meta:
+                    return cls(cache_dir)
+        except (OSError, ValueError):
+            pass
+
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        (cache_dir / cls.META_FILE_NAME).unlink(missing_ok=True)
+        images = np.lib.format.open_memmap(
+            cache_dir / cls.IMAGES_FILE_NAME, mode='w+', dtype=np.uint8,
+            shape=(len(names), image_size[0], image_size[1], 3))
+        masks = np.lib.format.open_memmap(
+            cache_dir / cls.MASKS_FILE_NAME, mode='w+', dtype=np.uint8,
+            shape=(len(names), mask_size[0], mask_size[1]))
+
+        def decode_sample(idx):
+            images[idx] = decode_resized(os.path.join(image_dir, names[idx]), image_size, 'RGB')
+            masks[idx] = decode_resized(os.path.join(mask_dir, names[idx]), mask_size, 'L')
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+            list(executor.map(decode_sample, range(len(names))))
+        images.flush()
+        masks.flush()
+        del images, masks
+
+        # Meta-data is written last to mark the cache as complete.
+        with open(cache_dir / cls.META_FILE_NAME, 'w') as meta_file:
+            json.dump(meta, meta_file)
+        return cls(cache_dir)
@@ -0,0 +1,30 @@
+#!/usr/bin/python3
+
+# ResNet101 backbone network predicting low-resolution segmentation masks.
+
+import torch
+from torchvision import models
+
+
+NUM_CLASSES = 21
+
+
+# Modify the network for semantic segmentation
+class SegNet(torch.nn.Module):
+    def __init__(self, backbone, num_classes=NUM_CLASSES, mask_size=(32, 32)):
+        super(SegNet, self).__init__()
+        self.backbone = torch.nn.Sequential(*list(backbone.children())[:-2])
+        self.conv1x1 = torch.nn.Conv2d(2048, num_classes, kernel_size=1)  # Adjust number of classes if needed
+        self.upsample = torch.nn.Upsample(size=mask_size, mode='bilinear', align_corners=True)
+
+    def forward(self, x):
+        x = self.backbone(x)
+        x = self.conv1x1(x)
+        x = self.upsample(x)
+        return x
+
+
+def create_segnet(pretrained=True, num_classes=NUM_CLASSES, mask_size=(32, 32)):
+    """Creates SegNet over ResNet101 backbone (ImageNet weights, if pretrained)."""
+    resnet = models.resnet101(pretrained=pretrained)
+    return SegNet(resnet, num_classes=num_classes, mask_size=mask_size)
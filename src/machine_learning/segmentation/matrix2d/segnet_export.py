@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+
+# TorchScript/ONNX export and int8 quantization of SegNet for CPU inference.
+
+from src.machine_learning.segmentation.matrix2d.segmentation_datasets import IMAGE_SIZE
+from src.machine_learning.segmentation.matrix2d.segnet_export_config import STATIC_QUANTIZATION
+
+import copy
+import itertools
+
+import torch
+
+
+def get_example_input(batch_size=1, image_size=IMAGE_SIZE):
+    return torch.rand(batch_size, 3, image_size[0], image_size[1])
+
+
+def export_torchscript(model, file_path, example_input=None):
+    """Traces the model in eval mode and saves it as TorchScript."""
+    example_input = example_input if example_input is not None else get_example_input()
+    with torch.no_grad():
+        traced_model = torch.jit.trace(model.eval(), example_input)
+        traced_model = torch.jit.freeze(traced_model)
+    torch.jit.save(traced_model, str(file_path))
+    return traced_model
+
+
+def export_onnx(model, file_path, example_input=None, opset_version=17):
+    """Exports the model in eval mode to ONNX with dynamic batch dimension."""
+    example_input = example_input if example_input is not None else get_example_input()
+    with torch.no_grad():
+        torch.onnx.export(
+            model.eval(), example_input, str(file_path),
+            input_names=['images'], output_names=['logits'],
+            dynamic_axes={'images': {0: 'batch'}, 'logits': {0: 'batch'}},
+            opset_version=opset_version)
+
+
+def quantize_static(model, calibration_loader, num_calibration_batches=32, backend='x86'):
+    """Quantizes weights and activations to int8 with FX graph mode.
+
+    Args:
+      model: Float model.
+      calibration_loader: Loader of (images, masks) batches observed to get activation ranges.
+      num_calibration_batches: Max number of observed batches.
+      backend: Quantized engine ('x86', 'fbgemm' or 'qnnpack').
+
+    Returns:
+      Quantized model taking and returning float tensors.
+    """
+    from torch.ao.quantization import quantize_fx
+
+    torch.backends.quantized.engine = backend
+    qconfig_mapping = torch.ao.quantization.get_default_qconfig_mapping(backend)
+    example_inputs = (get_example_input(),)
+    prepared_model = quantize_fx.prepare_fx(
+        copy.deepcopy(model).eval(), qconfig_mapping, example_inputs)
+    with torch.no_grad():
+        for images, _ in itertools.islice(calibration_loader, num_calibration_batches):
+            prepared_model(images)
+    return quantize_fx.convert_fx(prepared_model)
+
+
+def quantize(model, quantization_mode, calibration_loader=None, num_calibration_batches=32):
+    """Quantizes the model in the mode (static one requires calibration loader)."""
+    if quantization_mode == STATIC_QUANTIZATION:
+        if calibration_loader is None:
+            raise ValueError('Static quantization requires calibration samples.')
+        return quantize_static(model, calibration_loader, num_calibration_batches)
+    raise ValueError(f'Unknown quantization mode {quantization_mode}.')
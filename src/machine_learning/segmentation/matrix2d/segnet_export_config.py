@@ -0,0 +1,12 @@
+#!/usr/bin/python3
+
+# SegNet export formats and quantization modes (no torch imports).
+
+
+TORCHSCRIPT_FORMAT = 'torchscript'
+ONNX_FORMAT = 'onnx'
+EXPORT_FORMATS = (TORCHSCRIPT_FORMAT, ONNX_FORMAT)
+
+# Dynamic quantization covers only linear layers and SegNet has none.
+STATIC_QUANTIZATION = 'static'
+QUANTIZATION_MODES = (STATIC_QUANTIZATION,)
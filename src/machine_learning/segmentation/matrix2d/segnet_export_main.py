@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+
+# The script to export trained SegNet to TorchScript/ONNX with optional int8 quantization.
+#
+# Usage:
+#   python segnet_export_main.py \
+#     --model segnet.pt --output_dir <export dir> --formats torchscript onnx \
+#     --quantize static --calibration_images <dir> --calibration_masks <dir> \
+#     --calibration_cache <dir>
+#
+# Exported files are segnet.pt (TorchScript), segnet.onnx and segnet.int8.pt
+# (quantized TorchScript).
+
+import os, sys
+SCRIPT_DIRS = os.path.dirname(os.path.abspath(__file__)).split(os.sep)
+sys.path.append(os.path.join(os.sep, *SCRIPT_DIRS[:SCRIPT_DIRS.index('src')]))
+
+from src.machine_learning.segmentation.matrix2d import segnet_export_config
+
+import argparse
+import logging
+import pathlib
+
+
+TORCHSCRIPT_FILE_NAME = 'segnet.pt'
+ONNX_FILE_NAME = 'segnet.onnx'
+INT8_TORCHSCRIPT_FILE_NAME = 'segnet.int8.pt'
+
+
+def parse_args(argv):
+    # Parse input arguments.
+    parser = argparse.ArgumentParser(description='Export SegNet')
+    parser.add_argument('--model', dest='model_path',
+                        help='SegNet state dict saved by cnn_matrix2d_train.', required=True)
+    parser.add_argument('-o', '--output_dir', dest='output_dir_path',
+                        help='Output folder.', required=True)
+    parser.add_argument('--formats', dest='export_formats', nargs='*',
+                        choices=segnet_export_config.EXPORT_FORMATS,
+                        default=list(segnet_export_config.EXPORT_FORMATS),
+                        help='Export formats of the float model.')
+    parser.add_argument('--onnx_opset', dest='onnx_opset_version',
+                        help='ONNX opset version.', required=False, type=int, default=17)
+
+    parser.add_argument('--quantize', dest='quantization_mode',
+                        choices=segnet_export_config.QUANTIZATION_MODES, default=None,
+                        help='Int8 quantization mode (no quantization, if absent).')
+    parser.add_argument('--calibration_images', dest='calibration_image_dir',
+                        help='Folder with generated calibration samples.', required=False)
+    parser.add_argument('--calibration_masks', dest='calibration_mask_dir',
+                        help='Folder with masks of calibration samples.', required=False)
+    parser.add_argument('--calibration_cache', dest='calibration_cache_dir',
+                        help='Folder of decoded calibration samples.', required=False)
+    parser.add_argument('--calibration_batches', dest='num_calibration_batches',
+                        help='Number of observed calibration batches.',
+                        required=False, type=int, default=32)
+    parser.add_argument('--batch_size', dest='batch_size',
+                        help='Number of samples in a calibration batch.', required=False, type=int, default=8)
+    return parser.parse_args(argv[1:])
+
+
+def main(argv):
+    parsed_args = parse_args(argv)
+    output_dir_path = pathlib.Path(parsed_args.output_dir_path)
+    calibration_dirs = (
+        parsed_args.calibration_image_dir, parsed_args.calibration_mask_dir,
+        parsed_args.calibration_cache_dir)
+    if parsed_args.quantization_mode == segnet_export_config.STATIC_QUANTIZATION and not all(calibration_dirs):
+        logging.error('Static quantization requires calibration images, masks and cache.')
+        return os.EX_USAGE
+    from src.machine_learning.segmentation.matrix2d import segnet_export
+    from src.machine_learning.segmentation.matrix2d import segnet_tiled_inference
+    from src.machine_learning.segmentation.matrix2d.segmentation_datasets import PreDecodedSegmentationDataset
+    import torch
+
+    model = segnet_tiled_inference.load_segnet(parsed_args.model_path)
+    output_dir_path.mkdir(parents=True, exist_ok=True)
+    if segnet_export_config.TORCHSCRIPT_FORMAT in parsed_args.export_formats:
+        segnet_export.export_torchscript(model, output_dir_path / TORCHSCRIPT_FILE_NAME)
+        logging.info('TorchScript model saved to %s.', output_dir_path / TORCHSCRIPT_FILE_NAME)
+    if segnet_export_config.ONNX_FORMAT in parsed_args.export_formats:
+        segnet_export.export_onnx(
+            model, output_dir_path / ONNX_FILE_NAME, opset_version=parsed_args.onnx_opset_version)
+        logging.info('ONNX model saved to %s.', output_dir_path / ONNX_FILE_NAME)
+
+    if parsed_args.quantization_mode:
+        calibration_loader = None
+        if all(calibration_dirs):
+            calibration_data = PreDecodedSegmentationDataset.from_dirs(
+                image_dir=parsed_args.calibration_image_dir,
+                mask_dir=parsed_args.calibration_mask_dir,
+                cache_dir=parsed_args.calibration_cache_dir)
+            calibration_loader = torch.utils.data.DataLoader(
+                calibration_data, batch_size=parsed_args.batch_size, shuffle=True)
+        quantized_model = segnet_export.quantize(
+            model, parsed_args.quantization_mode, calibration_loader,
+            parsed_args.num_calibration_batches)
+        segnet_export.export_torchscript(quantized_model, output_dir_path / INT8_TORCHSCRIPT_FILE_NAME)
+        logging.info('Int8 TorchScript model saved to %s.', output_dir_path / INT8_TORCHSCRIPT_FILE_NAME)
+    return os.EX_OK
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    sys.exit(main(sys.argv))
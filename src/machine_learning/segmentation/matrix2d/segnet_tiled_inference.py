@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+
+# Sliding-window SegNet inference over images larger than the model tiles.
+
+from src.machine_learning.segmentation.matrix2d import segnet
+from src.machine_learning.segmentation.matrix2d.segmentation_datasets import IMAGE_SIZE
+
+import contextlib
+
+import numpy as np
+import torch
+
+
+def get_tile_starts(length, tile_size, stride):
+    """Gets tile start positions covering the length, the last tile ends at the length end."""
+    if length <= tile_size:
+        return [0]
+    tile_starts = list(range(0, length - tile_size + 1, stride))
+    if tile_starts[-1] != length - tile_size:
+        tile_starts.append(length - tile_size)
+    return tile_starts
+
+
+def load_segnet(model_path, device=torch.device('cpu'), channels_last=False):
+    """Loads SegNet state dict saved by cnn_matrix2d_train for inference."""
+    model = segnet.create_segnet(pretrained=False)
+    model.load_state_dict(torch.load(model_path, map_location=device))
+    model = model.to(device).eval()
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    return model
+
+
+class TiledSegmenter:
+    """Predicts class probability map of a large image tile by tile.
+
+    Overlapping tiles are batched through the model, low-resolution mask
+    probabilities are upsampled to the tile size and averaged where tiles
+    overlap. Only one strip of tile rows is held in memory, finished rows
+    are written to the output (e.g. memory-mapped array) as soon as no other
+    tile covers them.
+    """
+
+    def __init__(self, model, tile_shape=IMAGE_SIZE, tile_overlap=32, batch_size=32,
+                 class_idx=1, device=torch.device('cpu'), channels_last=False, bf16=False):
+        """Creates the segmenter.
+
+        Args:
+          model: SegNet in eval mode on the device.
+          tile_shape: Model input tile {height, width}.
+          tile_overlap: Number of pixels shared by neighbouring tiles.
+          batch_size: Number of tiles of one forward pass.
+          class_idx: Index of the predicted class.
+          device: Torch device of the model.
+          channels_last: Feed tiles in channels last layout.
+          bf16: Run forward passes in bfloat16 autocast.
+        """
+        if not 0 <= tile_overlap < min(tile_shape):
+            raise ValueError(f'Tile overlap {tile_overlap} does not fit {tile_shape} tiles.')
+        self.model = model
+        self.tile_shape = tuple(tile_shape)
+        self.tile_strides = (tile_shape[0] - tile_overlap, tile_shape[1] - tile_overlap)
+        self.batch_size = batch_size
+        self.class_idx = class_idx
+        self.device = device
+        self.memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        self.bf16 = bf16
+
+    def predict_tiles(self, tiles):
+        """Predicts class probabilities of uint8 RGB tiles (N x H x W x 3) at tile resolution."""
+        images = torch.from_numpy(tiles).to(self.device).permute(0, 3, 1, 2).float().div_(255)
+        images = images.contiguous(memory_format=self.memory_format)
+        autocast = (torch.autocast(device_type=self.device.type, dtype=torch.bfloat16)
+                    if self.bf16 else contextlib.nullcontext())
+        with torch.inference_mode(), autocast:
+            logits = self.model(images).float()
+        probabilities = torch.softmax(logits, dim=1)[:, self.class_idx:self.class_idx + 1]
+        probabilities = torch.nn.functional.interpolate(
+            probabilities, size=self.tile_shape, mode='bilinear', align_corners=False)
+        return probabilities[:, 0].cpu().numpy()
+
+    def predict(self, rgb_image, output=None):
+        """Predicts class probability of every image pixel.
+
+        Args:
+          rgb_image: H x W x 3 (or 4, alpha is ignored) uint8 array (e.g. memory-mapped one).
+          output: H x W float array to write probabilities to (allocated, if None).
+
+        Returns:
+          Output array.
+        """
+        img_height, img_width = rgb_image.shape[:2]
+        tile_height, tile_width = self.tile_shape
+        if output is None:
+            output = np.empty((img_height, img_width), dtype=np.float32)
+
+        strip_sums = np.zeros((tile_height, img_width), dtype=np.float32)
+        strip_weights = np.zeros((tile_height, img_width), dtype=np.float32)
+        strip_top = 0
+        col_starts = get_tile_starts(img_width, tile_width, self.tile_strides[1])
+        for row_start in get_tile_starts(img_height, tile_height, self.tile_strides[0]):
+            # Rows above the tile row are not covered by any next tile.
+            if row_start > strip_top:
+                finished_rows = row_start - strip_top
+                output[strip_top:row_start] = (
+                    strip_sums[:finished_rows] / strip_weights[:finished_rows])
+                for strip in (strip_sums, strip_weights):
+                    strip[:-finished_rows] = strip[finished_rows:]
+                    strip[-finished_rows:] = 0
+                strip_top = row_start
+
+            tile_rows = np.ascontiguousarray(rgb_image[row_start:row_start + tile_height, :, :3])
+            valid_height = tile_rows.shape[0]
+            for batch_start in range(0, len(col_starts), self.batch_size):
+                batch_col_starts = col_starts[batch_start:batch_start + self.batch_size]
+                tiles = np.zeros((len(batch_col_starts), tile_height, tile_width, 3), dtype=np.uint8)
+                for tile_idx, col_start in enumerate(batch_col_starts):
+                    tile = tile_rows[:, col_start:col_start + tile_width]
+                    tiles[tile_idx, :tile.shape[0], :tile.shape[1]] = tile
+                probabilities = self.predict_tiles(tiles)
+                for tile_idx, col_start in enumerate(batch_col_starts):
+                    valid_width = min(tile_width, img_width - col_start)
+                    strip_sums[:valid_height, col_start:col_start + valid_width] += (
+                        probabilities[tile_idx, :valid_height, :valid_width])
+                    strip_weights[:valid_height, col_start:col_start + valid_width] += 1
+
+        output[strip_top:] = (
+            strip_sums[:img_height - strip_top] / strip_weights[:img_height - strip_top])
+        return output
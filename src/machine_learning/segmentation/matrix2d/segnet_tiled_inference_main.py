@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+
+# The script to predict segmentation probability maps of large images with trained SegNet.
+#
+# Usage:
+#   python segnet_tiled_inference_main.py \
+#     --model segnet.pt --image <image path (*.npy is memory-mapped)> \
+#     --output <probabilities path (*.npy or 8-bit *.png)> \
+#     --tile_overlap 32 --batch_size 32 --intra_op_threads 16
+
+import os, sys
+SCRIPT_DIRS = os.path.dirname(os.path.abspath(__file__)).split(os.sep)
+sys.path.append(os.path.join(os.sep, *SCRIPT_DIRS[:SCRIPT_DIRS.index('src')]))
+
+import argparse
+import logging
+import pathlib
+import time
+
+import numpy as np
+from PIL import Image
+
+
+def parse_args(argv):
+    # Parse input arguments.
+    parser = argparse.ArgumentParser(description='Tiled SegNet Inference')
+    parser.add_argument('--model', dest='model_path',
+                        help='SegNet state dict saved by cnn_matrix2d_train.', required=True)
+    parser.add_argument('--image', dest='image_path',
+                        help='Input image (H x W x 3 uint8 *.npy is memory-mapped).', required=True)
+    parser.add_argument('--output', dest='output_path',
+                        help='Output probabilities (float32 *.npy written by rows or 8-bit *.png).',
+                        required=True)
+    parser.add_argument('--tile_overlap', dest='tile_overlap',
+                        help='Number of pixels shared by neighbouring tiles.',
+                        required=False, type=int, default=32)
+    parser.add_argument('--batch_size', dest='batch_size',
+                        help='Number of tiles of one forward pass.', required=False, type=int, default=32)
+    parser.add_argument('--class_idx', dest='class_idx',
+                        help='Index of the predicted class.', required=False, type=int, default=1)
+    parser.add_argument('--intra_op_threads', dest='num_intra_op_threads',
+                        help='Number of threads within CPU operators (torch default, if absent).',
+                        required=False, type=int, default=None)
+    parser.add_argument('--channels_last', dest='channels_last', action='store_true',
+                        help='Keep model weights and input tiles in channels last layout.')
+    parser.add_argument('--bf16', dest='bf16', action='store_true',
+                        help='Run forward passes in bfloat16 autocast.')
+    return parser.parse_args(argv[1:])
+
+
+def load_rgb_image(image_path):
+    """Loads H x W x 3 uint8 image (memory-mapped, if it is *.npy file)."""
+    if image_path.suffix == '.npy':
+        return np.load(image_path, mmap_mode='r')
+    Image.MAX_IMAGE_PIXELS = None
+    with Image.open(image_path) as img:
+        return np.asarray(img.convert('RGB'))
+
+
+def main(argv):
+    parsed_args = parse_args(argv)
+    image_path = pathlib.Path(parsed_args.image_path)
+    output_path = pathlib.Path(parsed_args.output_path)
+    if not image_path.is_file():
+        logging.error('%s is not a file.', image_path)
+        return os.EX_NOINPUT
+    if output_path.suffix not in ('.npy', '.png'):
+        logging.error('Unsupported output format %s.', output_path)
+        return os.EX_USAGE
+    from src.machine_learning.segmentation.matrix2d import segnet_tiled_inference
+    import torch
+
+    if parsed_args.num_intra_op_threads:
+        torch.set_num_threads(parsed_args.num_intra_op_threads)
+    model = segnet_tiled_inference.load_segnet(
+        parsed_args.model_path, channels_last=parsed_args.channels_last)
+    segmenter = segnet_tiled_inference.TiledSegmenter(
+        model, tile_overlap=parsed_args.tile_overlap, batch_size=parsed_args.batch_size,
+        class_idx=parsed_args.class_idx,
+        channels_last=parsed_args.channels_last, bf16=parsed_args.bf16)
+
+    rgb_image = load_rgb_image(image_path)
+    if rgb_image.ndim != 3 or rgb_image.shape[2] < 3 or rgb_image.dtype != np.uint8:
+        logging.error('%s is not H x W x 3 uint8 image.', image_path)
+        return os.EX_DATAERR
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    start_time = time.perf_counter()
+    if output_path.suffix == '.npy':
+        probabilities = np.lib.format.open_memmap(
+            output_path, mode='w+', dtype=np.float32, shape=rgb_image.shape[:2])
+        segmenter.predict(rgb_image, output=probabilities)
+        probabilities.flush()
+    else:
+        probabilities = segmenter.predict(rgb_image)
+        Image.fromarray(np.rint(probabilities * 255).astype(np.uint8), mode='L').save(output_path)
+    logging.info('%s of %dx%d pixels segmented in %.1fs.', image_path,
+                 rgb_image.shape[1], rgb_image.shape[0], time.perf_counter() - start_time)
+    return os.EX_OK
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    sys.exit(main(sys.argv))
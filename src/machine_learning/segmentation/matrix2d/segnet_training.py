@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+
+# SegNet training and evaluation epochs on a CPU or CUDA device.
+
+import contextlib
+import time
+
+import torch
+
+
+def select_device(device_name):
+    """Gets torch device of the name (CUDA, if available, for 'auto')."""
+    if device_name == 'auto':
+        device_name = 'cuda' if torch.cuda.is_available() else 'cpu'
+    return torch.device(device_name)
+
+
+def autocast(device, bf16):
+    """Gets bfloat16 autocast context of the device or no-op one."""
+    if not bf16:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=device.type, dtype=torch.bfloat16)
+
+
+def _synchronize(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+# Training loop
+def train(model, loader, criterion, optimizer, device,
+          channels_last=False, bf16=False, grad_accum_steps=1):
+    """Trains the model for one epoch.
+
+    Returns:
+      Epoch loss, number of samples per second and seconds spent waiting for batches.
+    """
+    model.train()
+    running_loss = 0.0
+    num_samples = 0
+    data_stall_time = 0.0
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+
+    optimizer.zero_grad()
+    start_time = time.perf_counter()
+    batch_request_time = start_time
+    for batch_idx, (images, masks) in enumerate(loader):
+        data_stall_time += time.perf_counter() - batch_request_time
+        images = images.to(device, non_blocking=True).contiguous(memory_format=memory_format)
+        masks = masks.to(device, non_blocking=True).squeeze(1)  # Ensure masks have the right shape
+        with autocast(device, bf16):
+            outputs = model(images)
+            loss = criterion(outputs.float(), masks.long())
+        (loss / grad_accum_steps).backward()
+        if (batch_idx + 1) % grad_accum_steps == 0 or batch_idx + 1 == len(loader):
+            optimizer.step()
+            optimizer.zero_grad()
+        running_loss += loss.item() * images.size(0)
+        num_samples += images.size(0)
+        batch_request_time = time.perf_counter()
+
+    _synchronize(device)
+    epoch_time = time.perf_counter() - start_time
+    epoch_loss = running_loss / max(1, num_samples)
+    return epoch_loss, num_samples / epoch_time if epoch_time else 0.0, data_stall_time
+
+
+# Evaluation loop
+def evaluate(model, loader, criterion, device, channels_last=False, bf16=False):
+    model.eval()
+    running_loss = 0.0
+    correct = 0
+    total = 0
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    with torch.no_grad():
+        for images, masks in loader:
+            images = images.to(device, non_blocking=True).contiguous(memory_format=memory_format)
+            masks = masks.to(device, non_blocking=True).squeeze(1)  # Ensure masks have the right shape
+            with autocast(device, bf16):
+                outputs = model(images).float()
+            loss = criterion(outputs, masks.long())
+            running_loss += loss.item() * images.size(0)
+            _, predicted = torch.max(outputs, 1)
+            total += masks.nelement()
+            correct += (predicted == masks).sum().item()
+    epoch_loss = running_loss / len(loader.dataset)
+    accuracy = 100 * correct / total
+    return epoch_loss, accuracy
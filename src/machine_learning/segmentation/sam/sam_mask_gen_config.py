@@ -0,0 +1,16 @@
+#!/usr/bin/python3
+
+# SAM multi-mask generation config and backends (no torch or SAM imports).
+
+
+TORCH_BACKEND = 'torch'
+ONNX_BACKEND = 'onnx'
+BACKENDS = (TORCH_BACKEND, ONNX_BACKEND)
+
+
+class SamAutoMaskGeneratorConfig:
+    def __init__(self):
+        self.pred_iou_thresh = 0.8
+        self.stability_score_thresh = 0.7
+        self.box_nms_thresh = 0.7
+        self.min_mask_region_area = 30
@@ -2,25 +2,77 @@
 
 # Wrapper of SAM-class providing multi-mask prediction and its config.
 
+from src.machine_learning.segmentation.sam.sam_mask_gen_config import BACKENDS
+from src.machine_learning.segmentation.sam.sam_mask_gen_config import ONNX_BACKEND
+from src.machine_learning.segmentation.sam.sam_mask_gen_config import TORCH_BACKEND
+
+import collections
 
 import cv2
 import segment_anything
+import torch
+
+
+class BatchEncodedSamPredictor(segment_anything.SamPredictor):
+    """SamPredictor taking image features encoded for a batch of images beforehand.
+
+    Queued features are consumed one per set_image call, so SamAutomaticMaskGenerator
+    without crop layers decodes masks of the batch images one after another.
+    """
 
+    def __init__(self, sam_model):
+        super().__init__(sam_model)
+        self.queued_features = collections.deque()
 
-class SamAutoMaskGeneratorConfig:
-    def __init__(self):
-        self.pred_iou_thresh = 0.8
-        self.stability_score_thresh = 0.7
-        self.box_nms_thresh = 0.7
-        self.min_mask_region_area = 30
+    @torch.no_grad()
+    def encode_images(self, img_rgbs):
+        """Encodes same size RGB-images in one image encoder pass and queues their features."""
+        transformed_images = []
+        for img_rgb in img_rgbs:
+            transformed_image = torch.as_tensor(self.transform.apply_image(img_rgb), device=self.device)
+            transformed_images.append(self.model.preprocess(
+                transformed_image.permute(2, 0, 1).contiguous()[None, :, :, :]))
+        features = self.model.image_encoder(torch.cat(transformed_images))
+        self.queued_features.extend(features[img_idx:img_idx + 1] for img_idx in range(len(img_rgbs)))
+
+    @torch.no_grad()
+    def set_torch_image(self, transformed_image, original_image_size):
+        if not self.queued_features:
+            super().set_torch_image(transformed_image, original_image_size)
+            return
+        self.reset_image()
+
+        self.original_size = original_image_size
+        self.input_size = tuple(transformed_image.shape[-2:])
+        self.features = self.queued_features.popleft()
+        self.is_image_set = True
 
 
 class SamMultiMaskInference:
     def __init__(self, sam_auto_mask_generator_config,
-        sam_checkpoint='sam_vit_b_01ec64.pth', sam_model_type='vit_b', device='cuda'):
+        sam_checkpoint='sam_vit_b_01ec64.pth', sam_model_type='vit_b', device=None,
+        backend=TORCH_BACKEND, num_threads=None, onnx_dir=None):
+        """Loads SAM model and its automatic mask generator.
+
+        Args:
+          sam_auto_mask_generator_config: SamAutoMaskGeneratorConfig.
+          sam_checkpoint: Path to SAM pth-checkpoint.
+          sam_model_type: SAM model type (vit_h, vit_b, etc.).
+          device: Torch device (CUDA, if available, for None; CPU for ONNX backend).
+          backend: PyTorch or ONNX Runtime (on CPU) encoder and decoder.
+          num_threads: Number of CPU threads of ONNX Runtime sessions.
+          onnx_dir: Folder of exported ONNX models (beside the checkpoint, if None).
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f'Unknown SAM backend {backend}.')
+        if backend == ONNX_BACKEND:
+            device = 'cpu'
+        elif device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
         self.sam_checkpoint = sam_checkpoint
         self.sam_model_type=sam_model_type
         self.device=device
+        self.backend = backend
 
         self.sam_model = segment_anything.sam_model_registry[sam_model_type](
             checkpoint=sam_checkpoint)
@@ -31,12 +83,50 @@ class SamMultiMaskInference:
             stability_score_thresh=sam_auto_mask_generator_config.stability_score_thresh,
             box_nms_thresh=sam_auto_mask_generator_config.box_nms_thresh,
             min_mask_region_area=sam_auto_mask_generator_config.min_mask_region_area)
+        if backend == ONNX_BACKEND:
+            from src.machine_learning.segmentation.sam import sam_onnx
+
+            encoder_path, decoder_path = sam_onnx.get_onnx_model_paths(sam_checkpoint, onnx_dir)
+            self.mask_generator.predictor = sam_onnx.OnnxSamPredictor(
+                self.sam_model, encoder_path, decoder_path, num_threads=num_threads)
+        else:
+            self.mask_generator.predictor = BatchEncodedSamPredictor(self.sam_model)
 
     def generate_all_masks(self, img_rgba):
         # noinspection PyUnresolvedReferences
         img_rgb = cv2.cvtColor(img_rgba, cv2.COLOR_RGBA2RGB)
-        masks = self.mask_generator.generate(img_rgb)
+        return self._get_binary_masks(self.mask_generator.generate(img_rgb))
+
+    def generate_all_masks_batch(self, img_rgbas):
+        """Generates masks of several images encoding same size ones in one batch.
+
+        ONNX encoder takes one image, so its images are encoded one by one.
+
+        Returns:
+          List of binary mask lists per image.
+        """
+        # noinspection PyUnresolvedReferences
+        img_rgbs = [cv2.cvtColor(img_rgba, cv2.COLOR_RGBA2RGB) for img_rgba in img_rgbas]
+        predictor = self.mask_generator.predictor
+        if not isinstance(predictor, BatchEncodedSamPredictor) or len(img_rgbs) == 1:
+            return [self._get_binary_masks(self.mask_generator.generate(img_rgb)) for img_rgb in img_rgbs]
+
+        img_shapes = {}
+        for img_idx, img_rgb in enumerate(img_rgbs):
+            img_shapes.setdefault(img_rgb.shape, []).append(img_idx)
+        all_binary_masks = [None] * len(img_rgbs)
+        for img_indices in img_shapes.values():
+            predictor.encode_images([img_rgbs[img_idx] for img_idx in img_indices])
+            try:
+                for img_idx in img_indices:
+                    all_binary_masks[img_idx] = self._get_binary_masks(
+                        self.mask_generator.generate(img_rgbs[img_idx]))
+            finally:
+                predictor.queued_features.clear()
+        return all_binary_masks
 
+    @staticmethod
+    def _get_binary_masks(masks):
         binary_masks = []
         for mask in  sorted(masks, key=(lambda mask: mask['area']), reverse=True):
             binary_masks.append(mask['segmentation'])
@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+
+# SAM image encoder and mask decoder exported to ONNX and run with ONNX Runtime on CPU.
+
+import logging
+import pathlib
+import warnings
+
+import numpy as np
+import onnxruntime
+import segment_anything
+from segment_anything.utils.onnx import SamOnnxModel
+import torch
+
+
+ONNX_OPSET_VERSION = 17
+
+
+def get_onnx_model_paths(sam_checkpoint, onnx_dir=None):
+    """Gets encoder and decoder ONNX paths beside the checkpoint (or in the folder)."""
+    sam_checkpoint = pathlib.Path(sam_checkpoint)
+    onnx_dir = pathlib.Path(onnx_dir) if onnx_dir else sam_checkpoint.parent
+    return (onnx_dir / f'{sam_checkpoint.stem}.encoder.onnx',
+            onnx_dir / f'{sam_checkpoint.stem}.decoder.onnx')
+
+
+def export_image_encoder(sam_model, encoder_path):
+    """Exports ViT image encoder taking preprocessed 1x3xSxS image."""
+    img_size = sam_model.image_encoder.img_size
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.filterwarnings('ignore', category=torch.jit.TracerWarning)
+        torch.onnx.export(
+            sam_model.image_encoder.cpu().eval(), torch.randn(1, 3, img_size, img_size),
+            str(encoder_path), input_names=['input_image'], output_names=['image_embeddings'],
+            opset_version=ONNX_OPSET_VERSION, do_constant_folding=True)
+
+
+def export_mask_decoder(sam_model, decoder_path):
+    """Exports prompt encoder and mask decoder returning all the mask tokens.
+
+    Batch of prompts shares one image embedding.
+    """
+    onnx_model = SamOnnxModel(sam_model.cpu().eval(), return_single_mask=False)
+    embed_dim = sam_model.prompt_encoder.embed_dim
+    embed_size = sam_model.prompt_encoder.image_embedding_size
+    mask_input_size = [4 * x for x in embed_size]
+    dummy_inputs = {
+        'image_embeddings': torch.randn(1, embed_dim, *embed_size, dtype=torch.float),
+        'point_coords': torch.randint(low=0, high=1024, size=(1, 5, 2), dtype=torch.float),
+        'point_labels': torch.randint(low=0, high=4, size=(1, 5), dtype=torch.float),
+        'mask_input': torch.randn(1, 1, *mask_input_size, dtype=torch.float),
+        'has_mask_input': torch.tensor([0], dtype=torch.float),
+        'orig_im_size': torch.tensor([1500, 2250], dtype=torch.float),
+    }
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.filterwarnings('ignore', category=torch.jit.TracerWarning)
+        torch.onnx.export(
+            onnx_model, tuple(dummy_inputs.values()), str(decoder_path),
+            input_names=list(dummy_inputs.keys()),
+            output_names=['masks', 'iou_predictions', 'low_res_masks'],
+            dynamic_axes={
+                'point_coords': {0: 'num_prompts', 1: 'num_points'},
+                'point_labels': {0: 'num_prompts', 1: 'num_points'},
+            },
+            opset_version=ONNX_OPSET_VERSION, do_constant_folding=True)
+
+
+def create_cpu_session(onnx_path, num_threads=None):
+    session_options = onnxruntime.SessionOptions()
+    session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if num_threads:
+        session_options.intra_op_num_threads = num_threads
+    session_options.inter_op_num_threads = 1
+    return onnxruntime.InferenceSession(
+        str(onnx_path), sess_options=session_options, providers=['CPUExecutionProvider'])
+
+
+class OnnxSamPredictor(segment_anything.SamPredictor):
+    """SamPredictor running image encoder and mask decoder with ONNX Runtime.
+
+    Image transforms, preprocessing and prompt coordinates stay the same,
+    so SamAutomaticMaskGenerator uses it as the PyTorch predictor.
+    """
+
+    def __init__(self, sam_model, encoder_path, decoder_path, num_threads=None):
+        super().__init__(sam_model)
+        for onnx_path, export_fn in ((encoder_path, export_image_encoder),
+                                     (decoder_path, export_mask_decoder)):
+            if not pathlib.Path(onnx_path).is_file():
+                logging.info('Exporting %s.', onnx_path)
+                export_fn(sam_model, onnx_path)
+        self.encoder_session = create_cpu_session(encoder_path, num_threads)
+        self.decoder_session = create_cpu_session(decoder_path, num_threads)
+
+    @torch.no_grad()
+    def set_torch_image(self, transformed_image, original_image_size):
+        self.reset_image()
+
+        self.original_size = original_image_size
+        self.input_size = tuple(transformed_image.shape[-2:])
+        input_image = self.model.preprocess(transformed_image)
+        image_embeddings, = self.encoder_session.run(
+            None, {'input_image': input_image.cpu().numpy().astype(np.float32)})
+        self.features = torch.from_numpy(image_embeddings)
+        self.is_image_set = True
+
+    @torch.no_grad()
+    def predict_torch(self, point_coords, point_labels, boxes=None, mask_input=None,
+                      multimask_output=True, return_logits=False):
+        if not self.is_image_set:
+            raise RuntimeError('An image must be set with .set_image(...) before mask prediction.')
+        if boxes is not None or point_coords is None:
+            raise ValueError('ONNX SAM predictor supports only point prompts.')
+        if mask_input is not None and mask_input.shape[0] > 1:
+            raise ValueError('ONNX SAM predictor supports one mask input shared by prompts.')
+
+        # The exported prompt encoder does not add the padding point of prompts without boxes.
+        point_coords = point_coords.cpu().numpy().astype(np.float32)
+        point_labels = point_labels.cpu().numpy().astype(np.float32)
+        num_prompts = point_coords.shape[0]
+        point_coords = np.concatenate(
+            [point_coords, np.zeros((num_prompts, 1, 2), dtype=np.float32)], axis=1)
+        point_labels = np.concatenate(
+            [point_labels, -np.ones((num_prompts, 1), dtype=np.float32)], axis=1)
+
+        mask_input_size = [4 * x for x in self.model.prompt_encoder.image_embedding_size]
+        has_mask_input = mask_input is not None
+        masks, iou_predictions, low_res_masks = self.decoder_session.run(None, {
+            'image_embeddings': self.features.numpy(),
+            'point_coords': point_coords,
+            'point_labels': point_labels,
+            'mask_input': (
+                mask_input.cpu().numpy().astype(np.float32) if has_mask_input
+                else np.zeros((1, 1, *mask_input_size), dtype=np.float32)),
+            'has_mask_input': np.array([float(has_mask_input)], dtype=np.float32),
+            'orig_im_size': np.array(self.original_size, dtype=np.float32),
+        })
+
+        # The first mask token is the single mask output, the rest are multi-mask ones.
+        mask_slice = slice(1, None) if multimask_output else slice(0, 1)
+        masks = torch.from_numpy(masks[:, mask_slice])
+        if not return_logits:
+            masks = masks > self.model.mask_threshold
+        return (masks, torch.from_numpy(iou_predictions[:, mask_slice]),
+                torch.from_numpy(low_res_masks[:, mask_slice]))
@@ -0,0 +1,300 @@
+#!/usr/bin/python3
+
+# Lightweight stage timers, counters, gauges and histograms of pipelines.
+
+import bisect
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class Histogram:
+    """Cumulative bucket counts of observed values."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def cumulative_counts(self):
+        cumulative_count, cumulative_counts = 0, []
+        for bucket_count in self.bucket_counts:
+            cumulative_count += bucket_count
+            cumulative_counts.append(cumulative_count)
+        return cumulative_counts
+
+    def to_dict(self):
+        return {
+            'count': self.count, 'sum': self.sum, 'max': self.max,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'buckets': dict(zip(
+                [str(bucket) for bucket in self.buckets] + ['+Inf'], self.cumulative_counts())),
+        }
+
+
+class _StageTimer:
+    def __init__(self, metrics, stage_name):
+        self.metrics = metrics
+        self.stage_name = stage_name
+        self.start_time = 0.0
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.metrics.observe_stage(self.stage_name, time.perf_counter() - self.start_time)
+
+
+class _DisabledStageTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class StageMetrics:
+    """Thread-safe registry of pipeline stage metrics."""
+
+    enabled = True
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.start_time = time.time()
+        self.lock = threading.Lock()
+        self.stage_histograms = {}
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def stage(self, stage_name):
+        """Gets context manager measuring duration of the stage."""
+        return _StageTimer(self, stage_name)
+
+    def observe_stage(self, stage_name, duration_in_seconds):
+        with self.lock:
+            if stage_name not in self.stage_histograms:
+                self.stage_histograms[stage_name] = Histogram(self.buckets)
+            self.stage_histograms[stage_name].observe(duration_in_seconds)
+
+    def observe(self, histogram_name, value, buckets=None):
+        with self.lock:
+            if histogram_name not in self.histograms:
+                self.histograms[histogram_name] = Histogram(buckets or self.buckets)
+            self.histograms[histogram_name].observe(value)
+
+    def count(self, counter_name, value=1):
+        with self.lock:
+            self.counters[counter_name] = self.counters.get(counter_name, 0) + value
+
+    def set_gauge(self, gauge_name, value):
+        with self.lock:
+            self.gauges[gauge_name] = value
+
+    def timed_iter(self, iterable, stage_name):
+        """Yields items of the iterable measuring time of getting every item."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(stage_name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def summary(self):
+        with self.lock:
+            return {
+                'uptime_s': time.time() - self.start_time,
+                'stages': {
+                    stage_name: histogram.to_dict()
+                    for stage_name, histogram in sorted(self.stage_histograms.items())},
+                'histograms': {
+                    histogram_name: histogram.to_dict()
+                    for histogram_name, histogram in sorted(self.histograms.items())},
+                'counters': dict(sorted(self.counters.items())),
+                'gauges': dict(sorted(self.gauges.items())),
+            }
+
+    def prometheus_text(self, prefix='small_detect'):
+        """Formats metrics in Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            if self.stage_histograms:
+                stage_metric = f'{prefix}_stage_seconds'
+                lines.append(f'# TYPE {stage_metric} histogram')
+                for stage_name, histogram in sorted(self.stage_histograms.items()):
+                    lines.extend(_format_prometheus_histogram(
+                        stage_metric, histogram, f'stage="{stage_name}"'))
+            for histogram_name, histogram in sorted(self.histograms.items()):
+                histogram_metric = f'{prefix}_{histogram_name}'
+                lines.append(f'# TYPE {histogram_metric} histogram')
+                lines.extend(_format_prometheus_histogram(histogram_metric, histogram))
+            for counter_name, counter_value in sorted(self.counters.items()):
+                lines.append(f'# TYPE {prefix}_{counter_name}_total counter')
+                lines.append(f'{prefix}_{counter_name}_total {counter_value}')
+            for gauge_name, gauge_value in sorted(self.gauges.items()):
+                lines.append(f'# TYPE {prefix}_{gauge_name} gauge')
+                lines.append(f'{prefix}_{gauge_name} {gauge_value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _format_prometheus_histogram(metric_name, histogram, labels=''):
+    label_prefix = labels + ',' if labels else ''
+    lines = [
+        f'{metric_name}_bucket{{{label_prefix}le="{bucket}"}} {cumulative_count}'
+        for bucket, cumulative_count in zip(
+            [str(bucket) for bucket in histogram.buckets] + ['+Inf'],
+            histogram.cumulative_counts())]
+    labels_suffix = f'{{{labels}}}' if labels else ''
+    lines.append(f'{metric_name}_sum{labels_suffix} {histogram.sum}')
+    lines.append(f'{metric_name}_count{labels_suffix} {histogram.count}')
+    return lines
+
+
+class DisabledStageMetrics:
+    """No-op registry used while instrumentation is turned off."""
+
+    enabled = False
+    _disabled_timer = _DisabledStageTimer()
+
+    def stage(self, stage_name):
+        return self._disabled_timer
+
+    def observe_stage(self, stage_name, duration_in_seconds):
+        pass
+
+    def observe(self, histogram_name, value, buckets=None):
+        pass
+
+    def count(self, counter_name, value=1):
+        pass
+
+    def set_gauge(self, gauge_name, value):
+        pass
+
+    def timed_iter(self, iterable, stage_name):
+        return iter(iterable)
+
+    def summary(self):
+        return {}
+
+    def prometheus_text(self, prefix='small_detect'):
+        return ''
+
+
+_active_metrics = DisabledStageMetrics()
+
+
+def get_metrics():
+    """Gets process-wide metrics registry (no-op one, if not enabled)."""
+    return _active_metrics
+
+
+def enable_metrics(buckets=DEFAULT_BUCKETS):
+    global _active_metrics
+    if not _active_metrics.enabled:
+        _active_metrics = StageMetrics(buckets)
+    return _active_metrics
+
+
+def _write_atomically(file_path, text):
+    file_path = pathlib.Path(file_path)
+    tmp_file_path = file_path.with_name(file_path.name + '.tmp')
+    with open(tmp_file_path, 'w') as tmp_file:
+        tmp_file.write(text)
+    os.replace(tmp_file_path, file_path)
+
+
+class MetricsReporter:
+    """Periodically logs JSON summary and writes it with Prometheus textfile."""
+
+    def __init__(self, metrics, json_path=None, prometheus_textfile_path=None,
+                 interval_in_seconds=30.0):
+        self.metrics = metrics
+        self.json_path = json_path
+        self.prometheus_textfile_path = prometheus_textfile_path
+        self.interval_in_seconds = interval_in_seconds
+        self.stopped = threading.Event()
+        self.report_thread = threading.Thread(
+            target=self._report_periodically, name='metrics-reporter', daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        self.report_thread.start()
+
+    def stop(self):
+        """Stops periodic reporting and reports the final metrics."""
+        self.stopped.set()
+        if self.report_thread.is_alive():
+            self.report_thread.join()
+        self.report()
+
+    def _report_periodically(self):
+        while not self.stopped.wait(self.interval_in_seconds):
+            self.report()
+
+    def report(self):
+        summary_json = json.dumps(self.metrics.summary(), sort_keys=True)
+        logging.info('Metrics: %s', summary_json)
+        try:
+            if self.json_path:
+                _write_atomically(self.json_path, summary_json)
+            if self.prometheus_textfile_path:
+                _write_atomically(self.prometheus_textfile_path, self.metrics.prometheus_text())
+        except OSError:
+            logging.exception('Metrics are not written.')
+
+
+def add_metrics_args(parser):
+    """Adds command line arguments enabling metrics reporting."""
+    parser.add_argument('--metrics_json', dest='metrics_json_path',
+                        help='Path to periodically written JSON summary of stage metrics.',
+                        required=False, default=None)
+    parser.add_argument('--prometheus_textfile', dest='prometheus_textfile_path',
+                        help='Path to periodically written Prometheus textfile (*.prom).',
+                        required=False, default=None)
+    parser.add_argument('--metrics_interval', dest='metrics_interval_in_seconds',
+                        help='Seconds between metrics reports.',
+                        required=False, type=float, default=30.0)
+
+
+def start_metrics_reporter(parsed_args):
+    """Enables metrics and starts reporter, if any of metrics outputs is requested.
+
+    Args:
+      parsed_args: Parsed arguments added by add_metrics_args.
+
+    Returns:
+      Started MetricsReporter or None.
+    """
+    if not (parsed_args.metrics_json_path or parsed_args.prometheus_textfile_path):
+        return None
+    metrics_reporter = MetricsReporter(
+        enable_metrics(), json_path=parsed_args.metrics_json_path,
+        prometheus_textfile_path=parsed_args.prometheus_textfile_path,
+        interval_in_seconds=parsed_args.metrics_interval_in_seconds)
+    metrics_reporter.start()
+    return metrics_reporter
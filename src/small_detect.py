@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+
+# The single entry point of small_detect scripts.
+#
+# Usage:
+#   python small_detect.py <subcommand> [<subcommand arguments>]
+#   python small_detect.py <subcommand> --help
+#
+# A subcommand module (and its skimage, wand, cv2, torch or segment_anything
+# dependencies) is imported only when the subcommand runs, so listing
+# subcommands costs no heavy imports. By convention subcommand mains import
+# modules needing wand, torch or segment_anything inside main() after
+# parse_args, so <subcommand> --help needs none of them either.
+
+import os, sys
+SCRIPT_DIRS = os.path.dirname(os.path.abspath(__file__)).split(os.sep)
+sys.path.append(os.path.join(os.sep, *SCRIPT_DIRS[:SCRIPT_DIRS.index('src')]))
+
+import importlib
+import logging
+
+
+PROG_NAME = 'small_detect'
+
+# Subcommand names, their main modules and descriptions.
+SUBCOMMANDS = (
+    ('tile', 'src.img_processing.tiling.tile_breaking_main',
+     'Crop a random tile of an image.'),
+    ('rotate', 'src.img_processing.augmentation.rotate_resize_crop_main',
+     'Rotate, resize and alpha-crop a template image.'),
+    ('overlay', 'src.img_processing.augmentation.adjust_overlay_main',
+     'Overlay a source object image onto a target image.'),
+    ('build-atlas', 'src.machine_learning.datasets.augmentation.source_atlas_main',
+     'Pre-render source objects at a grid of angles and widths.'),
+    ('generate', 'src.machine_learning.datasets.augmentation.src_rotate_resize_to_target_main',
+     'Generate dataset of sources fitted into targets.'),
+    ('merge-partitions', 'src.machine_learning.datasets.augmentation.generation_merge_main',
+     'Merge dataset partitions generated on several nodes.'),
+    ('validate', 'src.machine_learning.datasets.load.masked_src_in_target_load_main',
+     'Validate generated dataset before training.'),
+    ('detect-shadow', 'src.img_processing.detection.shadow.sam_shadow_detection_main',
+     'Detect shadows of a folder with SAM.'),
+    ('sweep-shadow', 'src.img_processing.detection.shadow.shadow_config_sweep_main',
+     'Sweep shadow detection thresholds.'),
+    ('shadow-server', 'src.img_processing.detection.shadow.shadow_detection_server_main',
+     'Serve shadow detection with SAM loaded once.'),
+    ('shadow-client', 'src.img_processing.detection.shadow.shadow_detection_client_main',
+     'Detect shadows of a folder with the running server.'),
+    ('train', 'src.machine_learning.segmentation.matrix2d.cnn_matrix2d_train',
+     'Train SegNet.'),
+    ('export', 'src.machine_learning.segmentation.matrix2d.segnet_export_main',
+     'Export and quantize SegNet.'),
+    ('infer', 'src.machine_learning.segmentation.matrix2d.segnet_tiled_inference_main',
+     'Run tiled SegNet inference on a large image.'),
+)
+
+
+def format_usage():
+    subcommand_name_width = max(len(subcommand_name) for subcommand_name, _, _ in SUBCOMMANDS)
+    return '\n'.join(
+        [f'usage: {PROG_NAME} <subcommand> [<args>]', '', 'subcommands:'] +
+        [f'  {subcommand_name:<{subcommand_name_width}}  {description}'
+         for subcommand_name, _, description in SUBCOMMANDS] +
+        ['', f'Run "{PROG_NAME} <subcommand> --help" for subcommand arguments.'])
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] in ('-h', '--help'):
+        print(format_usage())
+        return os.EX_OK if len(argv) >= 2 else os.EX_USAGE
+
+    subcommand_modules = {
+        subcommand_name: module_name for subcommand_name, module_name, _ in SUBCOMMANDS}
+    module_name = subcommand_modules.get(argv[1])
+    if not module_name:
+        print(f'{PROG_NAME}: unknown subcommand {argv[1]}.\n\n{format_usage()}', file=sys.stderr)
+        return os.EX_USAGE
+
+    # Argument parsers of the subcommand take the program name from sys.argv.
+    subcommand_argv = [f'{PROG_NAME} {argv[1]}'] + argv[2:]
+    sys.argv = subcommand_argv
+    return importlib.import_module(module_name).main(subcommand_argv)
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    sys.exit(main(sys.argv))